@@ -8,6 +8,8 @@ import numpy as np
 import types
 from time import sleep
 
+from precomputed_server import SingleVolumeRegistry, serve
+
 logging.basicConfig(level=logging.DEBUG)
 
 def start_server():
@@ -19,8 +21,11 @@ def start_server():
         arr = np.asarray(arr, dtype=np.uint8)
         vol = CloudVolume.from_numpy(arr, max_mip=1)
     else:
-        logging.info('using mounted dataset')
-        vol = CloudVolume('file:///mnt/data',parallel=2,cache=True)
+        # served by the precomputed server, which caches the chunks 
+        # read from the mount and sends caching headers
+        logging.info('serving mounted dataset with the precomputed server')
+        serve(SingleVolumeRegistry('/mnt/data'), port=1337)
+        return
 
     logging.info('volume created: {}'.format(vol[1,1,1]))
 
@@ -0,0 +1,549 @@
+#! /bin/env python
+
+""" A lightweight static server for all of the precomputed volumes
+of one neuroglancer session.
+
+Each volume is served under its own path prefix, /<cv_name>/...,
+so the confproxy route for a layer points at http://<container>:1337/<cv_name>.
+The volumes of the session are read from the redis hash cvserver:<session_name>
+(cv_name -> path of the precomputed volume) which viewer-launcher fills in
+as layers are added, so layers can be added after the server is started.
+cloudvolume_launcher.py uses the same server for a single volume mounted
+at /mnt/data, see SingleVolumeRegistry.
+
+Supports HTTP range requests and serves gzipped chunks (<chunk>.gz)
+as they are on disk when the client accepts gzip.
+
+Files are read through a ChunkCache: a bounded in-memory LRU cache
+(CHUNK_CACHE_MB) in front of an optional LRU cache on local disk
+(CHUNK_CACHE_DISK_MB, in CHUNK_CACHE_DIR), so that panning back over
+a volume does not go back to the NFS mount. The info files can change
+and are always read from disk. Every file is sent with an ETag and
+Cache-Control: no-cache, so the browser keeps it but checks with
+a conditional request that it did not change, which costs a 304 and no body.
+The paths are not content addressed, so a volume can be rewritten in place
+(e.g. an atlas of a shared atlas server) and must not be cached for longer.
+
+The Prefetcher fills the cache ahead of the viewer, from the scales in
+the info file of each volume: the coarsest scales in full (up to
+PREFETCH_COARSE_MB per volume) when the server starts or a volume is first
+requested, and the chunks next to each requested chunk as the user pans,
+with at most PREFETCH_WORKERS reads in flight. With WARM_CACHE set the
+coarse prefetch continues until the cache is full, which is how the shared
+atlas servers (see viewer-launcher) keep the atlases in memory for every session.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlsplit
+
+import redis
+
+logging.basicConfig(level=logging.INFO)
+
+PORT = 1337
+
+range_regex = re.compile(r'^bytes=(\d*)-(\d*)$')
+chunk_name_regex = re.compile(r'^(\d+)-(\d+)_(\d+)-(\d+)_(\d+)-(\d+)$')
+
+CHUNK_CACHE_MB = int(os.environ.get('CHUNK_CACHE_MB', 256))
+CHUNK_CACHE_DISK_MB = int(os.environ.get('CHUNK_CACHE_DISK_MB', 0))
+CHUNK_CACHE_DIR = os.environ.get('CHUNK_CACHE_DIR', '/tmp/chunk_cache')
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 4))
+PREFETCH_COARSE_MB = int(os.environ.get('PREFETCH_COARSE_MB', 64))
+PREFETCH_MAX_PENDING = 256
+
+""" Files that can change after they are written, which are not cached """
+MUTABLE_FILENAMES = ('info', 'provenance')
+
+CACHE_CONTROL = 'no-cache'
+
+
+class VolumeRegistry(object):
+    """ Maps cv_name -> directory of the precomputed volume for one session """
+    def __init__(self, kv, session_name):
+        self.kv = kv
+        self.session_name = session_name
+        self.volumes = {}
+
+    def get(self, cv_name):
+        if cv_name not in self.volumes:
+            # may have been added since we last looked
+            self.volumes = self.kv.hgetall('cvserver:{}'.format(self.session_name))
+        return self.volumes.get(cv_name)
+
+    def locate(self, parts):
+        """ The volume directory and the path parts within it for a request path """
+        return self.get(parts[0]), parts[1:]
+
+    def volume_roots(self):
+        return list(self.kv.hgetall('cvserver:{}'.format(self.session_name)).values())
+
+
+class SingleVolumeRegistry(object):
+    """ Serves one volume directory at the root path """
+    def __init__(self, volume_root):
+        self.volume_root = volume_root
+
+    def locate(self, parts):
+        return self.volume_root, parts
+
+    def volume_roots(self):
+        return [self.volume_root]
+
+
+def is_mutable(filepath):
+    return os.path.basename(filepath) in MUTABLE_FILENAMES or filepath.endswith('.json')
+
+
+class CachedFile(object):
+    """ A file as it is served: its bytes as stored on disk,
+    whether they are gzipped (read from <chunk>.gz) and its ETag """
+    __slots__ = ('data', 'gzipped', 'etag')
+
+    def __init__(self, data, gzipped, etag):
+        self.data = data
+        self.gzipped = gzipped
+        self.etag = etag
+
+
+def load_file(filepath):
+    """ Read a file, or its gzipped version if there is only that,
+    with one open() on the NFS mount. Returns a CachedFile or None """
+    for path, gzipped in ((filepath, False), (filepath + '.gz', True)):
+        try:
+            with open(path, 'rb') as f:
+                stat_result = os.fstat(f.fileno())
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            continue
+        etag = '{:x}-{:x}'.format(stat_result.st_mtime_ns, stat_result.st_size)
+        return CachedFile(data, gzipped, etag)
+    return None
+
+
+class MemoryTier(object):
+    """ A thread safe LRU cache of CachedFiles, bounded by total size in bytes """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+            return cached
+
+    def put(self, key, cached):
+        if len(cached.data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key).data)
+            self.entries[key] = cached
+            self.total_bytes += len(cached.data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted.data)
+
+
+class DiskTier(object):
+    """ An LRU cache of CachedFiles in a local directory, e.g. on an SSD,
+    bounded by total size in bytes. The directory belongs to this server
+    and is emptied when it starts """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict() # key -> (size, gzipped, etag)
+        self.lock = threading.Lock()
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        _, gzipped, etag = entry
+        try:
+            with open(self.path(key), 'rb') as f:
+                return CachedFile(f.read(), gzipped, etag)
+        except FileNotFoundError: # evicted in the meantime
+            return None
+
+    def put(self, key, cached):
+        size = len(cached.data)
+        if size > self.max_bytes:
+            return
+        path = self.path(key)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(cached.data)
+        os.replace(tmp_path, path)
+        evicted_keys = []
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[0]
+            self.entries[key] = (size, cached.gzipped, cached.etag)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted_key, (evicted_size, _, _) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                evicted_keys.append(evicted_key)
+        for evicted_key in evicted_keys:
+            try:
+                os.remove(self.path(evicted_key))
+            except FileNotFoundError:
+                pass
+
+
+class ChunkCache(object):
+    """ Reads the files of the volumes through a memory tier and,
+    if disk_bytes is given, a local disk tier behind it.
+    A memory_bytes of 0 turns the cache off """
+    def __init__(self, memory_bytes, disk_directory=None, disk_bytes=0):
+        self.memory = MemoryTier(memory_bytes) if memory_bytes else None
+        self.disk = DiskTier(disk_directory, disk_bytes) if memory_bytes and disk_bytes else None
+
+    def full(self):
+        return self.memory is None or self.memory.total_bytes >= self.memory.max_bytes
+
+    def read(self, filepath):
+        """ The file (see load_file()), from the cache if it is there.
+        Returns None if there is no such file """
+        if self.memory is None or is_mutable(filepath):
+            return load_file(filepath)
+        cached = self.memory.get(filepath)
+        if cached is not None:
+            return cached
+        if self.disk is not None:
+            cached = self.disk.get(filepath)
+            if cached is not None:
+                self.memory.put(filepath, cached)
+                return cached
+        cached = load_file(filepath)
+        if cached is not None:
+            self.memory.put(filepath, cached)
+            if self.disk is not None:
+                self.disk.put(filepath, cached)
+        return cached
+
+
+def chunk_name(start, end):
+    """ The file name of a precomputed chunk, e.g. 0-64_0-64_0-32 """
+    return '_'.join('{}-{}'.format(s, e) for s, e in zip(start, end))
+
+
+def scale_chunk_names(scale):
+    """ The file names of all chunks of an unsharded scale of an info file """
+    size, chunk_size = scale['size'], scale['chunk_sizes'][0]
+    offset = scale.get('voxel_offset', [0, 0, 0])
+    ranges = [range(offset[ii], offset[ii] + size[ii], chunk_size[ii]) for ii in range(3)]
+    for z in ranges[2]:
+        for y in ranges[1]:
+            for x in ranges[0]:
+                start = (x, y, z)
+                end = [min(start[ii] + chunk_size[ii], offset[ii] + size[ii]) for ii in range(3)]
+                yield chunk_name(start, end)
+
+
+def neighbour_chunk_names(scale, name):
+    """ The file names of the chunks sharing a face with a chunk of a scale """
+    match = chunk_name_regex.match(name)
+    if match is None:
+        return []
+    bounds = [int(value) for value in match.groups()]
+    start = bounds[0::2]
+    size, chunk_size = scale['size'], scale['chunk_sizes'][0]
+    offset = scale.get('voxel_offset', [0, 0, 0])
+    names = []
+    for axis in range(3):
+        for step in (-1, 1):
+            neighbour_start = list(start)
+            neighbour_start[axis] += step*chunk_size[axis]
+            if not offset[axis] <= neighbour_start[axis] < offset[axis] + size[axis]:
+                continue
+            neighbour_end = [min(neighbour_start[ii] + chunk_size[ii], offset[ii] + size[ii]) \
+                for ii in range(3)]
+            names.append(chunk_name(neighbour_start, neighbour_end))
+    return names
+
+
+class Prefetcher(object):
+    """ Reads chunks into the cache in the background, see the top of this module.
+    Only unsharded scales are prefetched, since the chunks of sharded
+    scales are not separate files """
+    def __init__(self, cache, workers=PREFETCH_WORKERS, coarse_bytes=PREFETCH_COARSE_MB*1024*1024):
+        self.cache = cache
+        self.coarse_bytes = coarse_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.seen_volume_roots = set()
+        self.scales = {} # volume root -> scale key -> scale from the info file
+
+    def volume_scales(self, volume_root):
+        if volume_root not in self.scales:
+            try:
+                with open(os.path.join(volume_root, 'info')) as f:
+                    scales = json.load(f)['scales']
+            except (OSError, ValueError, KeyError):
+                logging.warning('could not read the scales of {}, not prefetching it'.format(volume_root))
+                scales = []
+            self.scales[volume_root] = OrderedDict((scale['key'], scale) for scale in scales \
+                if 'sharding' not in scale and 'chunk_sizes' in scale)
+        return self.scales[volume_root]
+
+    def submit(self, filepath):
+        """ Read a file into the cache in the background,
+        unless it is already queued or too much is queued """
+        with self.lock:
+            if filepath in self.pending or len(self.pending) >= PREFETCH_MAX_PENDING:
+                return
+            self.pending.add(filepath)
+        self.executor.submit(self.fetch, filepath)
+
+    def fetch(self, filepath):
+        try:
+            self.cache.read(filepath)
+        except OSError:
+            logging.debug('could not prefetch {}'.format(filepath))
+        finally:
+            with self.lock:
+                self.pending.discard(filepath)
+
+    def prefetch_coarse(self, volume_root, max_bytes=None):
+        """ Read the coarsest scales of a volume in full,
+        until about max_bytes are read or the cache is full """
+        if max_bytes is None:
+            max_bytes = self.coarse_bytes
+        read_bytes = 0
+        for scale_key, scale in reversed(self.volume_scales(volume_root).items()):
+            for name in scale_chunk_names(scale):
+                if read_bytes >= max_bytes or self.cache.full():
+                    logging.info('prefetched {} MB of {}'.format(read_bytes//(1024*1024), volume_root))
+                    return
+                cached = self.cache.read(os.path.join(volume_root, scale_key, name))
+                if cached is not None:
+                    read_bytes += len(cached.data)
+        logging.info('prefetched all of {}'.format(volume_root))
+
+    def volume_requested(self, volume_root):
+        """ Start the coarse prefetch the first time a volume is requested """
+        with self.lock:
+            if volume_root in self.seen_volume_roots:
+                return
+            self.seen_volume_roots.add(volume_root)
+        self.executor.submit(self.prefetch_coarse, volume_root)
+
+    def chunk_requested(self, volume_root, volume_parts):
+        """ Prefetch the neighbours of a requested chunk in the same scale """
+        self.volume_requested(volume_root)
+        if len(volume_parts) != 2:
+            return
+        scale_key, name = volume_parts
+        scale = self.volume_scales(volume_root).get(scale_key)
+        if scale is None:
+            return
+        for neighbour_name in neighbour_chunk_names(scale, name):
+            self.submit(os.path.join(volume_root, scale_key, neighbour_name))
+
+
+def parse_range(range_header, size):
+    """ Returns (start, end) inclusive for a single byte range,
+    None if there is no range header, or raises ValueError if it is not satisfiable """
+    if not range_header:
+        return None
+    match = range_regex.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        raise ValueError(range_header)
+    start_str, end_str = match.groups()
+    if start_str == '':
+        # suffix range, e.g. bytes=-500 for the last 500 bytes
+        start = max(size - int(end_str), 0)
+        end = size - 1
+    else:
+        start = int(start_str)
+        end = min(int(end_str), size - 1) if end_str else size - 1
+    if start >= size or start > end:
+        raise ValueError(range_header)
+    return start, end
+
+
+class PrecomputedRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    registry = None # set in make_server()
+    cache = ChunkCache(0)
+    prefetcher = None
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def end_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Headers', 'Range, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'Content-Range, Content-Length, Content-Encoding, ETag')
+        BaseHTTPRequestHandler.end_headers(self)
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def resolve(self):
+        """ Returns the volume directory, the path parts within it
+        and the path on disk for the request, or None """
+        parts = [part for part in unquote(urlsplit(self.path).path).split('/') if part]
+        if not parts:
+            return None
+        volume_root, volume_parts = self.registry.locate(parts)
+        if volume_root is None:
+            return None
+        volume_root = os.path.realpath(volume_root)
+        filepath = os.path.realpath(os.path.join(volume_root, *volume_parts))
+        # no escaping the volume with ..
+        if os.path.commonpath([volume_root, filepath]) != volume_root:
+            return None
+        return volume_root, volume_parts, filepath
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.do_GET(head_only=True)
+
+    def do_GET(self, head_only=False):
+        resolved = self.resolve()
+        if resolved is None:
+            return self.send_empty(404)
+        volume_root, volume_parts, filepath = resolved
+        cached = self.cache.read(filepath)
+        if cached is None:
+            return self.send_empty(404)
+        if self.prefetcher is not None:
+            self.prefetcher.chunk_requested(volume_root, volume_parts)
+
+        data = cached.data
+        content_encoding = None
+        etag = cached.etag
+        if cached.gzipped:
+            accepts_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if accepts_gzip and not self.headers.get('Range'):
+                # pass the compressed chunk straight through
+                content_encoding = 'gzip'
+                etag += '-gzip'
+            else:
+                data = gzip.decompress(data)
+        etag = '"{}"'.format(etag)
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', CACHE_CONTROL)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        try:
+            byte_range = parse_range(self.headers.get('Range'), len(data))
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            self.send_response(200)
+            body = data
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+            body = data[start:end+1]
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', CACHE_CONTROL)
+        if cached.gzipped:
+            self.send_header('Vary', 'Accept-Encoding')
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+        if filepath.endswith('info') or filepath.endswith('.json'):
+            self.send_header('Content-Type', 'application/json')
+        else:
+            self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(registry, port=PORT, cache=None, prefetcher=None):
+    if cache is None:
+        cache = ChunkCache(0)
+    handler = type('SessionRequestHandler', (PrecomputedRequestHandler,),
+        {'registry': registry, 'cache': cache, 'prefetcher': prefetcher})
+    return ThreadingHTTPServer(('0.0.0.0', port), handler)
+
+
+def make_chunk_cache():
+    """ The ChunkCache configured in the environment """
+    return ChunkCache(CHUNK_CACHE_MB*1024*1024,
+        disk_directory=CHUNK_CACHE_DIR, disk_bytes=CHUNK_CACHE_DISK_MB*1024*1024)
+
+
+def serve(registry, port=PORT):
+    """ Serve the volumes of the registry until the process is stopped """
+    cache = make_chunk_cache()
+    prefetcher = None
+    if not cache.full() and PREFETCH_WORKERS > 0:
+        prefetcher = Prefetcher(cache)
+        if os.environ.get('WARM_CACHE'):
+            prefetcher.coarse_bytes = cache.memory.max_bytes
+        for volume_root in registry.volume_roots():
+            prefetcher.volume_requested(os.path.realpath(volume_root))
+    server = make_server(registry, port=port, cache=cache, prefetcher=prefetcher)
+    server.serve_forever()
+
+
+def get_session_name(kv):
+    """ The session is either given in the environment or, for a warm container
+    from the viewer-launcher pool, assigned through redis once it is needed """
+    pool_id = os.environ.get('POOL_ID')
+    if pool_id:
+        logging.info('waiting to be assigned to a session as {}'.format(pool_id))
+        _, assignment_json = kv.blpop('pool_assign:{}'.format(pool_id))
+        return json.loads(assignment_json)['session_name']
+    return os.environ['SESSION_NAME']
+
+
+if __name__ == "__main__":
+    kv = redis.Redis(host="redis", decode_responses=True)
+    session_name = get_session_name(kv)
+    logging.info('serving precomputed volumes for session {} on port {}'.format(session_name, PORT))
+    serve(VolumeRegistry(kv, session_name))
@@ -0,0 +1,14 @@
+## pull in required libraries for logging
+import logging
+import sys
+
+
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+formatter = logging.Formatter(FORMAT)
+shandler = logging.StreamHandler(sys.stdout)
+shandler.setFormatter(formatter)
+logging.getLogger("ontology_index").addHandler(shandler)
+logging.getLogger("ontology_index").setLevel(logging.INFO)
+
+
+from .ontology_index import OntologyIndex
@@ -0,0 +1,30 @@
+""" Write the index for an ontology JSON file, e.g. when building
+the ontology neuroglancer images:
+
+    python -m ontology_index.build /opt/allen.json /opt/ontology_index.npz --id-key graph_order --id-offset 1
+"""
+import argparse
+import logging
+
+from .ontology_index import OntologyIndex
+
+logger = logging.getLogger("ontology_index")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("ontology_file", help="nested ontology JSON file")
+    parser.add_argument("index_file", help="where to write the .npz index")
+    parser.add_argument("--id-key", default="id")
+    parser.add_argument("--id-offset", type=int, default=0)
+    args = parser.parse_args()
+
+    index = OntologyIndex.from_json(
+        args.ontology_file, id_key=args.id_key, id_offset=args.id_offset
+    )
+    index.save(args.index_file)
+    logger.info(f"wrote {len(index)} regions to {args.index_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import logging
+import json
+import numpy as np
+
+logger = logging.getLogger("ontology_index")
+
+""" The nodes of the ontology are stored in pre-order (depth first) so that
+the subtree of the node at position i is the contiguous slice i:subtree_end[i].
+Every query below is then an array lookup or a slice, never a walk of the JSON """
+INDEX_ARRAYS = ("ids", "names", "acronyms", "parent", "depth", "subtree_end")
+
+
+class OntologyIndex:
+    def __init__(self, ids, names, acronyms, parent, depth, subtree_end):
+        self.ids = ids
+        self.names = names
+        self.acronyms = acronyms
+        self.parent_position = parent
+        self.depth_array = depth
+        self.subtree_end = subtree_end
+        # the index is shared by every caller, and descendants() returns views into it
+        for array in (ids, names, acronyms, parent, depth, subtree_end):
+            array.flags.writeable = False
+        self._position_of_id = {int(x): ii for ii, x in enumerate(ids)}
+        self._position_of_name = {str(x): ii for ii, x in enumerate(names)}
+
+    @classmethod
+    def from_dict(cls, ontology_dict, id_key="id", id_offset=0):
+        """
+        ---PURPOSE---
+        Build the index from a nested ontology dictionary,
+        e.g. the allen.json or PMA_ontology.json files.
+        ---INPUT---
+        ontology_dict    The root node, with "name", "children" and the id_key
+        id_key           The key holding the id used for each node. The ontology
+                         neuroglancer viewers use the "graph_order" key
+        id_offset        Added to every id, e.g. 1 so that graph_order 0 is not segment 0
+        ---OUTPUT---
+        An OntologyIndex
+        """
+        ids, names, acronyms, parent, depth = [], [], [], [], []
+        stack = [(ontology_dict, -1, 0)]
+        while stack:
+            node, parent_position, node_depth = stack.pop()
+            ids.append(node.get(id_key) + id_offset)
+            names.append(node.get("name"))
+            acronyms.append(node.get("acronym") or "")
+            parent.append(parent_position)
+            depth.append(node_depth)
+            position = len(ids) - 1
+            # reversed so that the children are visited in the order of the file
+            for child in reversed(node.get("children", [])):
+                stack.append((child, position, node_depth + 1))
+
+        parent = np.array(parent, dtype=np.int32)
+        subtree_end = np.arange(1, len(ids) + 1, dtype=np.int32)
+        # in pre-order every child comes after its parent, so going backwards
+        # each subtree is complete before it is folded into its parent
+        for position in range(len(ids) - 1, 0, -1):
+            parent_position = parent[position]
+            subtree_end[parent_position] = max(
+                subtree_end[parent_position], subtree_end[position]
+            )
+        return cls(
+            ids=np.array(ids, dtype=np.int64),
+            names=np.array(names),
+            acronyms=np.array(acronyms),
+            parent=parent,
+            depth=np.array(depth, dtype=np.int16),
+            subtree_end=subtree_end,
+        )
+
+    @classmethod
+    def from_json(cls, ontology_file, **kwargs):
+        with open(ontology_file) as json_file:
+            ontology_dict = json.load(json_file)
+        return cls.from_dict(ontology_dict, **kwargs)
+
+    @classmethod
+    def load(cls, index_file):
+        """ Load an index written by save() """
+        with np.load(index_file, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in INDEX_ARRAYS})
+
+    def save(self, index_file):
+        np.savez_compressed(
+            index_file,
+            ids=self.ids,
+            names=self.names,
+            acronyms=self.acronyms,
+            parent=self.parent_position,
+            depth=self.depth_array,
+            subtree_end=self.subtree_end,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, region_id):
+        return int(region_id) in self._position_of_id
+
+    def position(self, region_id):
+        return self._position_of_id[int(region_id)]
+
+    def id_of(self, name):
+        """ The id of a region name, None if there is no such region """
+        position = self._position_of_name.get(name)
+        if position is None:
+            return None
+        return int(self.ids[position])
+
+    def name(self, region_id):
+        return str(self.names[self.position(region_id)])
+
+    def acronym(self, region_id):
+        return str(self.acronyms[self.position(region_id)])
+
+    def depth(self, region_id):
+        return int(self.depth_array[self.position(region_id)])
+
+    def parent(self, region_id):
+        """ The id of the parent of a region, None for the root """
+        parent_position = self.parent_position[self.position(region_id)]
+        if parent_position < 0:
+            return None
+        return int(self.ids[parent_position])
+
+    def ancestors(self, region_id):
+        """ The ids from the parent of a region up to the root """
+        ancestor_ids = []
+        parent_position = self.parent_position[self.position(region_id)]
+        while parent_position >= 0:
+            ancestor_ids.append(int(self.ids[parent_position]))
+            parent_position = self.parent_position[parent_position]
+        return ancestor_ids
+
+    def children(self, region_id):
+        """ The ids of the direct children of a region, in file order """
+        position = self.position(region_id)
+        end = self.subtree_end[position]
+        child_ids = []
+        child_position = position + 1
+        while child_position < end:
+            child_ids.append(int(self.ids[child_position]))
+            child_position = self.subtree_end[child_position]
+        return child_ids
+
+    def descendants(self, region_id):
+        """ The ids of all descendants of a region (not including itself),
+        as a read only view into the index """
+        position = self.position(region_id)
+        return self.ids[position + 1 : self.subtree_end[position]]
+
+    def descendant_names(self, region_id):
+        position = self.position(region_id)
+        return [str(x) for x in self.names[position + 1 : self.subtree_end[position]]]
+
+    def is_descendant(self, region_id, ancestor_id):
+        """ Whether region_id is strictly below ancestor_id in the hierarchy """
+        position = self.position(region_id)
+        ancestor_position = self.position(ancestor_id)
+        return ancestor_position < position < self.subtree_end[ancestor_position]
@@ -1,10 +1,35 @@
 from os import environ
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
+import time
 import requests
 import json
 
 logger = logging.getLogger("progproxy")
 
+""" One keep-alive HTTP session per proxy, shared by all progproxy objects
+in the process since callers usually make a new object for each request """
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+""" The last route table read from each proxy: target -> (time read, routes dict) """
+_route_cache = {}
+_route_cache_lock = threading.Lock()
+
+
+def get_session(target, pool_maxsize=16):
+    with _sessions_lock:
+        if target not in _sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_maxsize
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[target] = session
+        return _sessions[target]
+
 
 class progproxy(object):
     def __init__(
@@ -13,45 +38,96 @@ class progproxy(object):
         target_port="8001",
         key=environ["CONFIGPROXY_AUTH_TOKEN"],
         target_protocol="http",
+        max_workers=8,
     ):
         logger.debug("Programable Proxy Object Created")
         self.target = f"{target_protocol}://{target_hname}:{target_port}"
         self.headers = {"Authorization": f"token {key}"}
+        self.max_workers = max_workers
+        self.session = get_session(self.target, pool_maxsize=max(max_workers, 1))
         logger.debug(f"Target set to {self.target}")
         logger.debug(f"header set to {self.headers}")
 
+    def invalidate_cache(self):
+        with _route_cache_lock:
+            _route_cache.pop(self.target, None)
+
     def addroute(self, proxypath, proxytarget):
         logger.debug(f"adding path {proxypath} pointing to {proxytarget}")
         req_data = {"target": proxytarget}
-        response = requests.post(
+        response = self.session.post(
             f"{self.target}/api/routes/{proxypath}", data=json.dumps(req_data), headers=self.headers
         )
+        self.invalidate_cache()
         if response.status_code == 204 or response.status_code == 201:
             logger.debug("path added successfully")
-        else:
-            logger.warn(
-                f"failed to add proxy path {proxypath} pointing to {proxytarget}"
-            )
-            logger.debug(f"requests returned: {response}")
+            return True
+        logger.warn(
+            f"failed to add proxy path {proxypath} pointing to {proxytarget}"
+        )
+        logger.debug(f"requests returned: {response}")
+        return False
 
     def deleteroute(self, proxypath):
         logger.debug(f"removing proxy path {proxypath}")
-        response = requests.delete(f"{self.target}/api/routes{proxypath}",headers=self.headers)
+        response = self.session.delete(f"{self.target}/api/routes{proxypath}",headers=self.headers)
+        self.invalidate_cache()
         if response.status_code != 204:
             logger.warn(f"removal of {proxypath} failed")
             logger.debug(f"requests returned: {response}")
-        else:
-            logger.debug(f"{proxypath} removed")
+            return False
+        logger.debug(f"{proxypath} removed")
+        return True
+
+    def _map(self, func, *iterables):
+        """ Run func over the arguments with at most max_workers requests in flight """
+        arg_lists = [list(iterable) for iterable in iterables]
+        if not arg_lists or not arg_lists[0]:
+            return []
+        max_workers = min(len(arg_lists[0]), self.max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(func, *arg_lists))
+
+    def addroutes(self, routes):
+        """ Add many routes concurrently.
+        routes is a dict of proxypath -> proxytarget.
+        Returns a dict of proxypath -> whether it was added """
+        proxypaths = list(routes.keys())
+        results = self._map(self.addroute, proxypaths, [routes[proxypath] for proxypath in proxypaths])
+        return dict(zip(proxypaths, results))
+
+    def deleteroutes(self, proxypaths):
+        """ Delete many routes concurrently, with the proxypaths
+        as they appear in the route table, e.g. /viewers/<session_name>.
+        Returns a dict of proxypath -> whether it was deleted """
+        proxypaths = list(proxypaths)
+        results = self._map(self.deleteroute, proxypaths)
+        return dict(zip(proxypaths, results))
 
     def getroutes(self,inactive_since=None):
         """ inactive_since is a ISO 8601 timestamp, e.g.:
         2020-01-28T18:11:57.026018 """
         logger.debug("getting configured routes")
         if inactive_since is not None:
-            response = requests.get(f"{self.target}/api/routes?inactive_since={inactive_since}",headers=self.headers)
+            response = self.session.get(f"{self.target}/api/routes?inactive_since={inactive_since}",headers=self.headers)
         else:
-            response = requests.get(f"{self.target}/api/routes",headers=self.headers)
+            response = self.session.get(f"{self.target}/api/routes",headers=self.headers)
 
         logger.debug(f"current routes: {response.text}")
 
         return response
+
+    def routes(self, max_age=5):
+        """ The route table as a dict, from the in-process cache if it was
+        read less than max_age seconds ago and no route was added or deleted
+        through progproxy since. Use getroutes() when the last_activity
+        of the routes needs to be current. """
+        now = time.time()
+        with _route_cache_lock:
+            cached = _route_cache.get(self.target)
+        if cached is not None and now - cached[0] < max_age:
+            return cached[1]
+        route_dict = json.loads(self.getroutes().text)
+        with _route_cache_lock:
+            _route_cache[self.target] = (now, route_dict)
+        return route_dict
@@ -37,11 +37,123 @@ class BaseConfig(object):
 	'princeton_mouse_atlas':'/jukebox/LightSheetTransfer/atlas/annotation_sagittal_atlas_20um_iso_16bit.tif',
 	'paxinos':'/jukebox/LightSheetTransfer/atlas/kim_atlas/KimRef_annotation_volume_4brainpipe.tif'
 	}
+	# The ontology of each annotation volume, in lightserv/data, and the precomputed layer
+	# of each atlas. Used to build the hierarchy levels of the atlases, see ontology/atlas_levels.py
+	ATLAS_ONTOLOGY_FILE_DICTIONARY = {
+	'allen_2017':'allen_ontology.json',
+	'allen_pre2017':'allen_ontology.json',
+	'princeton_mouse_atlas':'PMA_ontology.json'
+	}
+	ATLAS_PRECOMPUTED_DIRECTORY_DICTIONARY = {
+	'allen_2017':'/jukebox/LightSheetTransfer/atlas/neuroglancer/atlas/allenatlas_2017',
+	'princeton_mouse_atlas':'/jukebox/LightSheetTransfer/atlas/neuroglancer/atlas/princetonmouse',
+	'paxinos':'/jukebox/LightSheetTransfer/atlas/neuroglancer/atlas/kimatlas'
+	}
+	# Local disk where the atlas tifs are converted to memory mappable .npy files, see ontology/atlas_store.py
+	ATLAS_STORE_DIR = os.environ.get('ATLAS_STORE_DIR','/tmp/lightserv_atlas_store')
 	PROCESSING_CODE_DIR = '/jukebox/wang/ahoag/brainpipe'
+	SPOCK_SSH_POOL_SIZE = 2 # max number of ssh connections to spock kept open by each worker process
+	SPOCK_SSH_KEEPALIVE_SECONDS = 30 
+	# Where spock jobs are run: 'spock' or 'fake_slurm' (in-process fake for load testing, see processing/cluster.py)
+	CLUSTER_BACKEND = os.environ.get('CLUSTER_BACKEND','spock')
+	FAKE_SLURM_QUEUE_SECONDS = (0,10) # (min,max) seconds a fake job stays PENDING
+	FAKE_SLURM_DURATION_SECONDS = (5,30) # (min,max) seconds a fake job stays RUNNING
+	FAKE_SLURM_FAILURE_RATE = 0.0
+	# Which step of the light sheet pipeline each precomputed pipeline waits on.
+	# When the status checker sees one of these steps complete it sends an event to start the pipeline.
+	# 'downsized':2 can be added to also make the downsized precomputed data
+	PRECOMPUTED_PIPELINE_TRIGGER_STEPS = {
+		'blending':1,
+		'registered':3
+	}
+	# How far back check_for_spock_jobs_ready_for_making_precomputed_data() looks 
+	# for jobs whose precomputed pipelines were never started
+	PRECOMPUTED_READY_CHECK_WINDOW_HOURS = 72
+	# Pipeline events go to their own queue so they are not stuck behind long running tasks
+	CELERY_ROUTES = {
+		'lightserv.processing.tasks.start_precomputed_pipeline': {'queue':'pipeline_events'},
+	}
 	DJ_SAFEMODE = True
 	dj.config['safemode'] = DJ_SAFEMODE
 	CELERY_ENABLE_UTC = False
 	CELERY_TIMEZONE = os.environ['TZ']
+	# The status checkers that spock_job_status_poller() hands the sacct statuses to.
+	# spock_dbtable_str says which spock table to look in for outstanding jobs for each checker
+	SPOCK_JOB_STATUS_HANDLERS = [
+		dict(task='lightserv.processing.tasks.processing_spock_job_status_checker',
+			spock_dbtable_str='ProcessingPipelineSpockJob',
+			kwargs={'reg':True}),
+		dict(task='lightserv.processing.tasks.processing_spock_job_status_checker',
+			spock_dbtable_str='ProcessingPipelineSpockJob',
+			kwargs={'reg':False}),
+		dict(task='lightserv.imaging.tasks.check_raw_precomputed_statuses',
+			spock_dbtable_str='RawPrecomputedSpockJob',
+			kwargs={}),
+		dict(task='lightserv.processing.tasks.precomputed_spock_job_status_checker',
+			spock_dbtable_str='BlendedPrecomputedSpockJob',
+			kwargs=dict(
+				spock_dbtable_str='BlendedPrecomputedSpockJob',
+				lightsheet_dbtable_str='Request.ProcessingChannel',
+				lightsheet_column_name='blended_precomputed_spock_jobid',
+				max_step_index=2)),
+		dict(task='lightserv.processing.tasks.precomputed_spock_job_status_checker',
+			spock_dbtable_str='RegisteredPrecomputedSpockJob',
+			kwargs=dict(
+				spock_dbtable_str='RegisteredPrecomputedSpockJob',
+				lightsheet_dbtable_str='Request.ProcessingChannel',
+				lightsheet_column_name='registered_precomputed_spock_jobid',
+				max_step_index=1)),
+		dict(task='lightserv.processing.tasks.smartspim_corrected_precomputed_job_status_checker',
+			spock_dbtable_str='SmartspimCorrectedPrecomputedSpockJob',
+			kwargs={}),
+		dict(task='lightserv.processing.tasks.smartspim_spock_job_status_checker',
+			spock_dbtable_str='SmartspimStitchingSpockJob',
+			kwargs=dict(
+				spock_dbtable_str='SmartspimStitchingSpockJob',
+				lightsheet_dbtable_str='Request.SmartspimStitchedChannel',
+				lightsheet_column_name='smartspim_stitching_spock_jobid',
+				max_step_index=3)),
+		dict(task='lightserv.processing.tasks.smartspim_spock_job_status_checker',
+			spock_dbtable_str='SmartspimDependentStitchingSpockJob',
+			kwargs=dict(
+				spock_dbtable_str='SmartspimDependentStitchingSpockJob',
+				lightsheet_dbtable_str='Request.SmartspimStitchedChannel',
+				lightsheet_column_name='smartspim_stitching_spock_jobid',
+				max_step_index=2)),
+		dict(task='lightserv.processing.tasks.smartspim_spock_job_status_checker',
+			spock_dbtable_str='SmartspimPystripeSpockJob',
+			kwargs=dict(
+				spock_dbtable_str='SmartspimPystripeSpockJob',
+				lightsheet_dbtable_str='Request.SmartspimPystripeChannel',
+				lightsheet_column_name='smartspim_pystripe_spock_jobid',
+				max_step_index=0)),
+	]
+	# How long a setup route waits for a neuroglancer container to report its viewer token
+	NG_VIEWER_LAUNCH_TIMEOUT_SECONDS = 60
+	# How many confproxy routes of a session are added or deleted at the same time
+	NG_LAUNCH_MAX_WORKERS = 8
+	NG_VIEWER_EXPIRE_SECONDS = 5*60
+	# How long the redis keys of a session outlive its last activity. 
+	# Must be longer than NG_VIEWER_EXPIRE_SECONDS plus the ng_viewer_checker interval
+	# so that the checker can still find the containers to take down
+	NG_SESSION_TTL_SECONDS = 2*NG_VIEWER_EXPIRE_SECONDS
+	# Budget for the containers of the neuroglancer sessions, see neuroglancer/scheduler.py.
+	# Launches that do not fit wait in line for up to NG_ADMISSION_TIMEOUT_SECONDS
+	NG_MAX_CONTAINERS = 60
+	NG_MAX_CONTAINERS_PER_USER = 12
+	NG_MAX_MEMORY_MB = 64000
+	NG_MAX_MEMORY_MB_PER_USER = 12000
+	# Estimated memory of each kind of container in MB, not measured
+	NG_CONTAINER_MEMORY_MB = {
+		'neuroglancer':1000,
+		'cvserver':500
+	}
+	NG_ADMISSION_TIMEOUT_SECONDS = 120
+	# Sessions idle for this long may be taken down early to make room for new ones
+	NG_SESSION_IDLE_SECONDS = 10*60
+
+	# Precomputed layers of the annotation volume remapped to a collapsed ontology
+	ONTOLOGY_REMAP_DIR = '/jukebox/LightSheetTransfer/atlas/ontology_remaps'
 
 
 class DevConfig(BaseConfig):
@@ -50,6 +162,7 @@ class DevConfig(BaseConfig):
 	SECRET_KEY = os.environ.get('SECRET_KEY')
 	DATA_BUCKET_ROOTPATH = '/jukebox/LightSheetData/lightserv_pnilsadmin_testing'
 	NG_VIEWER_EXPIRE_SECONDS = 5*60 # seconds time that a neuroglancer viewer and its cloudvolumes are allowed to stay up 
+	NG_SESSION_TTL_SECONDS = 2*NG_VIEWER_EXPIRE_SECONDS
 	SPOCK_LSADMIN_USERNAME = 'lightserv-test'
 	CELERY_ACKS_LATE = True
 	CELERYBEAT_SCHEDULE = {
@@ -146,84 +259,29 @@ class ProdConfig(BaseConfig):
 	SECRET_KEY = os.environ.get('SECRET_KEY')
 	DATA_BUCKET_ROOTPATH = '/jukebox/LightSheetData/lightserv'
 	NG_VIEWER_EXPIRE_SECONDS = 43200 # 6 hours - time that a neuroglancer viewer and its cloudvolumes are allowed to stay up 
+	NG_SESSION_TTL_SECONDS = 2*NG_VIEWER_EXPIRE_SECONDS
 	SPOCK_LSADMIN_USERNAME = 'lightserv-test'
 
 	CELERYBEAT_SCHEDULE = {
-		'processing_job_status_checker': {
-		'task': 'lightserv.processing.tasks.processing_spock_job_status_checker',
-		'schedule': timedelta(minutes=10),
-		'kwargs':{'reg':True}
-		},
-		'processing_job_status_checker_noreg': {
-		'task': 'lightserv.processing.tasks.processing_spock_job_status_checker',
-		'schedule': timedelta(minutes=60),
-		'kwargs':{'reg':False}
+		'spock_job_status_poller': {
+		'task': 'lightserv.processing.tasks.spock_job_status_poller',
+		'schedule': timedelta(minutes=10)
 		},
 		'ng_viewer_cleanser': {
 		'task': 'lightserv.neuroglancer.tasks.ng_viewer_checker',
 		'schedule': timedelta(hours=1)
 		},
-		'rawprecomp_job_status_checker': {
-		'task': 'lightserv.imaging.tasks.check_raw_precomputed_statuses',
-		'schedule': timedelta(minutes=10)
-		},
+		# Recovers step completed events that were lost, e.g. if the broker or worker failed 
+		# after the new status was stored. Only looks at the current status of jobs 
+		# that changed in the last PRECOMPUTED_READY_CHECK_WINDOW_HOURS
 		'precomputed_job_ready_checker': {
 		'task': 'lightserv.processing.tasks.check_for_spock_jobs_ready_for_making_precomputed_data',
-		'schedule': timedelta(minutes=30)
-		},
-		'blended_precomp_job_status_checker': {
-		'task': 'lightserv.processing.tasks.precomputed_spock_job_status_checker',
-		'schedule': timedelta(minutes=15),
-		'kwargs':dict(
-			spock_dbtable_str='BlendedPrecomputedSpockJob',
-			lightsheet_dbtable_str='Request.ProcessingChannel',
-			lightsheet_column_name='blended_precomputed_spock_jobid',
-			max_step_index=2)
-		},
-		'registered_precomp_job_status_checker': {
-		'task': 'lightserv.processing.tasks.precomputed_spock_job_status_checker',
-		'schedule': timedelta(minutes=15),
-		'kwargs':dict(
-			spock_dbtable_str='RegisteredPrecomputedSpockJob',
-			lightsheet_dbtable_str='Request.ProcessingChannel',
-			lightsheet_column_name='registered_precomputed_spock_jobid',
-			max_step_index=1)
-		},
-		'smartspim_corrected_precomputed_job_status_checker': {
-		'task': 'lightserv.processing.tasks.smartspim_corrected_precomputed_job_status_checker',
-		'schedule': timedelta(minutes=10)
+		'schedule': timedelta(hours=1)
 		},
 		'LightSheetData_storage_capacity_checker': {
 		'task': 'lightserv.main.tasks.check_lightsheetdata_storage',
 		'schedule': crontab(hour=8, minute=30) # 8:30 AM every day
 		},
-		'smartspim_stitching_job_status_checker': {
-		'task': 'lightserv.processing.tasks.smartspim_spock_job_status_checker',
-		'schedule': timedelta(minutes=15),
-		'kwargs':dict(
-			spock_dbtable_str='SmartspimStitchingSpockJob',
-			lightsheet_dbtable_str='Request.SmartspimStitchedChannel',
-			lightsheet_column_name='smartspim_stitching_spock_jobid',
-			max_step_index=3)
-		},
-		'smartspim_dependent_stitching_job_status_checker': {
-		'task': 'lightserv.processing.tasks.smartspim_spock_job_status_checker',
-		'schedule': timedelta(minutes=20),
-		'kwargs':dict(
-			spock_dbtable_str='SmartspimDependentStitchingSpockJob',
-			lightsheet_dbtable_str='Request.SmartspimStitchedChannel',
-			lightsheet_column_name='smartspim_stitching_spock_jobid',
-			max_step_index=2)
-		},
-		'smartspim_pystripe_job_status_checker': {
-		'task': 'lightserv.processing.tasks.smartspim_spock_job_status_checker',
-		'schedule': timedelta(minutes=20),
-		'kwargs':dict(
-			spock_dbtable_str='SmartspimPystripeSpockJob',
-			lightsheet_dbtable_str='Request.SmartspimPystripeChannel',
-			lightsheet_column_name='smartspim_pystripe_spock_jobid',
-			max_step_index=0)
-		},
 		
 	}
 
@@ -1,4 +1,5 @@
 from flask import Blueprint, render_template
+from lightserv.neuroglancer.utils import ViewerLaunchError
 
 errors = Blueprint('errors',__name__)
 
@@ -14,4 +15,8 @@ def error_403(error):
 
 @errors.app_errorhandler(500)
 def error_500(error):
-	return render_template('errors/500.html'), 500	
\ No newline at end of file
+	return render_template('errors/500.html'), 500	
+
+@errors.app_errorhandler(ViewerLaunchError)
+def error_viewer_launch(error):
+	return render_template('errors/viewer_launch.html'), 504
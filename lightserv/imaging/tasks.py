@@ -5,11 +5,12 @@ import pickle
 import math
 import paramiko
 import logging
-import datajoint as dj
 from lightserv import cel, db_spockadmin, db_lightsheet, smtp_connect
-from lightserv.processing.utils import determine_status_code
-from lightserv.main.tasks import (send_email,send_admin_email,
-	connect_to_spock)
+from lightserv.processing.utils import (ongoing_codes,
+	get_active_spock_job_contents,fetch_sacct_statuses,make_job_insert_dict,
+	insert_spock_jobs)
+from lightserv.main.tasks import send_email,send_admin_email
+from lightserv.processing.cluster import get_cluster_backend
 from email.message import EmailMessage
 
 logger = logging.getLogger(__name__)
@@ -94,13 +95,10 @@ def make_precomputed_rawdata(**kwargs):
 		# command = "cd /jukebox/wang/ahoag/precomputed/testing; ./test_pipeline.sh "
 		# command = "cd /jukebox/wang/ahoag/precomputed/testing; ./test_fail_pipeline.sh "
 
-	client = connect_to_spock()
-	stdin, stdout, stderr = client.exec_command(command)
-
 	try:
-		response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
-		logger.debug(response)
-		jobid_step0, jobid_step1, jobid_step2 = response.split('\n')
+		jobids, error_response = get_cluster_backend().submit(command,n_steps=3)
+		logger.debug(jobids)
+		jobid_step0, jobid_step1, jobid_step2 = jobids
 	except:
 		if lightsheet == 'left':
 			imaging_channel_update_dict = this_imaging_channel_content.fetch1()
@@ -124,7 +122,7 @@ def make_precomputed_rawdata(**kwargs):
 				'status_step1':status_step1,'status_step2':status_step2
 				}
 
-	db_spockadmin.RawPrecomputedSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.RawPrecomputedSpockJob,[entry_dict])    
 	logger.info(f"Precomputed (Raw data) job inserted into RawPrecomputedSpockJob() table: {entry_dict}")
 	logger.info(f"Precomputed (Raw data) job successfully submitted to spock, jobid_step2: {jobid_step2}")
 	try:
@@ -143,7 +141,7 @@ def make_precomputed_rawdata(**kwargs):
 	return f"Submitted jobid: {jobid_step2}"
 
 @cel.task()
-def check_raw_precomputed_statuses():
+def check_raw_precomputed_statuses(sacct_status_dict=None):
 	""" 
 	Checks all outstanding precomputed job statuses on spock
 	and updates their status in the SpockJobManager() in db_spockadmin
@@ -158,99 +156,47 @@ def check_raw_precomputed_statuses():
 	set the processing_progress in the ProcessingRequest() 
 	table to 'failed'. If all jobs completed, then set 
 	processing_progress to 'complete'
+
+	sacct_status_dict is passed in when this is run
+	as a handler by spock_job_status_poller(). 
+	Otherwise the statuses of all steps are fetched here in a single sacct query.
 	"""
 
 	""" First get all rows with latest timestamps """
-	# return "made it"
-	job_contents = db_spockadmin.RawPrecomputedSpockJob()
-	unique_contents = dj.U('jobid_step2','username',).aggr(
-		job_contents,timestamp='max(timestamp)')*job_contents
+	unique_contents = get_active_spock_job_contents(
+		db_spockadmin.RawPrecomputedSpockJob)
 	
-	# """ Get a list of all jobs we need to check up on, i.e.
-	# those that could conceivably change. Also list the problematic_codes
-	# which will be used later for error reporting to the user.
-	# """
-
-	problematic_codes = ("FAILED","BOOT_FAIL","CANCELLED","DEADLINE","OUT_OF_MEMORY","REVOKED")
-	# static_codes = ('COMPLETED','FAILED','BOOT_FAIL','CANCELLED','DEADLINE','OUT_OF_MEMORY','REVOKED')
-	ongoing_codes = ('SUBMITTED','RUNNING','PENDING','REQUEUED','RESIZING','SUSPENDED')
+	""" Get a list of all jobs we need to check up on, i.e.
+	those that could conceivably change. """
 	incomplete_contents = unique_contents & f'status_step2 in {ongoing_codes}'
-	# logger.debug(incomplete_contents)
-	jobids = list(incomplete_contents.fetch('jobid_step2'))
-	if jobids == []:
+	outstanding_job_dicts = incomplete_contents.fetch(
+		'username','lightsheet','jobid_step0','jobid_step1','jobid_step2',
+		'status_step0','status_step1',as_dict=True)
+	if outstanding_job_dicts == []:
 		return "No jobs to check"
-	jobids_str = ','.join(str(jobid) for jobid in jobids)
-	logger.debug(f"Outstanding job ids are: {jobids}")
+	logger.debug("Outstanding job ids are: {}".format(
+		[job_dict['jobid_step2'] for job_dict in outstanding_job_dicts]))
+	
+	if sacct_status_dict is None:
+		all_step_jobids = [job_dict[f'jobid_step{ii}'] for job_dict in outstanding_job_dicts \
+			for ii in range(3)]
+		sacct_status_dict = fetch_sacct_statuses(all_step_jobids)
+		if sacct_status_dict is None:
+			return "Error fetching job statuses from spock"
 	
-	client = connect_to_spock()
-	logger.debug("connected to spock")
-	logger.debug("")
-	command = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(jobids_str)
-	stdin, stdout, stderr = client.exec_command(command)
-	stdout_str = stdout.read().decode("utf-8")
-	try:
-		response_lines = stdout_str.strip('\n').split('\n')
-		jobids_received = [x.split('|')[0].split('_')[0] for x in response_lines]
-		status_codes_received = [x.split('|')[1] for x in response_lines]
-	except:
-		logger.debug("Something went wrong parsing output of precomputed sacct query on spock")
-		client.close()
-		return "Error parsing sacct query of precomputed jobid on spock"
-	logger.debug("jobids_received:")
-	logger.debug(jobids_received)
-	job_status_indices_dict = {jobid:[i for i, x in enumerate(jobids_received) if x == jobid] for jobid in set(jobids_received)} 
 	job_insert_list = []
-	for jobid,indices_list in job_status_indices_dict.items():
+	for job_dict in outstanding_job_dicts:
+		jobid = job_dict['jobid_step2']
 		logger.debug(f"In loop for jobid: {jobid}")
-		job_insert_dict = {'jobid_step2':jobid}
-		status_codes = [status_codes_received[ii] for ii in indices_list]
-		status_step2 = determine_status_code(status_codes)
+		if jobid not in sacct_status_dict:
+			logger.debug(f"No status returned by sacct for jobid={jobid}. Skipping")
+			continue
+		job_insert_dict = make_job_insert_dict(job_dict,2,sacct_status_dict)
+		status_step2 = job_insert_dict['status_step2']
 		logger.debug("Summary status code:")
 		logger.debug(status_step2)
-		job_insert_dict['status_step2'] = status_step2
-		""" Find the username, other jobids associated with this jobid """
-		username_thisjob,lightsheet_thisjob,jobid_step0,jobid_step1 = (
-			unique_contents & f'jobid_step2={jobid}').fetch1(
-			'username','lightsheet','jobid_step0','jobid_step1')
+		lightsheet_thisjob = job_insert_dict['lightsheet']
 		logger.debug(f"Lightsheet is: {lightsheet_thisjob}")
-		job_insert_dict['username']=username_thisjob
-		job_insert_dict['jobid_step0']=jobid_step0
-		job_insert_dict['jobid_step1']=jobid_step1
-		jobid_step_dict = {'step0':jobid_step0,'step1':jobid_step1}
-
-		""" Now figure out the status codes for the earlier dependency jobs """
-		this_run_earlier_jobids_str = ','.join([jobid_step0,jobid_step1])
-		try:
-			command_earlier_steps = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(this_run_earlier_jobids_str)
-			stdin_earlier_steps, stdout_earlier_steps, stderr_earlier_steps = client.exec_command(command_earlier_steps)
-		except:
-			logger.debug("Something went wrong fetching steps 0 and 1 job statuses from spock.")
-			client.close()
-			return "Error fetching steps 0,1 job statuses from spock"
-		stdout_str_earlier_steps = stdout_earlier_steps.read().decode("utf-8")
-		logger.debug(stdout_str_earlier_steps)
-		try:
-			response_lines_earlier_steps = stdout_str_earlier_steps.strip('\n').split('\n')
-			jobids_received_earlier_steps = [x.split('|')[0].split('_')[0] for x in response_lines_earlier_steps] # They will be listed as array jobs, e.g. 18521829_[0-5], 18521829_1 depending on their status
-			status_codes_received_earlier_steps = [x.split('|')[1] for x in response_lines_earlier_steps]
-		except:
-			logger.debug("Something went wrong parsing output of sacct query for steps 0,1 on spock")
-			client.close()
-			return "Error parsing sacct query of jobids for steps 0,1 on spock"
-
-		job_status_indices_dict_earlier_steps = {jobid:[i for i, x in enumerate(jobids_received_earlier_steps) \
-			if x == jobid] for jobid in set(jobids_received_earlier_steps)} 
-		""" Loop through the earlier steps and figure out their statuses """
-		for step_counter in range(2):
-		# for jobid_earlier_step,indices_list_earlier_step in job_status_indices_dict_earlier_steps.items():
-			step = f'step{step_counter}'
-			jobid_earlier_step = jobid_step_dict[step]
-			indices_list_earlier_step = job_status_indices_dict_earlier_steps[jobid_earlier_step]
-			status_codes_earlier_step = [status_codes_received_earlier_steps[ii] for ii in indices_list_earlier_step]
-			status_this_step = determine_status_code(status_codes_earlier_step)
-			status_step_str = f'status_step{step_counter}'
-			job_insert_dict[status_step_str] = status_this_step
-		job_insert_dict['lightsheet'] = lightsheet_thisjob
 		job_insert_list.append(job_insert_dict)
 		""" Get the imaging channel entry associated with this jobid
 		and update the progress """
@@ -341,12 +287,11 @@ def check_raw_precomputed_statuses():
 			if not os.environ['FLASK_MODE'] == 'TEST':
 				# send_email.delay(subject=subject,body=body,recipients=recipients)
 				send_admin_email.delay(subject=subject,body=admin_body)
-		db_spockadmin.RawPrecomputedSpockJob.insert1(job_insert_dict)
+		insert_spock_jobs(db_spockadmin.RawPrecomputedSpockJob,[job_insert_dict])
 
 	# logger.debug("Insert list:")
 	# logger.debug(job_insert_list)
 	# db_spockadmin.RawPrecomputedSpockJob.insert(job_insert_list)
-	client.close()
 
 	return "checked statuses"
 	
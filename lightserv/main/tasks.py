@@ -3,14 +3,15 @@ from flask import (render_template, request, redirect,
 				   Markup, Request, Response,jsonify,
                    current_app)
 from lightserv import db_lightsheet, db_admin, db_spockadmin, cel, smtp_connect
-from lightserv.main.utils import logged_in, table_sorter, log_http_requests
+from lightserv.main.utils import (logged_in, table_sorter, log_http_requests,
+	get_spock_connection_pool)
 from functools import partial, wraps
 
 import datajoint as dj
 import requests
 
 import logging
-import paramiko,time
+import time
 import os
 from datetime import datetime, timedelta
 from email.message import EmailMessage
@@ -33,18 +34,43 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 logger.addHandler(file_handler)
 
-def connect_to_spock():
+def get_configured_spock_connection_pool():
+	""" Get this process's spock connection pool, created with 
+	SPOCK_SSH_POOL_SIZE and SPOCK_SSH_KEEPALIVE_SECONDS from the config.
+	Everything that uses the pool should get it from here, since whichever 
+	caller creates the pool first decides its settings.
+	"""
 	hostname = 'spock.pni.princeton.edu'
 	
 	spock_username = current_app.config['SPOCK_LSADMIN_USERNAME']
 	port = 22
 
-	client = paramiko.SSHClient()
-	client.load_system_host_keys()
-	client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
-	client.connect(hostname, port=port, username=spock_username, allow_agent=False,look_for_keys=True)
+	pool = get_spock_connection_pool(hostname,spock_username,port=port,
+		max_connections=current_app.config['SPOCK_SSH_POOL_SIZE'],
+		keepalive_seconds=current_app.config['SPOCK_SSH_KEEPALIVE_SECONDS'])
+	return pool
+
+def connect_to_spock():
+	""" Get a connection to spock from this process's connection pool.
+	The returned client can be used like a paramiko.SSHClient,
+	but client.close() hands the connection back to the pool 
+	so the next task does not have to do the ssh handshake again.
+	"""
+	pool = get_configured_spock_connection_pool()
+	client = pool.acquire()
 	return client
 
+@cel.task()
+def spock_connection_pool_stats():
+	""" Report the hit/miss/reconnect counts of the spock
+	connection pool. Each prefork worker child has its own pool,
+	so these are only the stats of whichever child process ran this task,
+	not of the whole worker. """
+	pool = get_configured_spock_connection_pool()
+	stats = pool.get_stats()
+	logger.info(f"spock connection pool stats (pid {os.getpid()}): {stats}")
+	return stats
+
 @cel.task()
 def send_email(subject,body,sender_email='lightservhelper@gmail.com',recipients=['ahoag@princeton.edu']):
 	""" Send an automated email to one or more email addresses.
@@ -1,6 +1,8 @@
 from flask import session,request,url_for,redirect, flash, current_app
 from functools import wraps
 import os,time
+import socket
+import threading
 from lightserv import db_lightsheet, db_admin
 import datajoint as dj
 import paramiko
@@ -651,4 +653,198 @@ def db_table_determiner(schema_str,dbtable_str):
 	dbtable    - the datajoint table object ready to use for queries, etc..
 	"""
 	dbtable = eval(f'{schema_str}.{dbtable_str}')
-	return dbtable
\ No newline at end of file
+	return dbtable
+class SpockConnectionPool(object):
+	""" 
+	---PURPOSE---
+	Keeps authenticated ssh connections to spock open 
+	so that tasks do not need to do a full handshake every time they
+	run a command on spock. Commands are run on separate channels 
+	over the same connection, so a connection can be used by more than one
+	task at a time. Keepalives are sent so the connections do not get dropped 
+	while idle. A connection that dies is dropped from the pool and each 
+	task using it gets a new one, see discard().
+
+	The ssh handshakes are done outside of the lock, 
+	so a slow connect does not hold up tasks using the open connections.
+
+	One pool exists per process, see get_spock_connection_pool()
+	---INPUT---
+	hostname              - the host to connect to, e.g. 'spock.pni.princeton.edu'
+	username              - the user to connect as
+	port                  - ssh port
+	max_connections       - maximum number of connections to keep open
+	max_channels          - number of channels per connection before another connection is opened 
+	keepalive_seconds     - interval for sending keepalive packets 
+	"""
+	def __init__(self,hostname,username,port=22,
+		max_connections=2,max_channels=8,keepalive_seconds=30):
+		self.hostname = hostname
+		self.username = username
+		self.port = port
+		self.max_connections = max_connections
+		self.max_channels = max_channels
+		self.keepalive_seconds = keepalive_seconds
+		self.lock = threading.Lock()
+		self.changed = threading.Condition(self.lock) # notified when a connect finishes
+		# list of dicts like {'client':paramiko.SSHClient,'n_users':int,'dead':bool}
+		self.connections = [] 
+		self.n_connecting = 0 # connects in progress, counted against max_connections
+		self.stats = {'hits':0,'misses':0,'reconnects':0,'dropped':0}
+
+	def _connect(self):
+		client = paramiko.SSHClient()
+		client.load_system_host_keys()
+		client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
+		client.connect(self.hostname, port=self.port, username=self.username,
+			allow_agent=False,look_for_keys=True)
+		client.get_transport().set_keepalive(self.keepalive_seconds)
+		return client
+
+	@staticmethod
+	def _is_alive(client):
+		transport = client.get_transport()
+		return transport is not None and transport.is_active()
+
+	def _drop(self,connection):
+		""" Take a connection out of the pool. Must hold the lock. 
+		The client is closed by the last task using it, see release() """
+		connection['dead'] = True
+		self.connections.remove(connection)
+		self.stats['dropped'] += 1
+		if connection['n_users'] == 0:
+			connection['client'].close()
+
+	def acquire_connection(self):
+		""" Get a connection of the pool (a dict with the client),
+		reusing an open connection if possible. 
+		Every connection acquired must be handed back with release() """
+		with self.lock:
+			while True:
+				for connection in self.connections[:]:
+					if not self._is_alive(connection['client']):
+						logger.debug("Dropping dead connection to spock from pool")
+						self._drop(connection)
+				connection = min(self.connections,key=lambda x: x['n_users'],default=None)
+				at_capacity = len(self.connections) + self.n_connecting >= self.max_connections
+				if connection is not None and \
+					(connection['n_users'] < self.max_channels or at_capacity):
+					self.stats['hits'] += 1
+					connection['n_users'] += 1
+					logger.debug(f"spock connection pool stats: {self.get_stats()}")
+					return connection
+				if not at_capacity:
+					self.n_connecting += 1
+					break
+				# every slot is taken by a connect that has not finished
+				self.changed.wait()
+		client = None
+		try:
+			client = self._connect()
+		finally:
+			with self.lock:
+				self.n_connecting -= 1
+				if client is not None:
+					connection = {'client':client,'n_users':1,'dead':False}
+					self.connections.append(connection)
+					self.stats['misses'] += 1
+				self.changed.notify_all()
+		logger.debug(f"spock connection pool stats: {self.get_stats()}")
+		return connection
+
+	def acquire(self):
+		""" Get a PooledSpockClient. Reuses an open connection if possible """
+		return PooledSpockClient(self,self.acquire_connection())
+
+	def release(self,connection):
+		""" Hand a connection back to the pool. 
+		Closes it if it was dropped from the pool and this was its last user """
+		with self.lock:
+			connection['n_users'] = max(connection['n_users']-1,0)
+			if connection['dead'] and connection['n_users'] == 0:
+				connection['client'].close()
+
+	def discard(self,connection):
+		""" Drop a connection that failed from the pool and hand it back.
+		The other tasks using it find out when their next command fails 
+		and acquire a new connection themselves """
+		with self.lock:
+			if not connection['dead']:
+				self.connections.remove(connection)
+				connection['dead'] = True
+				self.stats['reconnects'] += 1
+		self.release(connection)
+
+	def get_stats(self):
+		""" Hit/miss/reconnect counts and how many connections 
+		and channels are currently in use """
+		stats = self.stats.copy()
+		stats['open_connections'] = len(self.connections)
+		stats['users'] = sum(connection['n_users'] for connection in self.connections)
+		return stats
+
+	def close_all(self):
+		with self.lock:
+			for connection in self.connections:
+				connection['dead'] = True
+				connection['client'].close()
+			self.connections = []
+
+class PooledSpockClient(object):
+	""" 
+	Wraps a paramiko.SSHClient from a SpockConnectionPool.
+	Can be used just like the client, e.g. client.exec_command(command),
+	except that close() hands the connection back to the pool 
+	instead of closing it. If the connection was dropped,
+	exec_command() gets a new connection from the pool and tries again once.
+	"""
+	def __init__(self,pool,connection):
+		self._pool = pool
+		self._connection = connection
+		self._client = connection['client']
+
+	def exec_command(self,command,**kwargs):
+		try:
+			return self._client.exec_command(command,**kwargs)
+		except (paramiko.SSHException,EOFError,socket.error):
+			logger.info("Connection to spock was dropped. Reconnecting")
+			self._pool.discard(self._connection)
+			self._connection = None
+			self._client = None
+			self._connection = self._pool.acquire_connection()
+			self._client = self._connection['client']
+			return self._client.exec_command(command,**kwargs)
+
+	def close(self):
+		if self._connection is not None:
+			self._pool.release(self._connection)
+			self._connection = None
+			self._client = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+	def __getattr__(self,name):
+		return getattr(self._client,name)
+
+_spock_connection_pools = {}
+
+def get_spock_connection_pool(hostname,username,port=22,**pool_kwargs):
+	""" 
+	---PURPOSE---
+	Get the SpockConnectionPool for this process. 
+	The process id is part of the key so that celery worker processes 
+	forked from a parent that already had a pool open do not share its sockets.
+	---INPUT---
+	hostname,username,port and pool_kwargs are passed to SpockConnectionPool()
+	---OUTPUT---
+	pool     - SpockConnectionPool() instance
+	"""
+	key = (os.getpid(),hostname,username,port)
+	if key not in _spock_connection_pools:
+		_spock_connection_pools[key] = SpockConnectionPool(hostname=hostname,
+			username=username,port=port,**pool_kwargs)
+	return _spock_connection_pools[key]
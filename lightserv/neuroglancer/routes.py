@@ -1,9 +1,8 @@
 from flask import (render_template, request, redirect,
                    Blueprint, session, url_for, flash,
-                   Markup, Request, Response,abort, current_app)
+                   Markup, Request, Response,abort, current_app, jsonify)
 import redis
 import logging
-import time
 import secrets
 import os
 import requests
@@ -22,7 +21,10 @@ from lightserv.main.utils import (check_imaging_completed,
     check_imaging_request_precomputed,log_http_requests,
     check_some_precomputed_pipelines_completed,logged_in,
     table_sorter,logged_in_as_admin)
-from .tasks import ng_viewer_checker
+from .tasks import ng_viewer_checker, start_neuroglancer_session
+from .scheduler import SessionScheduler
+from .utils import (launch_cloudvolume, wait_for_viewer,
+    get_redis, launch_status_key, serve_atlas_levels, ONTOLOGY_PMA_VIEWER_ATLAS)
 import progproxy as pp
 
 from functools import partial
@@ -76,9 +78,8 @@ def raw_data_setup(username,request_name,sample_name,imaging_request_number):
             kv = redis.Redis(host="testredis", decode_responses=True)
         else:
             kv = redis.Redis(host="redis", decode_responses=True)
-        hosturl = os.environ['HOSTURL'] # via dockerenv
         data_bucket_rootpath = current_app.config['DATA_BUCKET_ROOTPATH']
-        neuroglancer_url_dict = {}
+        neuroglancer_session_dict = {}
         cv_table_dict = {}
         if form.validate_on_submit():
             logger.debug("Form validated")
@@ -89,7 +90,7 @@ def raw_data_setup(username,request_name,sample_name,imaging_request_number):
                 # session_name = 'my_ng_session'
                 viewer_id = "viewer1" # for storing the viewer info in redis
                 # kv.hmset(session_name,{"viewer_id":viewer_id})
-                kv.hmset(session_name,{"cv_count":0}) # initialize the number of cloudvolumes in this ng session
+                cv_dict_list = [] # the cloudvolumes to launch in this ng session
 
                 # Set up environment to be shared by all cloudvolumes
                 cv_environment = {
@@ -102,7 +103,7 @@ def raw_data_setup(username,request_name,sample_name,imaging_request_number):
                 cv_number = 0 # to keep track of how many cloudvolumes in this viewer
                 image_resolution_form = form.image_resolution_forms[ii]
                 image_resolution = image_resolution_form.image_resolution.data
-                neuroglancer_url_dict[image_resolution] = {}
+                neuroglancer_session_dict[image_resolution] = {}
                 cv_contents_dict_list_this_resolution = []
                 """ Loop through channels and spawn a cloudvolume 
                 within this session for each light sheet used """
@@ -169,69 +170,23 @@ def raw_data_setup(username,request_name,sample_name,imaging_request_number):
                         cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                             cv_container_name=cv_container_name,
                             layer_type=layer_type,session_name=session_name)
-                        requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                        logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-                        """ Enter the cv information into redis
-                        so I can get it from within the neuroglancer container """
-                        kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                            f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})
-                        # increment the number of cloudvolumes so it is up to date
-                        kv.hincrby(session_name,'cv_count',1)
-                        # register with the confproxy so that it can be seen from outside the nglancer network
-                        proxy_h = pp.progproxy(target_hname='confproxy')
-                        proxypath = os.path.join('cloudvols',session_name,cv_name)
-                        proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                        cv_dict['cv_number'] = cv_number
+                        cv_dict_list.append(cv_dict)
                         cv_contents_dict_list_this_resolution.append(cv_contents_dict_this_lightsheet)
                 cv_table = MultiLightSheetCloudVolumeLayerTable(cv_contents_dict_list_this_resolution)
                 cv_table_dict[image_resolution] = cv_table
                 """ Now spawn a neuroglancer container which will make
                 layers for each of the spawned cloudvolumes """
-                ng_container_name = f'{session_name}_ng_container'
-                ng_dict = {}
-                ng_dict['hosturl'] = hosturl
-                ng_dict['ng_container_name'] = ng_container_name
-                ng_dict['session_name'] = session_name
-                """ send the data to the viewer-launcher
-                to launch the ng viewer """                       
-                
-                requests.post('http://viewer-launcher:5005/ng_raw_launcher',json=ng_dict)
-                logger.debug("Made post request to viewer-launcher to launch ng raw viewer")
-                
-                # Add the ng container name to redis session key level
-                kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-                proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                    proxytarget=f"http://{ng_container_name}:8080/")
-                logger.debug(f"Added {ng_container_name} to redis and confproxy")
-                # Add the ng container name to redis session key level
-                kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-                proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                    proxytarget=f"http://{ng_container_name}:8080/")
-
-                # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-                while True:
-                    session_dict = kv.hgetall(session_name)
-                    if 'viewer' in session_dict.keys():
-                        break
-                    else:
-                        logger.debug("Still spinning; waiting for redis entry for neuroglancer viewer")
-                        time.sleep(0.25)
-                viewer_json_str = kv.hgetall(session_name)['viewer']
-                viewer_dict = json.loads(viewer_json_str)
-                logging.debug(f"Redis contents for viewer")
-                logging.debug(viewer_dict)
-                proxy_h.getroutes()
-                # logger.debug("Proxy contents:")
-                # logger.debug(proxy_contents)
-                
-                neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-                neuroglancer_url_dict[image_resolution] = neuroglancerurl
-                logger.debug(neuroglancerurl)
+                """ Launch the cloudvolumes and the neuroglancer viewer in the background.
+                The page polls for the link to the viewer while they start """
+                payload = {'session_name':session_name,'cv_dict_list':cv_dict_list,
+                    'ng_launcher':'ng_raw_launcher','url_scheme':'http'}
+                start_neuroglancer_session(kv,payload)
+                neuroglancer_session_dict[image_resolution] = session_name
+                logger.debug(f"Launching neuroglancer session {session_name}")
             return render_template('neuroglancer/viewer_links.html',
                 datatype='raw',
-                url_dict=neuroglancer_url_dict,cv_table_dict=cv_table_dict)
+                session_dict=neuroglancer_session_dict,cv_table_dict=cv_table_dict)
 
         else: # form not validated
             flash("There were errors below. Correct them in order to proceed.",'danger')
@@ -376,7 +331,6 @@ def general_data_setup(username,request_name,sample_name,
         logger.debug('POST request')
         # Redis setup for this session
         
-        hosturl = os.environ['HOSTURL'] # via .dockerenv
         data_bucket_rootpath = current_app.config['DATA_BUCKET_ROOTPATH']
 
         if form.validate_on_submit():
@@ -387,7 +341,7 @@ def general_data_setup(username,request_name,sample_name,
             spawning cloudvolumes where necessary"""
             
             kv = redis.Redis(host="redis", decode_responses=True)
-            neuroglancer_url_dict = OrderedDict({
+            neuroglancer_session_dict = OrderedDict({
                 'Raw':{},
                 'Stitched':{},
                 'Blended':{},
@@ -432,7 +386,8 @@ def general_data_setup(username,request_name,sample_name,
                     session_name = secrets.token_hex(6)
                     viewer_id = "viewer1" # for storing the viewer info in redis. Only ever one per session
                     # initialize this redis session key
-                    kv.hmset(session_name,{"cv_count":0,"cvs_need_atlas":""}) 
+                    cv_dict_list = [] # the cloudvolumes to launch in this ng session
+                    cvs_need_atlas = ""
                     cv_number = 0 # to keep track of how many cloudvolumes in this viewer/session
                     """ Loop through channels and spawn a cloudvolume 
                     within this session for each light sheet used """
@@ -498,60 +453,28 @@ def general_data_setup(username,request_name,sample_name,
                             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                                 cv_container_name=cv_container_name,
                                 layer_type=layer_type,session_name=session_name)
-                            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                            logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-                            """ Enter the cv information into redis
-                            so I can get it from within the neuroglancer container """
-                            kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                                f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})
-                            # increment the number of cloudvolumes so it is up to date
-                            kv.hincrby(session_name,'cv_count',1)
-                            # register with the confproxy so that it can be seen from outside the nglancer network
-                            proxy_h = pp.progproxy(target_hname='confproxy')
-                            proxypath = os.path.join('cloudvols',session_name,cv_name)
-                            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                            cv_dict['cv_number'] = cv_number
+                            cv_dict_list.append(cv_dict)
                             cv_contents_dict_list_this_resolution.append(cv_contents_dict_this_lightsheet)
                     cv_table = MultiLightSheetCloudVolumeLayerTable(cv_contents_dict_list_this_resolution)
                     cv_table_dict['Raw'][image_resolution] = cv_table
                     """ Raw data neuroglancer container """
-                    ng_container_name = f'{session_name}_ng_container'
-                    ng_dict = {}
-                    ng_dict['hosturl'] = hosturl
-                    ng_dict['ng_container_name'] = ng_container_name
-                    ng_dict['session_name'] = session_name
-                    """ send the data to the viewer-launcher
-                    to launch the ng viewer """                       
-                    requests.post('http://viewer-launcher:5005/ng_raw_launcher',json=ng_dict)                    
-                    """ Add the ng container name to redis session key level """
-                    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                    """ Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network """
-                    proxy_h.addroute(proxypath=f'viewers/{session_name}', proxytarget=f"http://{ng_container_name}:8080/")
-
-                    """ Spin until the neuroglancer viewer token from redis becomes available 
-                    (may be waiting on the neuroglancer container to finish writing to redis) """
-                    while True:
-                        session_dict = kv.hgetall(session_name)
-                        if 'viewer' in session_dict.keys():
-                            break
-                        else:
-                            logger.debug("Still spinning; waiting for redis entry for neuroglancer viewer")
-                            time.sleep(0.25)
-                    viewer_json_str = kv.hgetall(session_name)['viewer']
-                    viewer_dict = json.loads(viewer_json_str)
-                    response=proxy_h.getroutes()
-                    
-                    neuroglancerurl = f"https://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-                    neuroglancer_url_dict['Raw'][image_resolution] = neuroglancerurl
-                    logger.debug("URL IS:")
-                    logger.debug(neuroglancerurl)
+                    """ Launch the cloudvolumes and the neuroglancer viewer in the background.
+                    The page polls for the link to the viewer while they start """
+                    payload = {'session_name':session_name,'cv_dict_list':cv_dict_list,
+                        'ng_launcher':'ng_raw_launcher','url_scheme':'https',
+                        'session_fields':{'cvs_need_atlas':cvs_need_atlas}}
+                    start_neuroglancer_session(kv,payload)
+                    neuroglancer_session_dict['Raw'][image_resolution] = session_name
+                    logger.debug(f"Launching neuroglancer session {session_name}")
 
                 """ Stitched data """
                 if any(any_stitched_channels):
                     session_name = secrets.token_hex(6)
                     viewer_id = "viewer1" # for storing the viewer info in redis. Only ever one per session
                     # initialize this redis session key
-                    kv.hmset(session_name,{"cv_count":0,"cvs_need_atlas":""}) 
+                    cv_dict_list = [] # the cloudvolumes to launch in this ng session
+                    cvs_need_atlas = ""
                     cv_number = 0 # to keep track of how many cloudvolumes in this viewer/session
                     """ Loop through channels and spawn a cloudvolume 
                     within this session for each light sheet used """
@@ -595,51 +518,18 @@ def general_data_setup(username,request_name,sample_name,
                             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                                 cv_container_name=cv_container_name,
                                 layer_type=layer_type,session_name=session_name)
-                            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                            logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-                            """ Enter the cv information into redis
-                            so I can get it from within the neuroglancer container """
-                            kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                                f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})
-                            # increment the number of cloudvolumes so it is up to date
-                            kv.hincrby(session_name,'cv_count',1)
-                            # register with the confproxy so that it can be seen from outside the nglancer network
-                            proxy_h = pp.progproxy(target_hname='confproxy')
-                            proxypath = os.path.join('cloudvols',session_name,cv_name)
-                            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                            cv_dict['cv_number'] = cv_number
+                            cv_dict_list.append(cv_dict)
                 
                     """ Stitched data neuroglancer container """
-                    ng_container_name = f'{session_name}_ng_container'
-                    ng_dict = {}
-                    ng_dict['hosturl'] = hosturl
-                    ng_dict['ng_container_name'] = ng_container_name
-                    ng_dict['session_name'] = session_name
-                    """ send the data to the viewer-launcher
-                    to launch the ng viewer """                       
-                    requests.post('http://viewer-launcher:5005/ng_raw_launcher',json=ng_dict)                    
-                    """ Add the ng container name to redis session key level """
-                    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                    """ Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network """
-                    proxy_h.addroute(proxypath=f'viewers/{session_name}', proxytarget=f"http://{ng_container_name}:8080/")
-
-                    """ Spin until the neuroglancer viewer token from redis becomes available 
-                    (may be waiting on the neuroglancer container to finish writing to redis) """
-                    while True:
-                        session_dict = kv.hgetall(session_name)
-                        if 'viewer' in session_dict.keys():
-                            break
-                        else:
-                            logger.debug("Still spinning; waiting for redis entry for neuroglancer viewer")
-                            time.sleep(0.25)
-                    viewer_json_str = kv.hgetall(session_name)['viewer']
-                    viewer_dict = json.loads(viewer_json_str)
-                    response=proxy_h.getroutes()
-                    
-                    neuroglancerurl = f"https://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-                    neuroglancer_url_dict['Stitched'][image_resolution] = neuroglancerurl
-                    logger.debug("URL IS:")
-                    logger.debug(neuroglancerurl)
+                    """ Launch the cloudvolumes and the neuroglancer viewer in the background.
+                    The page polls for the link to the viewer while they start """
+                    payload = {'session_name':session_name,'cv_dict_list':cv_dict_list,
+                        'ng_launcher':'ng_raw_launcher','url_scheme':'https',
+                        'session_fields':{'cvs_need_atlas':cvs_need_atlas}}
+                    start_neuroglancer_session(kv,payload)
+                    neuroglancer_session_dict['Stitched'][image_resolution] = session_name
+                    logger.debug(f"Launching neuroglancer session {session_name}")
 
                 """ Blended data """
                 if any(any_blended_channels):
@@ -649,7 +539,8 @@ def general_data_setup(username,request_name,sample_name,
                     session_name = secrets.token_hex(6)
                     viewer_id = "viewer1" # for storing the viewer info in redis. Only ever one per session
                     # initialize this redis session key
-                    kv.hmset(session_name,{"cv_count":0,"cvs_need_atlas":""}) 
+                    cv_dict_list = [] # the cloudvolumes to launch in this ng session
+                    cvs_need_atlas = ""
                     cv_number = 0 # to keep track of how many cloudvolumes in this viewer/session
                     """ Loop through channels and spawn a cloudvolume 
                     within this session for each light sheet used """
@@ -722,54 +613,19 @@ def general_data_setup(username,request_name,sample_name,
                         cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                             cv_container_name=cv_container_name,
                             layer_type=layer_type,session_name=session_name)
-                        requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                        logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-                        """ Enter the cv information into redis
-                        so I can get it from within the neuroglancer container """
-
-                        kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                            f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})                    
-                        kv.hincrby(session_name,'cv_count',1)
-                        
-                        """ register with the confproxy so that the cloudvolume
-                        can be seen from outside the docker network """
-                        
-                        proxy_h = pp.progproxy(target_hname='confproxy')
-                        proxypath = os.path.join('cloudvols',session_name,cv_name)
-                        proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                        cv_dict['cv_number'] = cv_number
+                        cv_dict_list.append(cv_dict)
                         cv_contents_dict_list_this_resolution.append(cv_contents_dict_this_channel)
                     cv_table = CloudVolumeLayerTable(cv_contents_dict_list_this_resolution)
                     cv_table_dict['Blended'][image_resolution] = cv_table
                     """ Blended data neuroglancer container """
-                    ng_container_name = f'{session_name}_ng_container'
-                    ng_dict = {}
-                    ng_dict['hosturl'] = hosturl
-                    ng_dict['ng_container_name'] = ng_container_name
-                    ng_dict['session_name'] = session_name
-                    """ send the data to the viewer-launcher
-                    to launch the ng viewer """                       
-                    requests.post('http://viewer-launcher:5005/nglauncher',json=ng_dict)                    
-                    """ Add the ng container name to redis session key level """
-                    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                    """ Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network """
-                    proxy_h.addroute(proxypath=f'viewers/{session_name}', proxytarget=f"http://{ng_container_name}:8080/")
-
-                    """ Spin until the neuroglancer viewer token from redis becomes available 
-                    (may be waiting on the neuroglancer container to finish writing to redis) """
-                    while True:
-                        session_dict = kv.hgetall(session_name)
-                        if 'viewer' in session_dict.keys():
-                            break
-                        else:
-                            logger.debug("Still spinning; waiting for redis entry for neuroglancer viewer")
-                            time.sleep(0.25)
-                    viewer_json_str = kv.hgetall(session_name)['viewer']
-                    viewer_dict = json.loads(viewer_json_str)
-                    response=proxy_h.getroutes()
-                    
-                    neuroglancerurl = f"https://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-                    neuroglancer_url_dict['Blended'][image_resolution] = neuroglancerurl
+                    """ Launch the cloudvolumes and the neuroglancer viewer in the background.
+                    The page polls for the link to the viewer while they start """
+                    payload = {'session_name':session_name,'cv_dict_list':cv_dict_list,
+                        'ng_launcher':'nglauncher','url_scheme':'https',
+                        'session_fields':{'cvs_need_atlas':cvs_need_atlas}}
+                    start_neuroglancer_session(kv,payload)
+                    neuroglancer_session_dict['Blended'][image_resolution] = session_name
 
                 """ Downsized data """
                 if any(any_downsized_channels):
@@ -779,7 +635,8 @@ def general_data_setup(username,request_name,sample_name,
                     session_name = secrets.token_hex(6)
                     viewer_id = "viewer1" # for storing the viewer info in redis. Only ever one per session
                     # initialize this redis session key
-                    kv.hmset(session_name,{"cv_count":0,"cvs_need_atlas":""}) 
+                    cv_dict_list = [] # the cloudvolumes to launch in this ng session
+                    cvs_need_atlas = ""
                     cv_number = 0 # to keep track of how many cloudvolumes in this viewer/session
                     """ Loop through channels and spawn a cloudvolume 
                     within this session for each light sheet used """
@@ -848,56 +705,20 @@ def general_data_setup(username,request_name,sample_name,
                         cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                             cv_container_name=cv_container_name,
                             layer_type=layer_type,session_name=session_name)
-                        requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                        logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-                        """ Enter the cv information into redis
-                        so I can get it from within the neuroglancer container """
-
-                        kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                            f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})                    
-                        kv.hincrby(session_name,'cv_count',1)
-                        
-                        """ register with the confproxy so that the cloudvolume
-                        can be seen from outside the docker network """
-                        
-                        proxy_h = pp.progproxy(target_hname='confproxy')
-                        proxypath = os.path.join('cloudvols',session_name,cv_name)
-                        proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                        cv_dict['cv_number'] = cv_number
+                        cv_dict_list.append(cv_dict)
                         cv_contents_dict_list_this_resolution.append(cv_contents_dict_this_channel)
                     cv_table = CloudVolumeLayerTable(cv_contents_dict_list_this_resolution)
                     cv_table_dict['Downsized'][image_resolution] = cv_table
                     """ Downsized data neuroglancer container """
-                    ng_container_name = f'{session_name}_ng_container'
-                    ng_dict = {}
-                    ng_dict['hosturl'] = hosturl
-                    ng_dict['ng_container_name'] = ng_container_name
-                    ng_dict['session_name'] = session_name
-                    """ send the data to the viewer-launcher
-                    to launch the ng viewer """                       
-                    requests.post('http://viewer-launcher:5005/nglauncher',json=ng_dict)                    
-                    """ Add the ng container name to redis session key level """
-                    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                    """ Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network """
-                    proxy_h.addroute(proxypath=f'viewers/{session_name}', proxytarget=f"http://{ng_container_name}:8080/")
-
-                    """ Spin until the neuroglancer viewer token from redis becomes available 
-                    (may be waiting on the neuroglancer container to finish writing to redis) """
-                    while True:
-                        session_dict = kv.hgetall(session_name)
-                        if 'viewer' in session_dict.keys():
-                            break
-                        else:
-                            logger.debug("Still spinning; waiting for redis entry for neuroglancer viewer")
-                            time.sleep(0.25)
-                    viewer_json_str = kv.hgetall(session_name)['viewer']
-                    viewer_dict = json.loads(viewer_json_str)
-                    response=proxy_h.getroutes()
-                    
-                    neuroglancerurl = f"https://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-                    neuroglancer_url_dict['Downsized'][image_resolution] = neuroglancerurl
-                    logger.debug("URL IS:")
-                    logger.debug(neuroglancerurl)
+                    """ Launch the cloudvolumes and the neuroglancer viewer in the background.
+                    The page polls for the link to the viewer while they start """
+                    payload = {'session_name':session_name,'cv_dict_list':cv_dict_list,
+                        'ng_launcher':'nglauncher','url_scheme':'https',
+                        'session_fields':{'cvs_need_atlas':cvs_need_atlas}}
+                    start_neuroglancer_session(kv,payload)
+                    neuroglancer_session_dict['Downsized'][image_resolution] = session_name
+                    logger.debug(f"Launching neuroglancer session {session_name}")
 
                 """ Registered data """
                 if any(any_registered_channels):
@@ -911,7 +732,8 @@ def general_data_setup(username,request_name,sample_name,
                     session_name = secrets.token_hex(6)
                     viewer_id = "viewer1" # for storing the viewer info in redis. Only ever one per session
                     # initialize this redis session key
-                    kv.hmset(session_name,{"cv_count":0,"cvs_need_atlas":""}) 
+                    cv_dict_list = [] # the cloudvolumes to launch in this ng session
+                    cvs_need_atlas = ""
                     cv_number = 0 # to keep track of how many cloudvolumes in this viewer/session
                     """ Loop through channels and spawn a cloudvolume 
                     within this session for each light sheet used """
@@ -1002,30 +824,14 @@ def general_data_setup(username,request_name,sample_name,
                             cv_container_name=cv_container_name,
                             layer_type=layer_type,session_name=session_name)
                         
-                        requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                        logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-                        """ Enter the cv information into redis
-                        so I can get it from within the neuroglancer container """
-
-                        kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                            f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})                    
-                        kv.hincrby(session_name,'cv_count',1)
-                        
-                        """ register with the confproxy so that the cloudvolume
-                        can be seen from outside the docker network """
-                        
-                        proxy_h = pp.progproxy(target_hname='confproxy')
-                        proxypath = os.path.join('cloudvols',session_name,cv_name)
-                        proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                        cv_dict['cv_number'] = cv_number
+                        cv_dict_list.append(cv_dict)
 
                         """ Check if atlas overlay was requested """
                         overlay_atlas_this_channel = channel_form.viz_atlas.data
                         if overlay_atlas_this_channel:
                             atlas_requested=True
-                            cvs_need_atlas = kv.hgetall(session_name)['cvs_need_atlas']
                             cvs_need_atlas+= f'{cv_name},'
-                            kv.hmset(session_name,{'cvs_need_atlas':cvs_need_atlas})
                         cv_contents_dict_list_this_resolution.append(cv_contents_dict_this_channel)
                     
                     """ If atlas was requested for any of the channels,
@@ -1035,7 +841,7 @@ def general_data_setup(username,request_name,sample_name,
                         """ Set up cloudvolume params for the atlas"""
 
                         cv_number += 1 
-                        cv_container_name = f'{session_name}_atlas'
+                        cv_container_name = f'shared_atlas_{atlas_name}'
                         cv_name = atlas_name # what shows up as the layer name in neuroglancer
                         logger.debug("Cloudvolume name is:")
                         logger.debug(cv_name)
@@ -1059,64 +865,30 @@ def general_data_setup(username,request_name,sample_name,
                         cv_contents_dict_this_channel['cv_name'] = cv_name
                         cv_contents_dict_this_channel['cv_path'] = cv_path
                         cv_contents_dict_this_channel['data_path'] = data_path
-                        """ send the data to the viewer-launcher
-                        to launch the cloudvolume """    
+                        """ The atlas is served by the shared atlas server 
+                        of viewer-launcher, no container is started for it """    
 
                         cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                             cv_container_name=cv_container_name,
-                            layer_type=layer_type,session_name=session_name)
-                        requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-                        logger.debug("Made post request to viewer-launcher to launch atlas cloudvolume")
-
-                        """ Enter the cv information into redis
-                        so I can get it from within the neuroglancer container """
-
-                        kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-                            f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})                    
-                        kv.hincrby(session_name,'cv_count',1)
-                        
-                        """ register with the confproxy so that the cloudvolume
-                        can be seen from outside the docker network """
-                        
-                        proxy_h = pp.progproxy(target_hname='confproxy')
-                        proxypath = os.path.join('cloudvols',session_name,cv_name)
-                        proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                            layer_type=layer_type,session_name=session_name,
+                            shared=True)
+                        cv_dict['cv_number'] = cv_number
+                        cv_dict_list.append(cv_dict)
                         cv_contents_dict_list_this_resolution.append(cv_contents_dict_this_channel)
                     cv_table = CloudVolumeLayerTable(cv_contents_dict_list_this_resolution)
                     cv_table_dict['Registered'][image_resolution] = cv_table  
                     """ Registered data neuroglancer container """
-                    ng_container_name = f'{session_name}_ng_container'
-                    ng_dict = {}
-                    ng_dict['hosturl'] = hosturl
-                    ng_dict['ng_container_name'] = ng_container_name
-                    ng_dict['session_name'] = session_name
-                    """ send the data to the viewer-launcher
-                    to launch the ng viewer """                       
-                    requests.post('http://viewer-launcher:5005/ng_reg_launcher',json=ng_dict)                    
-                    """ Add the ng container name to redis session key level """
-                    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-                    """ Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network """
-                    proxy_h.addroute(proxypath=f'viewers/{session_name}', proxytarget=f"http://{ng_container_name}:8080/")
-
-                    """ Spin until the neuroglancer viewer token from redis becomes available 
-                    (may be waiting on the neuroglancer container to finish writing to redis) """
-                    while True:
-                        session_dict = kv.hgetall(session_name)
-                        if 'viewer' in session_dict.keys():
-                            break
-                        else:
-                            logger.debug("Still spinning; waiting for redis entry for neuroglancer viewer")
-                            time.sleep(0.25)
-                    viewer_json_str = kv.hgetall(session_name)['viewer']
-                    viewer_dict = json.loads(viewer_json_str)
-                    response=proxy_h.getroutes()
-                    
-                    neuroglancerurl = f"https://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-                    neuroglancer_url_dict['Registered'][image_resolution] = neuroglancerurl
+                    """ Launch the cloudvolumes and the neuroglancer viewer in the background.
+                    The page polls for the link to the viewer while they start """
+                    payload = {'session_name':session_name,'cv_dict_list':cv_dict_list,
+                        'ng_launcher':'ng_reg_launcher','url_scheme':'https',
+                        'session_fields':{'cvs_need_atlas':cvs_need_atlas}}
+                    start_neuroglancer_session(kv,payload)
+                    neuroglancer_session_dict['Registered'][image_resolution] = session_name
        
             logger.debug(cv_table_dict)
             return render_template('neuroglancer/general_viewer_links.html',
-                url_dict=neuroglancer_url_dict,cv_table_dict=cv_table_dict)
+                session_dict=neuroglancer_session_dict,cv_table_dict=cv_table_dict)
 
         else: # form not validated
             flash("There were errors below. Correct them in order to proceed.","danger")
@@ -1241,6 +1013,21 @@ def general_data_setup(username,request_name,sample_name,
     return render_template('neuroglancer/general_data_setup.html',form=form,
         channel_contents_lists=channel_contents_lists,processing_request_table=processing_request_table)
 
+@neuroglancer.route("/neuroglancer/viewer_launch_status/<session_name>")
+@logged_in
+def viewer_launch_status(session_name):
+    """ Report the progress of launching a session's neuroglancer viewer
+    in the background, see start_neuroglancer_session() in tasks.py.
+    Polled by the viewer links pages, so not logged with log_http_requests.
+
+    Returns JSON with the state: pending, queued (with the queue_position), 
+    launching, ready (with the url) or failed (with the error) """
+    kv = get_redis()
+    launch_status = kv.hgetall(launch_status_key(session_name))
+    if not launch_status:
+        return jsonify({'state':'unknown'}), 404
+    return jsonify(launch_status)
+
 @neuroglancer.route("/neuroglancer/allen_atlas",
     methods=['GET','POST'])
 @logged_in
@@ -1361,7 +1148,7 @@ def jess_cfos_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1373,7 +1160,7 @@ def jess_cfos_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 2: Raw atlas an21 """
     layer_type = "segmentation"
@@ -1387,7 +1174,7 @@ def jess_cfos_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1399,7 +1186,7 @@ def jess_cfos_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 3: Raw cells an21 """
     layer_type = "segmentation"
@@ -1413,7 +1200,7 @@ def jess_cfos_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1425,7 +1212,7 @@ def jess_cfos_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -1445,25 +1232,11 @@ def jess_cfos_example():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -1515,7 +1288,7 @@ def jess_cfos_50micron_zres_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1527,7 +1300,7 @@ def jess_cfos_50micron_zres_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 2: Raw atlas an21 """
     layer_type = "segmentation"
@@ -1541,7 +1314,7 @@ def jess_cfos_50micron_zres_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1553,7 +1326,7 @@ def jess_cfos_50micron_zres_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells an21 """
     layer_type = "segmentation"
@@ -1567,7 +1340,7 @@ def jess_cfos_50micron_zres_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1579,7 +1352,7 @@ def jess_cfos_50micron_zres_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -1599,25 +1372,11 @@ def jess_cfos_50micron_zres_example():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -1669,7 +1428,7 @@ def jess_cfos_spherecell_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1681,7 +1440,7 @@ def jess_cfos_spherecell_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 2: Raw atlas an21 """
     layer_type = "segmentation"
@@ -1695,7 +1454,7 @@ def jess_cfos_spherecell_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1707,7 +1466,7 @@ def jess_cfos_spherecell_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells an21 """
     layer_type = "segmentation"
@@ -1721,7 +1480,7 @@ def jess_cfos_spherecell_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1733,7 +1492,7 @@ def jess_cfos_spherecell_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -1753,25 +1512,11 @@ def jess_cfos_spherecell_example():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -1823,7 +1568,7 @@ def jess_cfos_precomp_annotations():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1835,7 +1580,7 @@ def jess_cfos_precomp_annotations():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 2: Raw atlas an21 """
     layer_type = "segmentation"
@@ -1849,7 +1594,7 @@ def jess_cfos_precomp_annotations():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1861,7 +1606,7 @@ def jess_cfos_precomp_annotations():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 3: Raw cells an21 """
     layer_type = "annotation"
@@ -1907,25 +1652,11 @@ def jess_cfos_precomp_annotations():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -1978,7 +1709,7 @@ def jess_cfos_precomp_annotations_iso():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -1990,7 +1721,7 @@ def jess_cfos_precomp_annotations_iso():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 2: Raw atlas an4 """
     layer_type = "segmentation"
@@ -2004,7 +1735,7 @@ def jess_cfos_precomp_annotations_iso():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2016,7 +1747,7 @@ def jess_cfos_precomp_annotations_iso():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 3: Raw cells an4 """
     layer_type = "annotation"
@@ -2062,25 +1793,11 @@ def jess_cfos_precomp_annotations_iso():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -2132,7 +1849,7 @@ def jess_cfos_201810dataset():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2144,7 +1861,7 @@ def jess_cfos_201810dataset():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 2: Raw atlas dadult_pc_crus1_1 """
     layer_type = "segmentation"
@@ -2158,7 +1875,7 @@ def jess_cfos_201810dataset():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2170,7 +1887,7 @@ def jess_cfos_201810dataset():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells  """
     layer_type = "segmentation"
@@ -2184,7 +1901,7 @@ def jess_cfos_201810dataset():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2196,7 +1913,7 @@ def jess_cfos_201810dataset():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -2216,25 +1933,11 @@ def jess_cfos_201810dataset():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -2285,7 +1988,7 @@ def jess_cfos_eroded_cell_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2297,7 +2000,7 @@ def jess_cfos_eroded_cell_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 2: Raw atlas an4_saline """
     layer_type = "segmentation"
@@ -2311,7 +2014,7 @@ def jess_cfos_eroded_cell_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2323,7 +2026,7 @@ def jess_cfos_eroded_cell_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 3: Raw cells an4_saline """
     layer_type = "annotation"
@@ -2369,25 +2072,11 @@ def jess_cfos_eroded_cell_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -2441,7 +2130,7 @@ def jess_tracing_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2453,7 +2142,7 @@ def jess_tracing_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
                
@@ -2466,7 +2155,7 @@ def jess_tracing_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2478,7 +2167,7 @@ def jess_tracing_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -2489,6 +2178,10 @@ def jess_tracing_example():
     """ send the data to the viewer-launcher
     to launch the ng viewer """                       
     
+    """ Let p and c switch between the hierarchy levels of the atlas, if they were built """
+    atlas_levels_fields = serve_atlas_levels(ONTOLOGY_PMA_VIEWER_ATLAS)
+    if atlas_levels_fields:
+        kv.hmset(session_name,atlas_levels_fields)
     requests.post('http://viewer-launcher:5005/ng_ontology_pma_launcher',json=ng_dict)
     logger.debug("Made post request to viewer-launcher to launch ng custom viewer")
     """ Neuroglancer viewer container """
@@ -2509,25 +2202,11 @@ def jess_tracing_example():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -2578,7 +2257,7 @@ def jess_cfos_merge_ontology_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2590,7 +2269,7 @@ def jess_cfos_merge_ontology_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 2: Raw atlas  """
     layer_type = "segmentation"
@@ -2604,7 +2283,7 @@ def jess_cfos_merge_ontology_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2616,7 +2295,7 @@ def jess_cfos_merge_ontology_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # # """ CV 3: Raw cells  """
     layer_type = "annotation"
@@ -2659,6 +2338,10 @@ def jess_cfos_merge_ontology_demo():
     """ send the data to the viewer-launcher
     to launch the ng viewer """                       
     
+    """ Let p and c switch between the hierarchy levels of the atlas, if they were built """
+    atlas_levels_fields = serve_atlas_levels(ONTOLOGY_PMA_VIEWER_ATLAS)
+    if atlas_levels_fields:
+        kv.hmset(session_name,atlas_levels_fields)
     requests.post('http://viewer-launcher:5005/ng_ontology_pma_launcher',json=ng_dict)
     logger.debug("Made post request to viewer-launcher to launch ng custom viewer")
     
@@ -2668,25 +2351,11 @@ def jess_cfos_merge_ontology_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     
     neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
     logger.debug(neuroglancerurl)
@@ -2724,7 +2393,7 @@ def willmore_fiber_placement_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2736,7 +2405,7 @@ def willmore_fiber_placement_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 2: Kim et al. group Mouse Brain Atlas """
     cv_number += 1              
@@ -2750,7 +2419,7 @@ def willmore_fiber_placement_demo():
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
     
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2762,7 +2431,7 @@ def willmore_fiber_placement_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     """ CV 3: Kim et al. group Mouse Brain Atlas segment boundaries """
     cv_number += 1              
@@ -2775,7 +2444,7 @@ def willmore_fiber_placement_demo():
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
     
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2787,7 +2456,7 @@ def willmore_fiber_placement_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ Neuroglancer viewer """
     ng_container_name = f'{session_name}_ng_container'
@@ -2807,22 +2476,9 @@ def willmore_fiber_placement_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
     
@@ -2874,7 +2530,7 @@ def joey_aldolase_example():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2886,7 +2542,7 @@ def joey_aldolase_example():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -2906,25 +2562,11 @@ def joey_aldolase_example():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -2980,7 +2622,7 @@ def cz15_cfos_lavision_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -2992,7 +2634,7 @@ def cz15_cfos_lavision_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -3006,7 +2648,7 @@ def cz15_cfos_lavision_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3018,7 +2660,7 @@ def cz15_cfos_lavision_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells """
     layer_type = "annotation"
@@ -3064,25 +2706,11 @@ def cz15_cfos_lavision_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -3139,7 +2767,7 @@ def cz15_cfos_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3151,7 +2779,7 @@ def cz15_cfos_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -3165,7 +2793,7 @@ def cz15_cfos_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3177,7 +2805,7 @@ def cz15_cfos_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells """
     layer_type = "annotation"
@@ -3223,25 +2851,11 @@ def cz15_cfos_smartspim_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -3297,7 +2911,7 @@ def mkislin_20210715_mk_Ai148_442_2p():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3309,7 +2923,7 @@ def mkislin_20210715_mk_Ai148_442_2p():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -3329,25 +2943,11 @@ def mkislin_20210715_mk_Ai148_442_2p():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -3403,7 +3003,7 @@ def mkislin_20210715_mk_Ai148_442_lightsheet():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3415,7 +3015,7 @@ def mkislin_20210715_mk_Ai148_442_lightsheet():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 2: lightsheet data - Ch 642 """
     layer_type = "image"
@@ -3429,7 +3029,7 @@ def mkislin_20210715_mk_Ai148_442_lightsheet():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3441,7 +3041,7 @@ def mkislin_20210715_mk_Ai148_442_lightsheet():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -3461,25 +3061,11 @@ def mkislin_20210715_mk_Ai148_442_lightsheet():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -3533,7 +3119,7 @@ def kelly_cfos_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3545,7 +3131,7 @@ def kelly_cfos_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -3559,7 +3145,7 @@ def kelly_cfos_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3571,7 +3157,7 @@ def kelly_cfos_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells """
     layer_type = "annotation"
@@ -3617,25 +3203,11 @@ def kelly_cfos_smartspim_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -3689,7 +3261,7 @@ def kelly_cfos_lavision_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3701,7 +3273,7 @@ def kelly_cfos_lavision_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -3715,7 +3287,7 @@ def kelly_cfos_lavision_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -3727,7 +3299,7 @@ def kelly_cfos_lavision_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ CV 3: Raw cells """
     layer_type = "annotation"
@@ -3773,25 +3345,11 @@ def kelly_cfos_lavision_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -3863,7 +3421,7 @@ def HJB_DCN_YFP():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -3875,7 +3433,7 @@ def HJB_DCN_YFP():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
             
             """ Neuroglancer viewer container """
             ng_container_name = f'{session_name}_ng_container'
@@ -3896,25 +3454,11 @@ def HJB_DCN_YFP():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -3993,7 +3537,7 @@ def diamanti_SynGCaMP7_12_001_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -4005,7 +3549,7 @@ def diamanti_SynGCaMP7_12_001_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -4019,7 +3563,7 @@ def diamanti_SynGCaMP7_12_001_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -4031,7 +3575,7 @@ def diamanti_SynGCaMP7_12_001_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
     # """ Neuroglancer viewer container """
     ng_container_name = f'{session_name}_ng_container'
@@ -4051,25 +3595,11 @@ def diamanti_SynGCaMP7_12_001_smartspim_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -4126,7 +3656,7 @@ def soline_20201005_2357_819_sample001_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -4138,7 +3668,7 @@ def soline_20201005_2357_819_sample001_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -4152,7 +3682,7 @@ def soline_20201005_2357_819_sample001_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -4164,7 +3694,7 @@ def soline_20201005_2357_819_sample001_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
 
     # """ Neuroglancer viewer container """
@@ -4185,25 +3715,11 @@ def soline_20201005_2357_819_sample001_smartspim_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -4260,7 +3776,7 @@ def soline_20201005_2357_819_sample002_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -4272,7 +3788,7 @@ def soline_20201005_2357_819_sample002_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
     
     """ CV 2: Raw atlas """
     layer_type = "segmentation"
@@ -4286,7 +3802,7 @@ def soline_20201005_2357_819_sample002_smartspim_demo():
     cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
         cv_container_name=cv_container_name,
         layer_type=layer_type,session_name=session_name)
-    requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+    cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
     logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
     """ Enter the cv information into redis
@@ -4298,7 +3814,7 @@ def soline_20201005_2357_819_sample002_smartspim_demo():
     # register with the confproxy so that it can be seen from outside the nglancer network
     proxy_h = pp.progproxy(target_hname='confproxy')
     proxypath = os.path.join('cloudvols',session_name,cv_name)
-    proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+    proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
 
     # """ Neuroglancer viewer container """
@@ -4319,25 +3835,11 @@ def soline_20201005_2357_819_sample002_smartspim_demo():
     proxy_h.addroute(proxypath=f'viewers/{session_name}', 
         proxytarget=f"http://{ng_container_name}:8080/")
     logger.debug(f"Added {ng_container_name} to redis and confproxy")
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
 
-    # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
+    # Wait until the neuroglancer container has written its viewer token to redis
+    viewer_dict = wait_for_viewer(kv,session_name)
     logging.debug(f"Redis contents for viewer")
     logging.debug(viewer_dict)
-    proxy_h.getroutes()
     # logger.debug("Proxy contents:")
     # logger.debug(proxy_contents)
     
@@ -4431,7 +3933,7 @@ def jess_cfos_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -4443,7 +3945,7 @@ def jess_cfos_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             # """ CV 2: Raw atlas  """
             layer_type = "segmentation"
@@ -4457,7 +3959,7 @@ def jess_cfos_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -4469,7 +3971,7 @@ def jess_cfos_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             # # """ CV 3: Raw cells  """
             layer_type = "annotation"
@@ -4521,25 +4023,11 @@ def jess_cfos_setup():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -4626,7 +4114,7 @@ def jess_tracing_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -4639,7 +4127,7 @@ def jess_tracing_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ CV 2: Raw atlas  """
             layer_type = "segmentation"
@@ -4653,7 +4141,7 @@ def jess_tracing_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -4665,7 +4153,7 @@ def jess_tracing_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ Neuroglancer viewer container """
             ng_container_name = f'{session_name}_ng_container'
@@ -4676,6 +4164,10 @@ def jess_tracing_setup():
             """ send the data to the viewer-launcher
             to launch the ng viewer """                       
             
+            """ Let p and c switch between the hierarchy levels of the atlas, if they were built """
+            atlas_levels_fields = serve_atlas_levels(ONTOLOGY_PMA_VIEWER_ATLAS)
+            if atlas_levels_fields:
+                kv.hmset(session_name,atlas_levels_fields)
             requests.post('http://viewer-launcher:5005/ng_ontology_pma_launcher',json=ng_dict)
             logger.debug("Made post request to viewer-launcher to launch ng custom viewer")
             
@@ -4685,25 +4177,11 @@ def jess_tracing_setup():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -4788,7 +4266,7 @@ def zimmerman_02_cfos_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -4800,7 +4278,7 @@ def zimmerman_02_cfos_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
             
 
             """ CV 2: 488 Channel (first check that it exists) """
@@ -4817,7 +4295,7 @@ def zimmerman_02_cfos_setup():
                 cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                     cv_container_name=cv_container_name,
                     layer_type=layer_type,session_name=session_name)
-                requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+                cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
                 logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
                 """ Enter the cv information into redis
@@ -4829,7 +4307,7 @@ def zimmerman_02_cfos_setup():
                 # register with the confproxy so that it can be seen from outside the nglancer network
                 proxy_h = pp.progproxy(target_hname='confproxy')
                 proxypath = os.path.join('cloudvols',session_name,cv_name)
-                proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ CV 3: Raw space atlas (first check that it exists) """
 
@@ -4845,7 +4323,7 @@ def zimmerman_02_cfos_setup():
                 cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                     cv_container_name=cv_container_name,
                     layer_type=layer_type,session_name=session_name)
-                requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+                cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
                 logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
                 """ Enter the cv information into redis
@@ -4857,7 +4335,7 @@ def zimmerman_02_cfos_setup():
                 # register with the confproxy so that it can be seen from outside the nglancer network
                 proxy_h = pp.progproxy(target_hname='confproxy')
                 proxypath = os.path.join('cloudvols',session_name,cv_name)
-                proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ Neuroglancer viewer container """
             ng_container_name = f'{session_name}_ng_container'
@@ -4878,25 +4356,11 @@ def zimmerman_02_cfos_setup():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -4982,7 +4446,7 @@ def zimmerman_04_06_cfos_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -4994,7 +4458,7 @@ def zimmerman_04_06_cfos_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
             
             """ Neuroglancer viewer container """
             ng_container_name = f'{session_name}_ng_container'
@@ -5015,25 +4479,11 @@ def zimmerman_04_06_cfos_setup():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -5140,7 +4590,7 @@ def zimmerman_02_cfos_setup_imaging_request_2():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -5152,7 +4602,7 @@ def zimmerman_02_cfos_setup_imaging_request_2():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
             
 
             """ CV 2: 488 Channel (first check that it exists) """
@@ -5169,7 +4619,7 @@ def zimmerman_02_cfos_setup_imaging_request_2():
                 cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                     cv_container_name=cv_container_name,
                     layer_type=layer_type,session_name=session_name)
-                requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+                cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
                 logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
                 """ Enter the cv information into redis
@@ -5181,7 +4631,7 @@ def zimmerman_02_cfos_setup_imaging_request_2():
                 # register with the confproxy so that it can be seen from outside the nglancer network
                 proxy_h = pp.progproxy(target_hname='confproxy')
                 proxypath = os.path.join('cloudvols',session_name,cv_name)
-                proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ CV 3: Raw space atlas (first check that it exists) """
 
@@ -5197,7 +4647,7 @@ def zimmerman_02_cfos_setup_imaging_request_2():
                 cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                     cv_container_name=cv_container_name,
                     layer_type=layer_type,session_name=session_name)
-                requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+                cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
                 logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
                 """ Enter the cv information into redis
@@ -5209,7 +4659,7 @@ def zimmerman_02_cfos_setup_imaging_request_2():
                 # register with the confproxy so that it can be seen from outside the nglancer network
                 proxy_h = pp.progproxy(target_hname='confproxy')
                 proxypath = os.path.join('cloudvols',session_name,cv_name)
-                proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ Neuroglancer viewer container """
             ng_container_name = f'{session_name}_ng_container'
@@ -5230,25 +4680,11 @@ def zimmerman_02_cfos_setup_imaging_request_2():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -5340,7 +4776,7 @@ def MO_May2021_Tsc1_viz_setup():
             cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                 cv_container_name=cv_container_name,
                 layer_type=layer_type,session_name=session_name)
-            requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+            cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
             logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
             """ Enter the cv information into redis
@@ -5352,7 +4788,7 @@ def MO_May2021_Tsc1_viz_setup():
             # register with the confproxy so that it can be seen from outside the nglancer network
             proxy_h = pp.progproxy(target_hname='confproxy')
             proxypath = os.path.join('cloudvols',session_name,cv_name)
-            proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+            proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
             
 
             """ CV 2: Raw space atlas (first check that it exists) """
@@ -5369,7 +4805,7 @@ def MO_May2021_Tsc1_viz_setup():
                 cv_dict = dict(cv_path=cv_path,cv_name=cv_name,
                     cv_container_name=cv_container_name,
                     layer_type=layer_type,session_name=session_name)
-                requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
+                cv_container_name,cv_proxytarget = launch_cloudvolume(cv_dict)
                 logger.debug("Made post request to viewer-launcher to launch cloudvolume")
 
                 """ Enter the cv information into redis
@@ -5381,7 +4817,7 @@ def MO_May2021_Tsc1_viz_setup():
                 # register with the confproxy so that it can be seen from outside the nglancer network
                 proxy_h = pp.progproxy(target_hname='confproxy')
                 proxypath = os.path.join('cloudvols',session_name,cv_name)
-                proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
+                proxy_h.addroute(proxypath=proxypath,proxytarget=cv_proxytarget)
 
             """ Neuroglancer viewer container """
             ng_container_name = f'{session_name}_ng_container'
@@ -5402,25 +4838,11 @@ def MO_May2021_Tsc1_viz_setup():
             proxy_h.addroute(proxypath=f'viewers/{session_name}', 
                 proxytarget=f"http://{ng_container_name}:8080/")
             logger.debug(f"Added {ng_container_name} to redis and confproxy")
-            # Add the ng container name to redis session key level
-            kv.hmset(session_name, {"ng_container_name": ng_container_name})
-            # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-            proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-                proxytarget=f"http://{ng_container_name}:8080/")
 
-            # Spin until the neuroglancer viewer token from redis becomes available (may be waiting on the neuroglancer container to finish writing to redis)
-            while True:
-                session_dict = kv.hgetall(session_name)
-                if 'viewer' in session_dict.keys():
-                    break
-                else:
-                    logging.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-                    time.sleep(0.25)
-            viewer_json_str = kv.hgetall(session_name)['viewer']
-            viewer_dict = json.loads(viewer_json_str)
+            # Wait until the neuroglancer container has written its viewer token to redis
+            viewer_dict = wait_for_viewer(kv,session_name)
             logging.debug(f"Redis contents for viewer")
             logging.debug(viewer_dict)
-            proxy_h.getroutes()
             
             neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
             logger.debug(neuroglancerurl)
@@ -5458,9 +4880,9 @@ def confproxy_table():
     reverse = (request.args.get('direction', 'asc') == 'desc')
     kv = redis.Redis(host="redis", decode_responses=True)
     proxy_h = pp.progproxy(target_hname='confproxy')
-    """ Grab all of the confproxy routes from the proxy table """
-    response_all = proxy_h.getroutes()
-    proxy_dict = json.loads(response_all.text)
+    """ Grab all of the confproxy routes from the proxy table,
+    a few seconds old at most """
+    proxy_dict = proxy_h.routes()
     logger.debug("All current confproxy routes:")
     logger.debug(proxy_dict)
     table_contents = []
@@ -5492,8 +4914,10 @@ def confproxy_table():
         cv_container_names = [session_dict[f'cv{x+1}_container_name'] for x in range(cv_count)]
         ng_container_name = session_dict['ng_container_name']
         ng_table_entry['container_name'] = ng_container_name
+        ng_table_entry['docker_host'] = session_dict.get('docker_host','')
         container_names = cv_container_names + [ng_container_name]
-        container_dict = {'list_of_container_names':container_names}
+        container_dict = {'list_of_container_names':container_names,
+            'docker_host':session_dict.get('docker_host')}
         response = requests.post('http://viewer-launcher:5005/get_container_info',json=container_dict)
         container_info_dict = json.loads(response.text)
         ng_container_info_dict = container_info_dict[ng_container_name]
@@ -5508,14 +4932,12 @@ def confproxy_table():
         else:
             # this container needs to be removed from the confproxy since it is no longer running
             proxy_h.deleteroute(ng_proxypath)
-            logger.debug("After removing ng proxypath current confproxy routes are:")
-            updated_response = proxy_h.getroutes()
-            updated_proxy_dict = json.loads(updated_response.text)
-            logger.debug(updated_proxy_dict)
+            logger.debug("deleted ng proxypath")
         for ii in range(cv_count):
             cv_table_entry = {
                 'session_name':session_name,
                 'proxy_path':cv_proxypaths[ii],
+                'docker_host':session_dict.get('docker_host',''),
             }
             cv_container_name = cv_container_names[ii]
             this_container_info_dict = container_info_dict[cv_container_name]
@@ -5545,5 +4967,16 @@ def confproxy_table():
     table = ConfproxyAdminTable(sorted_table_contents,
         sort_by=sort,sort_reverse=reverse)
 
-    return render_template('neuroglancer/confproxy_admin_panel.html',table=table)
+    admission_stats = SessionScheduler(kv).stats()
+
+    return render_template('neuroglancer/confproxy_admin_panel.html',table=table,
+        admission_stats=admission_stats)
+
+@neuroglancer.route("/admin/viewer_admission_stats",methods=['GET'])
+@logged_in_as_admin
+def viewer_admission_stats():
+    """ JSON with the queue depth, wait times and budget use
+    of the neuroglancer session scheduler, see scheduler.py """
+    kv = get_redis()
+    return jsonify(SessionScheduler(kv).stats())
    
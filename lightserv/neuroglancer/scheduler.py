@@ -0,0 +1,327 @@
+""" Admission control for launching neuroglancer sessions.
+
+Each launch of a new session (reusing a live session is free) costs
+containers and memory, which are budgeted in total and per user
+(NG_MAX_CONTAINERS, NG_MAX_MEMORY_MB and their _PER_USER versions).
+Launches that do not fit wait in a fair queue: start-time fair queueing
+with equal weights, which takes turns between the users that are waiting
+instead of serving one user's burst of launches before everyone else's.
+When it is a launch's turn but the budget is used up, the least recently
+used idle sessions are taken down to make room before it gives up after
+NG_ADMISSION_TIMEOUT_SECONDS.
+
+All of the state lives in redis so that every celery worker shares it,
+and the decision to admit a launch is made in one lua script so that
+two workers cannot both take the last of the budget.
+"""
+
+import json, logging, time
+from collections import Counter
+
+import redis
+from flask import current_app
+
+from .utils import (ViewerLaunchError, BUDGET_USAGE_KEY, SESSION_ACTIVITY_INDEX,
+    session_in_use, take_down_sessions)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate=False
+
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+file_handler = logging.FileHandler('logs/neuroglancer_scheduler.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+QUEUE_KEY = 'ng_admission_queue' # sorted set of ticket -> virtual start tag
+TICKETS_KEY = 'ng_admission_tickets' # hash of ticket -> json with username, cost and enqueue time
+VTIME_KEY = 'ng_admission_vtime' # tag of the last admitted ticket
+WAIT_TIMES_KEY = 'ng_admission_wait_times' # list of the most recent wait times in seconds
+N_WAIT_TIMES = 1000
+ALIVE_SECONDS = 10 # a ticket whose task stops refreshing it for this long is dropped
+POLL_SECONDS = 0.5
+
+ADMITTED = 1
+WAIT_YOUR_TURN = 0
+OVER_BUDGET = -1
+OVER_USER_BUDGET = -2
+NOT_QUEUED = -3
+
+def user_tag_key(username):
+    return f'ng_admission_last_tag:{username}'
+
+def ticket_alive_key(ticket):
+    return f'ng_admission_alive:{ticket}'
+
+""" A ticket's virtual start tag is one more than the later of the last admitted tag
+and the user's own last tag, so each user's n-th waiting launch
+is admitted after every other user's n-th """
+ENQUEUE_SCRIPT = """
+local vtime = tonumber(redis.call('GET', KEYS[3]) or '0')
+local last_tag = tonumber(redis.call('GET', KEYS[4]) or '0')
+local tag = math.max(vtime, last_tag) + 1
+redis.call('SET', KEYS[4], tag, 'EX', 86400)
+redis.call('ZADD', KEYS[1], tag, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('SET', KEYS[5], 1, 'EX', ARGV[3])
+return tag
+"""
+
+""" Go through the queue in tag order. Tickets ahead that would fit, or are waiting
+for the total budget, go first. Tickets ahead that are only over their own user's
+budget do not hold up anyone else. Admitting a ticket records its cost
+in the usage hash and on the session hash, which is the ticket """
+ADMIT_SCRIPT = """
+local queue, tickets, usage, vtime, session = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local max_containers, max_user_containers = tonumber(ARGV[2]), tonumber(ARGV[3])
+local max_memory, max_user_memory = tonumber(ARGV[4]), tonumber(ARGV[5])
+local function used(field)
+    return tonumber(redis.call('HGET', usage, field) or '0')
+end
+local function check(info)
+    local user = 'user:' .. info.username
+    if used(user .. ':containers') + info.containers > max_user_containers
+        or used(user .. ':memory_mb') + info.memory_mb > max_user_memory then
+        return -2
+    end
+    if used('containers') + info.containers > max_containers
+        or used('memory_mb') + info.memory_mb > max_memory then
+        return -1
+    end
+    return 1
+end
+local entries = redis.call('ZRANGE', queue, 0, -1, 'WITHSCORES')
+for i = 1, #entries, 2 do
+    local ticket, tag = entries[i], entries[i+1]
+    local info_json = redis.call('HGET', tickets, ticket)
+    if (not info_json) or redis.call('EXISTS', 'ng_admission_alive:' .. ticket) == 0 then
+        redis.call('ZREM', queue, ticket)
+        redis.call('HDEL', tickets, ticket)
+    else
+        local info = cjson.decode(info_json)
+        local status = check(info)
+        if ticket == ARGV[1] then
+            if status ~= 1 then
+                return status
+            end
+            local user = 'user:' .. info.username
+            redis.call('HINCRBY', usage, 'containers', info.containers)
+            redis.call('HINCRBY', usage, 'memory_mb', info.memory_mb)
+            redis.call('HINCRBY', usage, user .. ':containers', info.containers)
+            redis.call('HINCRBY', usage, user .. ':memory_mb', info.memory_mb)
+            redis.call('HMSET', session, 'admitted_username', info.username,
+                'admitted_containers', info.containers, 'admitted_memory_mb', info.memory_mb)
+            redis.call('ZREM', queue, ticket)
+            redis.call('HDEL', tickets, ticket)
+            redis.call('SET', vtime, tag)
+            return 1
+        elseif status ~= -2 then
+            return 0
+        end
+    end
+end
+return -3
+"""
+
+class ViewerAdmissionError(ViewerLaunchError):
+    """ Raised when a session could not be admitted within
+    NG_ADMISSION_TIMEOUT_SECONDS, or can never fit in the budget """
+    pass
+
+def session_cost(payload):
+    """ The containers and memory (MB) launching a session
+    (see launch_neuroglancer_viewer()) takes: one neuroglancer container
+    and usually one precomputed server for all of its cloudvolumes,
+    not counting the atlases which have shared servers """
+    container_memory_mb = current_app.config['NG_CONTAINER_MEMORY_MB']
+    containers = 1
+    memory_mb = container_memory_mb['neuroglancer']
+    if any(not cv_dict.get('shared') for cv_dict in payload['cv_dict_list']):
+        containers += 1
+        memory_mb += container_memory_mb['cvserver']
+    return containers, memory_mb
+
+class SessionScheduler(object):
+    """
+    ---PURPOSE---
+    Decides when a new neuroglancer session may be launched,
+    see the top of this module.
+    ---INPUT---
+    kv      - redis.Redis() instance
+    """
+    def __init__(self,kv):
+        self.kv = kv
+        config = current_app.config
+        self.limits = {
+            'containers':config['NG_MAX_CONTAINERS'],
+            'containers_per_user':config['NG_MAX_CONTAINERS_PER_USER'],
+            'memory_mb':config['NG_MAX_MEMORY_MB'],
+            'memory_mb_per_user':config['NG_MAX_MEMORY_MB_PER_USER']}
+        self.timeout = config['NG_ADMISSION_TIMEOUT_SECONDS']
+        self.idle_seconds = config['NG_SESSION_IDLE_SECONDS']
+        self.enqueue_script = kv.register_script(ENQUEUE_SCRIPT)
+        self.admit_script = kv.register_script(ADMIT_SCRIPT)
+
+    def enqueue(self,ticket,username,containers,memory_mb):
+        ticket_info = json.dumps({'username':username,'containers':containers,
+            'memory_mb':memory_mb,'enqueued':time.time()})
+        self.enqueue_script(keys=[QUEUE_KEY,TICKETS_KEY,VTIME_KEY,
+            user_tag_key(username),ticket_alive_key(ticket)],
+            args=[ticket,ticket_info,ALIVE_SECONDS])
+
+    def dequeue(self,ticket):
+        pipe = self.kv.pipeline()
+        pipe.zrem(QUEUE_KEY,ticket)
+        pipe.hdel(TICKETS_KEY,ticket)
+        pipe.delete(ticket_alive_key(ticket))
+        pipe.execute()
+
+    def try_admit(self,ticket):
+        """ One attempt at admitting a queued ticket, returns one of
+        ADMITTED, WAIT_YOUR_TURN, OVER_BUDGET, OVER_USER_BUDGET or NOT_QUEUED """
+        self.kv.expire(ticket_alive_key(ticket),ALIVE_SECONDS)
+        return self.admit_script(keys=[QUEUE_KEY,TICKETS_KEY,BUDGET_USAGE_KEY,VTIME_KEY,ticket],
+            args=[ticket,self.limits['containers'],self.limits['containers_per_user'],
+                self.limits['memory_mb'],self.limits['memory_mb_per_user']])
+
+    def queue_position(self,ticket):
+        rank = self.kv.zrank(QUEUE_KEY,ticket)
+        return None if rank is None else rank + 1
+
+    def admit(self,session_name,username,cost,on_queued=None):
+        """
+        ---PURPOSE---
+        Block until a new session fits in the budget, evicting idle sessions
+        to make room if needed, and charge the session's cost to the budget.
+        The cost is given back by take_down_sessions().
+        ---INPUT---
+        session_name    - the session to launch, also used as its ticket in the queue
+        username        - who the session is for
+        cost            - (containers, memory_mb), see session_cost()
+        on_queued       - (optional) function called with the queue position
+                          while the session waits
+        ---OUTPUT---
+        wait_seconds    - how long the session waited
+        Raises ViewerAdmissionError if the session was not admitted in time
+        """
+        containers,memory_mb = cost
+        if containers > min(self.limits['containers'],self.limits['containers_per_user']) or \
+            memory_mb > min(self.limits['memory_mb'],self.limits['memory_mb_per_user']):
+            raise ViewerAdmissionError(f"Session {session_name} needs {containers} containers "
+                f"and {memory_mb} MB, more than the viewer budget allows")
+        start = time.time()
+        deadline = start + self.timeout
+        ticket = session_name
+        self.enqueue(ticket,username,containers,memory_mb)
+        try:
+            while True:
+                status = self.try_admit(ticket)
+                if status == ADMITTED:
+                    break
+                if status == NOT_QUEUED: # e.g. the worker stalled for longer than ALIVE_SECONDS
+                    self.enqueue(ticket,username,containers,memory_mb)
+                    continue
+                if status in (OVER_BUDGET,OVER_USER_BUDGET):
+                    evict_username = username if status == OVER_USER_BUDGET else None
+                    if self.evict_idle_session(evict_username):
+                        continue
+                if time.time() > deadline:
+                    raise ViewerAdmissionError(f"Session {session_name} was not admitted "
+                        f"after {self.timeout} seconds, the viewers are at capacity")
+                if on_queued is not None:
+                    on_queued(self.queue_position(ticket))
+                time.sleep(POLL_SECONDS)
+        except:
+            self.dequeue(ticket)
+            raise
+        self.kv.delete(ticket_alive_key(ticket))
+        wait_seconds = time.time() - start
+        pipe = self.kv.pipeline()
+        pipe.lpush(WAIT_TIMES_KEY,wait_seconds)
+        pipe.ltrim(WAIT_TIMES_KEY,0,N_WAIT_TIMES-1)
+        pipe.execute()
+        logger.debug(f"Admitted session {session_name} for {username} after {wait_seconds:.1f} seconds")
+        return wait_seconds
+
+    def evict_idle_session(self,username=None):
+        """ Take down the least recently used session that has been idle
+        for NG_SESSION_IDLE_SECONDS and holds budget, only of this user if given.
+        Returns whether a session was taken down """
+        idle_before = time.time() - self.idle_seconds
+        candidates = self.kv.zrangebyscore(SESSION_ACTIVITY_INDEX,'-inf',idle_before,start=0,num=50)
+        for session_name in candidates: # least recently used first
+            admitted_username = self.kv.hget(session_name,'admitted_username')
+            if admitted_username is None:
+                continue
+            if username is not None and admitted_username != username:
+                continue
+            if session_in_use(self.kv,session_name,self.idle_seconds):
+                continue
+            logger.info(f"Evicting idle session {session_name} of {admitted_username} to make room")
+            take_down_sessions(self.kv,[session_name])
+            return True
+        return False
+
+    def rebuild_usage(self):
+        """ Recount the budget used from the admitted sessions,
+        in case a session's redis keys expired before it was taken down """
+        with self.kv.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(BUDGET_USAGE_KEY)
+                    usage = Counter()
+                    for session_name in pipe.zrange(SESSION_ACTIVITY_INDEX,0,-1):
+                        username,containers,memory_mb = pipe.hmget(session_name,
+                            'admitted_username','admitted_containers','admitted_memory_mb')
+                        if username is None:
+                            continue
+                        usage['containers'] += int(containers)
+                        usage['memory_mb'] += int(memory_mb)
+                        usage[f'user:{username}:containers'] += int(containers)
+                        usage[f'user:{username}:memory_mb'] += int(memory_mb)
+                    pipe.multi()
+                    pipe.delete(BUDGET_USAGE_KEY)
+                    if usage:
+                        pipe.hmset(BUDGET_USAGE_KEY,dict(usage))
+                    pipe.execute()
+                    return dict(usage)
+                except redis.WatchError:
+                    continue
+
+    def stats(self):
+        """ Queue depth, wait times and budget use for the admin dashboard """
+        now = time.time()
+        ticket_infos = [json.loads(ticket_info) for ticket_info in self.kv.hgetall(TICKETS_KEY).values()]
+        current_waits = [now - ticket_info['enqueued'] for ticket_info in ticket_infos]
+        recent_waits = sorted(float(wait) for wait in self.kv.lrange(WAIT_TIMES_KEY,0,-1))
+        if recent_waits:
+            recent_wait_stats = {
+                'count':len(recent_waits),
+                'mean':sum(recent_waits)/len(recent_waits),
+                'p50':recent_waits[len(recent_waits)//2],
+                'p95':recent_waits[min(int(len(recent_waits)*0.95),len(recent_waits)-1)],
+                'max':recent_waits[-1]}
+        else:
+            recent_wait_stats = {'count':0}
+        usage = {field:int(value) for field,value in self.kv.hgetall(BUDGET_USAGE_KEY).items()}
+        usage_per_user = {}
+        for field,value in usage.items():
+            if field.startswith('user:'):
+                _,username,resource = field.split(':')
+                usage_per_user.setdefault(username,{})[resource] = value
+        return {
+            'queue_depth':self.kv.zcard(QUEUE_KEY),
+            'queue_depth_per_user':dict(Counter(ticket_info['username'] for ticket_info in ticket_infos)),
+            'longest_current_wait_seconds':max(current_waits,default=0),
+            'recent_wait_seconds':recent_wait_stats,
+            'usage':{'containers':usage.get('containers',0),'memory_mb':usage.get('memory_mb',0)},
+            'usage_per_user':usage_per_user,
+            'limits':self.limits}
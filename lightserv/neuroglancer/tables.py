@@ -95,6 +95,7 @@ class ConfproxyAdminTable(Table):
 	image = Col('docker image',column_html_attrs=column_html_attrs)
 	container_name = Col('container name',column_html_attrs=column_html_attrs)
 	container_id = Col('container id')
+	docker_host = Col('docker host')
 	# last_activity = DateTimeCol('last activity')
 	last_activity = Col('last activity')
 	def sort_url(self, col_key, reverse=False):
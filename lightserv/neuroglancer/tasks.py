@@ -1,11 +1,13 @@
-from flask import current_app
-import redis
+from flask import current_app, session
 import progproxy as pp
 from lightserv import cel
 import os
 import logging
-from datetime import datetime, timedelta
-import json, requests
+import json, time
+from .utils import (get_redis, launch_status_key, launch_neuroglancer_viewer,
+    claim_session, session_in_use, attach_neuroglancer_viewer,
+    touch_session, parse_route_timestamp, take_down_sessions, SESSION_ACTIVITY_INDEX)
+from .scheduler import SessionScheduler, session_cost
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -24,70 +26,122 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 logger.addHandler(file_handler)
 
+def start_neuroglancer_session(kv,payload):
+    """ Launch a neuroglancer session in the background.
+    The progress can be followed in redis, see launch_status_key().
+    The payload is described in launch_neuroglancer_viewer() """
+    payload.setdefault('username',session.get('user'))
+    status_key = launch_status_key(payload['session_name'])
+    kv.hmset(status_key,{'state':'pending'})
+    kv.expire(status_key,current_app.config['NG_SESSION_TTL_SECONDS'])
+    launch_neuroglancer_session.delay(payload)
+
+@cel.task()
+def launch_neuroglancer_session(payload):
+    """ A celery task to launch the cloudvolumes and neuroglancer viewer
+    of a session so the setup routes do not have to wait for them.
+    Writes the state (pending, queued, launching, ready or failed) and 
+    the viewer link or the error to the session's launch status hash in redis,
+    which the viewer_launch_status route reads. 
+
+    If a live session already displays the same layers 
+    (see claim_session()), a new viewer is made on it instead 
+    of launching new containers. The refcount and last_attached 
+    fields of that session keep ng_viewer_checker() from taking it 
+    down while the viewer is being handed out. 
+
+    Launching new containers has to be admitted by the
+    SessionScheduler first, which may queue the launch 
+    until there is room in the viewer budget. """
+    kv = get_redis()
+    session_name = payload['session_name']
+    status_key = launch_status_key(session_name)
+    kv.hmset(status_key,{'state':'launching'})
+    live_session_name = claim_session(kv,payload)
+    kv.hincrby(live_session_name,'refcount',1)
+    kv.hset(live_session_name,'last_attached',time.time())
+    touch_session(kv,live_session_name)
+    try:
+        if live_session_name == session_name:
+            scheduler = SessionScheduler(kv)
+            scheduler.admit(session_name,payload.get('username') or 'unknown',session_cost(payload),
+                on_queued=lambda position: kv.hmset(status_key,
+                    {'state':'queued','queue_position':position or 0}))
+            kv.hmset(status_key,{'state':'launching'})
+            neuroglancerurl = launch_neuroglancer_viewer(payload,kv=kv)
+        else:
+            logger.debug(f"Reusing live session {live_session_name} for {session_name}")
+            neuroglancerurl = attach_neuroglancer_viewer(kv,live_session_name,
+                url_scheme=payload.get('url_scheme','http'))
+    except Exception as e:
+        logger.exception(f"Failed to launch neuroglancer session {session_name}")
+        if live_session_name == session_name:
+            # stops whatever did start and gives back its budget
+            take_down_sessions(kv,[session_name])
+        kv.hmset(status_key,{'state':'failed','error':repr(e)})
+        kv.expire(status_key,current_app.config['NG_SESSION_TTL_SECONDS'])
+        return "failed"
+    finally:
+        pipe = kv.pipeline()
+        pipe.hincrby(live_session_name,'refcount',-1)
+        # in case the session was taken down in the meantime
+        pipe.expire(live_session_name,current_app.config['NG_SESSION_TTL_SECONDS'])
+        pipe.execute()
+    kv.hmset(status_key,{'state':'ready','url':neuroglancerurl})
+    logger.debug(f"Neuroglancer session {session_name} is ready at {neuroglancerurl}")
+    return "ready"
+
 @cel.task() 
 def ng_viewer_checker():
-    """ A celery task to check the activity timestamp
-    for all open viewers.
-    If it has been more than 30 seconds since last activity,
-    then shuts down the viewer and its cloudvolumes and removes them from
-    the proxy table. """
-    
+    """ A celery task to take down the neuroglancer sessions
+    that have had no activity for NG_VIEWER_EXPIRE_SECONDS:
+    shuts down the viewer and its cloudvolumes and removes them from
+    the proxy table. 
 
-    proxy_h = pp.progproxy(target_hname='confproxy')
-    """ Make the timestamp against which we will compare the viewer timestamps """
-    response_all = proxy_h.getroutes()
-    proxy_dict_all = json.loads(response_all.text)
-    logger.debug("PROXY DICT (ALL ROUTES):")
-    logger.debug(proxy_dict_all)
+    Sessions are kept in a redis sorted set by their last activity
+    (see touch_session()), so finding the expired sessions is a range query.
+    The activity of the viewers is first synced into the set
+    from one read of the proxy table. """
+    kv = get_redis()
+    proxy_h = pp.progproxy(target_hname='confproxy',
+        max_workers=current_app.config['NG_LAUNCH_MAX_WORKERS'])
     expire_seconds = current_app.config['NG_VIEWER_EXPIRE_SECONDS']
-    timeout_timestamp_iso = (datetime.utcnow() - timedelta(seconds=expire_seconds)).isoformat()
-    response = proxy_h.getroutes(inactive_since=timeout_timestamp_iso)
-    proxy_dict = json.loads(response.text)
-    # proxy_viewer_dict = {key:proxy_dict[key] for key in proxy_dict.keys() if 'viewer' in key}
-    expired_session_names = [key.split('/')[-1] for key in proxy_dict.keys() if 'viewer' in key]
-    """ Now figure out the session names of each of the expired viewers """   
-    logger.debug(f"Expired session names: {expired_session_names}")
 
-    """ Now delete the proxy routes for the viewers and cloudvolumes
-    associated with each of these expired sessions"""
-    for expired_session_name in expired_session_names:
-        # first ng viewers
-        ng_proxypath = f'/viewers/{expired_session_name}'
-        proxy_h.deleteroute(ng_proxypath)
-        # now find any cloudvolumes with this session name
-        cv_proxypaths = [key for key in proxy_dict.keys() if f'cloudvols/{expired_session_name}' in key]
-        logger.debug("expired cloudvolume proxypaths:")
-        logger.debug(cv_proxypaths)
-        for cv_proxypath in cv_proxypaths:
-            proxy_h.deleteroute(cv_proxypath)
+    """ Sync the last activity of the viewers from the proxy table 
+    and group the cloudvolume routes by session """
+    response = proxy_h.getroutes()
+    proxy_dict = json.loads(response.text)
+    viewer_activity_dict = {}
+    cv_proxypath_dict = {} # session_name -> list of cloudvolume proxypaths
+    for proxypath,route_dict in proxy_dict.items():
+        path_parts = proxypath.strip('/').split('/')
+        if path_parts[0] == 'viewers' and route_dict.get('last_activity'):
+            viewer_activity_dict[path_parts[-1]] = parse_route_timestamp(route_dict['last_activity'])
+        elif path_parts[0] == 'cloudvols' and len(path_parts) > 1:
+            cv_proxypath_dict.setdefault(path_parts[1],[]).append(proxypath)
+    session_names = list(viewer_activity_dict.keys())
+    pipe = kv.pipeline()
+    for session_name in session_names:
+        pipe.zscore(SESSION_ACTIVITY_INDEX,session_name)
+    indexed_activities = pipe.execute()
+    for session_name,indexed_activity in zip(session_names,indexed_activities):
+        last_activity = viewer_activity_dict[session_name]
+        if indexed_activity is None or last_activity > indexed_activity:
+            touch_session(kv,session_name,last_activity)
 
-    """ Now use the session names to take down the actual 
-        docker containers for both neuroglancer viewer and cloudvolume
-        that were launched for each session """
-    logger.debug("removing cloudvolume/neuroglancer containers linked to expired viewers")
-    kv = redis.Redis(host="redis", decode_responses=True)
-    container_names_to_kill = []
-    for session_name in expired_session_names:
-        logger.debug(f"in loop for {session_name}")
-        session_dict = kv.hgetall(session_name)
-        # Cloudvolume containers
-        try: # there might not always be cloudvolumes
-            cv_count = int(session_dict['cv_count'])
-        except:
-            cv_count = 0
-        for i in range(cv_count):
-            # logger.debug(f"in loop over cloudvolume counts")
-            cv_container_name = session_dict['cv%i_container_name' % (i+1)]
-            container_names_to_kill.append(cv_container_name)
+    """ Now find the sessions that have been inactive for too long,
+    skipping sessions that were just handed out to someone else """   
+    timeout_timestamp = time.time() - expire_seconds
+    expired_session_names = kv.zrangebyscore(SESSION_ACTIVITY_INDEX,'-inf',timeout_timestamp)
+    expired_session_names = [session_name for session_name in expired_session_names \
+        if not session_in_use(kv,session_name,expire_seconds)]
+    logger.debug(f"Expired session names: {expired_session_names}")
+    if len(expired_session_names) > 0:
+        take_down_sessions(kv,expired_session_names,proxy_h=proxy_h,
+            cv_proxypath_dict=cv_proxypath_dict)
 
-        # Neuroglancer container - there will just be one per session
-        ng_container_name = session_dict['ng_container_name']
-        container_names_to_kill.append(ng_container_name)
-    
-    # Have to send the containers to viewer-launcher to kill since we are not root 
-    # in this flask container
-    if len(container_names_to_kill) > 0:
-        containers_to_kill_dict = {'list_of_container_names':container_names_to_kill}
-        requests.post('http://viewer-launcher:5005/container_killer',json=containers_to_kill_dict)
+    """ Sessions whose keys expired without being taken down 
+    would otherwise hold on to their viewer budget """
+    SessionScheduler(kv).rebuild_usage()
        
-    return "checked ng viewer health"
\ No newline at end of file
+    return "checked ng viewer health"
@@ -1,8 +1,11 @@
-import os, json, requests, logging, time
+import os, json, requests, logging, time, hashlib, secrets
+from datetime import datetime, timezone
 
 import redis
+from flask import current_app
 
 import progproxy as pp
+from lightserv.ontology.atlas_levels import atlas_levels_session_fields
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -21,6 +24,331 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 logger.addHandler(file_handler)
 
+""" The atlases shown by the Allen and the Princeton mouse atlas ontology viewers """
+ONTOLOGY_VIEWER_ATLAS = 'allen_2017'
+ONTOLOGY_PMA_VIEWER_ATLAS = 'princeton_mouse_atlas'
+
+class ViewerLaunchError(Exception):
+    """ Raised when a neuroglancer container does not
+    report its viewer token in time, e.g. because it crashed """
+    pass
+
+def wait_for_viewer(kv,session_name,timeout=None,ready_key=None):
+    """ Block until the neuroglancer container of a session
+    has started its viewer and return the viewer info (host, port, token).
+
+    The neuroglancer containers push the viewer info onto the redis list
+    <session_name>_viewer_ready (or ready_key if given) when they are ready, 
+    so this waits with BLPOP instead of polling the session hash.
+    Raises ViewerLaunchError if the viewer is not ready within timeout seconds
+    (NG_VIEWER_LAUNCH_TIMEOUT_SECONDS by default) """
+    if timeout is None:
+        timeout = current_app.config['NG_VIEWER_LAUNCH_TIMEOUT_SECONDS']
+    if ready_key is None:
+        ready_key = f'{session_name}_viewer_ready'
+    # The viewer may have been ready before we started waiting,
+    # in which case the list entry is still there for BLPOP
+    result = kv.blpop(ready_key,timeout=timeout)
+    if result is None:
+        logger.error(f"Neuroglancer viewer for session {session_name} "
+                     f"was not ready after {timeout} seconds")
+        raise ViewerLaunchError(session_name)
+    _, viewer_json_str = result
+    viewer_dict = json.loads(viewer_json_str)
+    logger.debug(f"Redis contents for viewer")
+    logger.debug(viewer_dict)
+    return viewer_dict
+
+def launch_cloudvolume(cv_dict):
+    """ Ask viewer-launcher to serve a cloudvolume in a neuroglancer session.
+    All cloudvolumes of a session are served by one precomputed server
+    container, each under its own path prefix.
+
+    cv_dict needs cv_path, cv_name, cv_container_name, layer_type and session_name.
+    Returns the name of the container serving the cloudvolume
+    and the target for its confproxy route """
+    response = requests.post('http://viewer-launcher:5005/cvserver_launcher',json=cv_dict)
+    response_dict = response.json()
+    return response_dict['container_name'], response_dict['proxytarget']
+
+def get_redis():
+    """ The redis instance shared with the neuroglancer containers """
+    if os.environ['FLASK_MODE'] == 'TEST':
+        return redis.Redis(host="testredis", decode_responses=True)
+    return redis.Redis(host="redis", decode_responses=True)
+
+def launch_status_key(session_name):
+    """ The redis hash where the progress of launching a session's viewer is kept,
+    see launch_neuroglancer_session() in tasks.py """
+    return f'{session_name}_launch_status'
+
+def layer_set_hash(payload):
+    """ A content address for the layers of a neuroglancer session payload
+    (see launch_neuroglancer_viewer()): the sha256 of the sorted set
+    of (cv_path, layer_type) of its cloudvolumes. The neuroglancer launcher
+    and the extra session fields are included too since they change
+    how the same layers are displayed. """
+    layers = sorted({(cv_dict['cv_path'],cv_dict['layer_type']) for cv_dict in payload['cv_dict_list']})
+    layer_set = {'layers':layers,
+        'ng_launcher':payload.get('ng_launcher','ng_custom_launcher'),
+        'session_fields':payload.get('session_fields',{})}
+    return hashlib.sha256(json.dumps(layer_set,sort_keys=True).encode('utf-8')).hexdigest()
+
+def session_registry_key(layer_set_hash):
+    """ The redis key holding the name of the live session
+    that displays a set of layers, see claim_session() """
+    return f'ng_session_registry:{layer_set_hash}'
+
+def claim_session(kv,payload):
+    """ Find the live session that displays the layers of this payload,
+    or register the payload's own session as the one that does.
+    Uses SET NX so that only one of several simultaneous requests
+    for the same layers launches containers.
+
+    Returns the name of the session to use, which is the payload's
+    session_name if it needs to be launched """
+    this_layer_set_hash = layer_set_hash(payload)
+    registry_key = session_registry_key(this_layer_set_hash)
+    session_name = payload['session_name']
+    while True:
+        if kv.set(registry_key,session_name,nx=True):
+            kv.hset(session_name,'layer_set_hash',this_layer_set_hash)
+            return session_name
+        live_session_name = kv.get(registry_key)
+        if live_session_name is not None: # unless it expired in the meantime
+            return live_session_name
+
+def release_session(kv,session_name):
+    """ Remove a session from the registry so that no new
+    requests are sent to it, e.g. because it failed to launch or expired """
+    this_layer_set_hash = kv.hget(session_name,'layer_set_hash')
+    if this_layer_set_hash is None:
+        return
+    registry_key = session_registry_key(this_layer_set_hash)
+    if kv.get(registry_key) == session_name:
+        kv.delete(registry_key)
+
+""" Sorted set of session names scored by the unix time of their last activity """
+SESSION_ACTIVITY_INDEX = 'ng_sessions_by_activity'
+
+def session_keys(session_name):
+    """ The redis keys that belong to a session """
+    return [session_name,launch_status_key(session_name),
+        f'cvserver:{session_name}',f'cvserver_started:{session_name}',
+        f'{session_name}_new_viewer',f'{session_name}_viewer_ready']
+
+def touch_session(kv,session_name,last_activity=None):
+    """ Record activity on a session (now by default, or at the unix time last_activity).
+    Moves the session up the activity index that ng_viewer_checker() 
+    expires sessions from and pushes back the TTL of the session's 
+    redis keys, so keys of sessions that are never cleaned up do not pile up """
+    if last_activity is None:
+        last_activity = time.time()
+    ttl = current_app.config['NG_SESSION_TTL_SECONDS']
+    this_layer_set_hash = kv.hget(session_name,'layer_set_hash')
+    pipe = kv.pipeline()
+    pipe.zadd(SESSION_ACTIVITY_INDEX,{session_name:last_activity})
+    for key in session_keys(session_name):
+        pipe.expire(key,ttl)
+    if this_layer_set_hash is not None:
+        pipe.expire(session_registry_key(this_layer_set_hash),ttl)
+    pipe.execute()
+
+def parse_route_timestamp(timestamp_str):
+    """ Convert the last_activity of a confproxy route,
+    e.g. 2020-01-28T18:11:57.026Z (UTC), to unix time """
+    timestamp_dt = datetime.strptime(timestamp_str,'%Y-%m-%dT%H:%M:%S.%fZ')
+    return timestamp_dt.replace(tzinfo=timezone.utc).timestamp()
+
+def session_in_use(kv,session_name,expire_seconds):
+    """ Whether a viewer is still being handed out from a session (its refcount)
+    or was handed out so recently that its user may not have opened it yet """
+    session_dict = kv.hgetall(session_name)
+    if int(session_dict.get('refcount',0)) > 0:
+        return True
+    last_attached = float(session_dict.get('last_attached',0))
+    return time.time() - last_attached < expire_seconds
+
+""" Redis hash of the containers and memory used by the admitted sessions,
+in total and per user (user:<username>:containers etc.), see scheduler.py """
+BUDGET_USAGE_KEY = 'ng_budget_usage'
+
+def release_session_budget(kv,session_name):
+    """ Give back the containers and memory a session was admitted with.
+    Only the first call for a session does anything """
+    username,containers,memory_mb = kv.hmget(session_name,
+        'admitted_username','admitted_containers','admitted_memory_mb')
+    if username is None or not kv.hdel(session_name,'admitted_username'):
+        return
+    pipe = kv.pipeline()
+    pipe.hincrby(BUDGET_USAGE_KEY,'containers',-int(containers))
+    pipe.hincrby(BUDGET_USAGE_KEY,'memory_mb',-int(memory_mb))
+    pipe.hincrby(BUDGET_USAGE_KEY,f'user:{username}:containers',-int(containers))
+    pipe.hincrby(BUDGET_USAGE_KEY,f'user:{username}:memory_mb',-int(memory_mb))
+    pipe.execute()
+
+def take_down_sessions(kv,session_names,proxy_h=None,cv_proxypath_dict=None):
+    """ Shut down the viewers and cloudvolumes of sessions, 
+    remove them from the proxy table and from redis
+    and give back their budget. 
+
+    cv_proxypath_dict (session_name -> list of proxypaths) can add 
+    cloudvolume routes that are not in the session hashes, 
+    e.g. from sessions made by hand in the example routes """
+    if len(session_names) == 0:
+        return
+    if cv_proxypath_dict is None:
+        cv_proxypath_dict = {}
+    if proxy_h is None:
+        proxy_h = pp.progproxy(target_hname='confproxy',
+            max_workers=current_app.config['NG_LAUNCH_MAX_WORKERS'])
+
+    """ Stop sending new requests to the sessions """
+    for session_name in session_names:
+        release_session(kv,session_name)
+
+    """ Read the containers of all sessions at once """
+    pipe = kv.pipeline()
+    for session_name in session_names:
+        pipe.hgetall(session_name)
+    session_dicts = pipe.execute()
+
+    proxypaths_to_delete = []
+    container_names_by_host = {} # docker_host -> container names, see viewer-launcher hosts.py
+    for session_name,session_dict in zip(session_names,session_dicts):
+        container_names_to_kill = container_names_by_host.setdefault(
+            session_dict.get('docker_host'),[])
+        proxypaths_to_delete.append(f'/viewers/{session_name}')
+        session_cv_proxypaths = set(cv_proxypath_dict.get(session_name,[]))
+        # Cloudvolume containers, there might not always be cloudvolumes
+        cv_count = int(session_dict.get('cv_count',0))
+        for i in range(cv_count):
+            cv_name = session_dict.get('cv%i_name' % (i+1))
+            # shared atlases have a route of their own under /cloudvols/atlas that stays up
+            if session_dict.get('cv%i_shared' % (i+1)):
+                continue
+            if cv_name:
+                session_cv_proxypaths.add(f'/cloudvols/{session_name}/{cv_name}')
+            cv_container_name = session_dict.get('cv%i_container_name' % (i+1))
+            # the cloudvolumes of a session usually share one precomputed server container
+            if cv_container_name and cv_container_name not in container_names_to_kill:
+                container_names_to_kill.append(cv_container_name)
+        proxypaths_to_delete.extend(sorted(session_cv_proxypaths))
+        # Neuroglancer container - there will just be one per session
+        if 'ng_container_name' in session_dict:
+            container_names_to_kill.append(session_dict['ng_container_name'])
+    logger.debug("proxypaths to delete:")
+    logger.debug(proxypaths_to_delete)
+
+    """ Delete the proxy routes in parallel """
+    proxy_h.deleteroutes(proxypaths_to_delete)
+
+    """ Take down the actual docker containers for both neuroglancer viewer 
+    and cloudvolumes that were launched for each session. 
+    Have to send the containers to viewer-launcher to kill since we are not root 
+    in this flask container. Sessions without a docker_host are looked for on every host """
+    logger.debug("removing cloudvolume/neuroglancer containers of the sessions")
+    for docker_host,container_names_to_kill in container_names_by_host.items():
+        if len(container_names_to_kill) == 0:
+            continue
+        containers_to_kill_dict = {'list_of_container_names':container_names_to_kill,
+            'docker_host':docker_host}
+        requests.post('http://viewer-launcher:5005/container_killer',json=containers_to_kill_dict)
+
+    """ Finally give back their budget and remove the sessions from redis """
+    for session_name in session_names:
+        release_session_budget(kv,session_name)
+    pipe = kv.pipeline()
+    for session_name in session_names:
+        pipe.delete(*session_keys(session_name))
+    pipe.zrem(SESSION_ACTIVITY_INDEX,*session_names)
+    pipe.execute()
+
+def make_viewer_url(session_name,viewer_dict,url_scheme='http'):
+    """ The link to a viewer of a session.
+    hosturl/nglancer is reverse proxied to 8080 inside the ng container """
+    hosturl = os.environ['HOSTURL'] # via dockerenv
+    return f"{url_scheme}://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/"
+
+def attach_neuroglancer_viewer(kv,session_name,url_scheme='http'):
+    """ Get a new viewer on the neuroglancer container of a live session
+    and return the link to it. The new viewer starts from the session's 
+    initial layers and layout but has its own state, so users of the same 
+    session do not move each other's views around.
+
+    The container may still be starting, in which case it 
+    answers the request once its first viewer is ready """
+    reply_key = f'{session_name}_new_viewer_{secrets.token_hex(4)}'
+    kv.rpush(f'{session_name}_new_viewer',reply_key)
+    viewer_dict = wait_for_viewer(kv,session_name,ready_key=reply_key)
+    return make_viewer_url(session_name,viewer_dict,url_scheme)
+
+def launch_neuroglancer_viewer(payload,kv=None):
+    """ Launches the cloudvolumes and the neuroglancer viewer of a session,
+    registers them with the configurable proxy and returns the link to the viewer.
+
+    The payload is a dictionary with:
+    session_name    - the name of the session
+    cv_dict_list    - list of cloudvolume dictionaries (see launch_cloudvolume()),
+                      each also with its cv_number (1-indexed) and shared=True for
+                      an atlas served by viewer-launcher's shared atlas servers
+    ng_launcher     - (optional) the viewer-launcher route for the neuroglancer container,
+                      ng_custom_launcher by default
+    session_fields  - (optional) extra fields for the session hash in redis, e.g. cvs_need_atlas
+    url_scheme      - (optional) http or https for the returned link, http by default
+
+    The whole session is launched with one call to viewer-launcher's /session_launcher,
+    which starts all of the containers at the same time and returns once they are healthy.
+    Raises ViewerLaunchError if they are not healthy within NG_VIEWER_LAUNCH_TIMEOUT_SECONDS.
+    """
+    hosturl = os.environ['HOSTURL'] # via dockerenv
+    if kv is None:
+        kv = get_redis()
+
+    session_name = payload['session_name']
+    session_fields = {"cv_count":0} # initialize the number of cloudvolumes in this ng session
+    session_fields.update(payload.get('session_fields',{}))
+    kv.hmset(session_name,session_fields)
+    touch_session(kv,session_name)
+
+    timeout = current_app.config['NG_VIEWER_LAUNCH_TIMEOUT_SECONDS']
+    session_spec = {
+        'session_name':session_name,
+        'cv_dict_list':payload['cv_dict_list'],
+        'ng_launcher':payload.get('ng_launcher','ng_custom_launcher'),
+        'hosturl':hosturl,
+        'timeout':timeout}
+    # leave viewer-launcher time to start the containers on top of the health checks
+    response = requests.post('http://viewer-launcher:5005/session_launcher',
+        json=session_spec,timeout=timeout+60)
+    # the keys made while launching get their TTL too
+    touch_session(kv,session_name)
+    if response.status_code != 200:
+        logger.error(f"viewer-launcher could not launch session {session_name}: {response.text}")
+        raise ViewerLaunchError(session_name)
+    viewer_dict = response.json()['viewer']
+    logger.debug(f"Launched session {session_name} with viewer:")
+    logger.debug(viewer_dict)
+    
+    return make_viewer_url(session_name,viewer_dict,payload.get('url_scheme','http'))
+
+def serve_atlas_levels(atlas_name):
+    """ Returns the session fields that let an ontology viewer switch between
+    the pre-built hierarchy levels of an atlas (see ontology/atlas_levels.py),
+    or an empty dict if they were not built. The levels are served from
+    the shared atlas server of viewer-launcher at /cloudvols/atlas/<atlas_name>,
+    which is started here if no session has used the atlas yet """
+    session_fields = atlas_levels_session_fields(atlas_name)
+    if not session_fields:
+        return {}
+    cv_path = current_app.config['ATLAS_PRECOMPUTED_DIRECTORY_DICTIONARY'][atlas_name]
+    response = requests.post('http://viewer-launcher:5005/shared_atlas_launcher',
+        json={'cv_name':atlas_name,'cv_path':cv_path})
+    if response.status_code != 200:
+        logger.error(f"viewer-launcher could not serve the atlas {atlas_name}: {response.text}")
+        return {}
+    return session_fields
+
 def generate_neuroglancer_url(payload,ng_image=None):
     """ A convenience function that takes a list of cloudvolume paths/metadata
     and launches cloudvolume containers and a neuroglancer viewer container
@@ -28,87 +356,11 @@ def generate_neuroglancer_url(payload,ng_image=None):
     containers are registered with the configurable proxy.
 
     """
-    config_proxy_auth_token = os.environ['CONFIGPROXY_AUTH_TOKEN']
-    hosturl = os.environ['HOSTURL'] # via dockerenv
-    
-    # Redis setup for this session
-    kv = redis.Redis(host="redis", decode_responses=True)
-
-    session_name = payload['session_name']
-    kv.hmset(session_name,{"cv_count":0}) # initialize the number of cloudvolumes in this ng session
-
-    # Connect to progproxy so I can communicate with it
-    proxy_h = pp.progproxy(target_hname='confproxy')
-
-    # Set up environment to be shared by all cloudvolumes
-    cv_environment = {
-    'PYTHONPATH':'/opt/libraries',
-    'CONFIGPROXY_AUTH_TOKEN':f"{config_proxy_auth_token}",
-    'SESSION_NAME':session_name
-    }
-
-    cv_dict_list = payload['cv_dict_list']
-    cv_number=0
-    for cv_dict in cv_dict_list:
-        cv_number = cv_dict['cv_number']
-        cv_container_name = cv_dict['cv_container_name']
-        cv_name = cv_dict['cv_name']
-        layer_type = cv_dict['layer_type']
-
-        """ send the data to the viewer-launcher
-        to launch the cloudvolume """                       
-        requests.post('http://viewer-launcher:5005/cvlauncher',json=cv_dict)
-        logger.debug("Made post request to viewer-launcher to launch cloudvolume")
-
-        """ Enter the cv information into redis
-        so I can get it from within the neuroglancer container """
-        kv.hmset(session_name, {f"cv{cv_number}_container_name": cv_container_name,
-            f"cv{cv_number}_name": cv_name, f"layer{cv_number}_type":layer_type})
-        # increment the number of cloudvolumes so it is up to date
-        kv.hincrby(session_name,'cv_count',1)
-        # register with the confproxy so that it can be seen from outside the nglancer network
-        proxypath = os.path.join('cloudvols',session_name,cv_name)
-        proxy_h.addroute(proxypath=proxypath,proxytarget=f"http://{cv_container_name}:1337")
-
-    """ Neuroglancer viewer container """
-    ng_container_name = f'{session_name}_ng_container'
-    ng_dict = {}
-    ng_dict['hosturl'] = hosturl
-    ng_dict['ng_container_name'] = ng_container_name
-    ng_dict['session_name'] = session_name
-    """ send the data to the viewer-launcher
-    to launch the ng viewer """                       
+    payload = dict(payload)
     if ng_image == 'custom' or not ng_image:
-        requests.post('http://viewer-launcher:5005/ng_custom_launcher',json=ng_dict)
+        payload['ng_launcher'] = 'ng_custom_launcher'
     elif ng_image == 'ontology':
-        requests.post('http://viewer-launcher:5005/ng_ontology_launcher',json=ng_dict)
-    logger.debug("Made post request to viewer-launcher to launch ng custom viewer")
-    
-    # Add the ng container name to redis session key level
-    kv.hmset(session_name, {"ng_container_name": ng_container_name})
-    # Add ng viewer url to config proxy so it can be seen from outside of the lightserv docker network 
-    proxy_h.addroute(proxypath=f'viewers/{session_name}', 
-        proxytarget=f"http://{ng_container_name}:8080/")
-    # if ng_image == 'ontology':
-    #     proxy_h.addroute(proxypath=f'ng_api', 
-    #         proxytarget=f"http://{ng_container_name}:5000/")
-    logger.debug(f"Added {ng_container_name} to redis and confproxy")
-
-    # Spin until the neuroglancer viewer token from redis becomes available 
-    # (may be waiting on the neuroglancer container to finish writing to redis)
-    # This happens in the post request to viewer-launcher
-    while True:
-        session_dict = kv.hgetall(session_name)
-        if 'viewer' in session_dict.keys():
-            break
-        else:
-            logger.debug("Still spinning; waiting for redis entry for neuoglancer viewer")
-            time.sleep(0.25)
-    viewer_json_str = kv.hgetall(session_name)['viewer']
-    viewer_dict = json.loads(viewer_json_str)
-    logger.debug(f"Redis contents for viewer")
-    logger.debug(viewer_dict)
-    proxy_h.getroutes()
-    
-    neuroglancerurl = f"http://{hosturl}/nglancer/{session_name}/v/{viewer_dict['token']}/" # localhost/nglancer is reverse proxied to 8080 inside the ng container
-    return neuroglancerurl
\ No newline at end of file
+        payload['ng_launcher'] = 'ng_ontology_launcher'
+        payload['session_fields'] = dict(payload.get('session_fields',{}),
+            **serve_atlas_levels(ONTOLOGY_VIEWER_ATLAS))
+    return launch_neuroglancer_viewer(payload)
@@ -0,0 +1,137 @@
+""" Offline builder of the hierarchy levels of the atlases.
+
+For each atlas, the annotation volume is remapped once per depth of its
+ontology, merging every region deeper than that depth into its ancestor
+(see remap.depth_lookup_table()). Each level is a precomputed segmentation
+layer in <atlas precomputed directory>/levels/<depth>, next to the atlas
+layer itself, so the shared atlas server already serves it at
+/cv/atlas/<atlas name>/levels/<depth>. The ontology viewers then go up
+or down the hierarchy by swapping the source of the atlas layer instead
+of adding to its equivalences.
+
+Run in the flask container, e.g.:
+    python -m lightserv.ontology.atlas_levels allen_2017 --processes 8
+"""
+
+import os
+import json
+import logging
+import argparse
+import pkg_resources
+
+import numpy as np
+
+from ontology_index import OntologyIndex
+from lightserv.config import BaseConfig
+from . import remap
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate=False
+
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+file_handler = logging.FileHandler('logs/ontology_atlas_levels.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+DATA_PATH = pkg_resources.resource_filename('lightserv', 'data') # package name first then subdirectory next
+
+""" Written last in the levels directory, listing the levels that were built """
+LEVELS_FILE = 'levels.json'
+
+def levels_directory(atlas_dir):
+    return os.path.join(atlas_dir,'levels')
+
+def read_atlas_levels(atlas_dir):
+    """ The depths of the levels built for an atlas,
+    or an empty list if none were built """
+    try:
+        with open(os.path.join(levels_directory(atlas_dir),LEVELS_FILE)) as levels_file:
+            return json.load(levels_file)['levels']
+    except (OSError,ValueError,KeyError):
+        return []
+
+def atlas_levels_session_fields(atlas_name):
+    """ The session fields that let an ontology viewer switch between 
+    the levels of an atlas, or an empty dict if they were not built.
+    atlas_name must be the name the shared atlas server is routed by """
+    atlas_dir = BaseConfig.ATLAS_PRECOMPUTED_DIRECTORY_DICTIONARY.get(atlas_name)
+    levels = read_atlas_levels(atlas_dir) if atlas_dir else []
+    if not levels:
+        return {}
+    return {'atlas_levels_name':atlas_name,
+        'atlas_levels':','.join(str(level) for level in levels)}
+
+def build_atlas_levels(annotation_file,ontology_file,atlas_dir,
+    depths=None,processes=None,force=False):
+    """
+    ---PURPOSE---
+    Write one precomputed segmentation layer per hierarchy level of an atlas
+    ---INPUT---
+    annotation_file     The annotation tif of the atlas, in z,y,x order
+    ontology_file       The nested ontology JSON whose ids are the ids in annotation_file.
+                        Raises ValueError if the volume has any other id than 0
+    atlas_dir           The precomputed layer of the atlas. Its info file
+                        gives the resolution of the levels
+    depths              The depths to build, all of the depths of the ontology if None
+    processes           How many processes to remap each level in
+    force               Rebuild levels that were already built
+    ---OUTPUT---
+    The list of depths built
+    """
+    index = OntologyIndex.from_json(ontology_file)
+    if depths is None:
+        depths = list(range(int(index.depth_array.max())+1))
+    with open(os.path.join(atlas_dir,'info')) as info_file:
+        atlas_scale = json.load(info_file)['scales'][0]
+    volume = remap.open_volume(annotation_file)
+    shape,dtype = volume.shape,volume.dtype
+    if list(atlas_scale['size']) != [shape[2],shape[1],shape[0]]:
+        raise ValueError(f"{annotation_file} has shape {shape} (z,y,x) "
+            f"but the atlas layer {atlas_dir} has size {atlas_scale['size']} (x,y,z)")
+    # every id of the volume must be in the ontology, or it could not be merged
+    volume_ids = np.unique(volume)
+    del volume
+    remap.check_volume_ids(index,volume_ids)
+    for depth in depths:
+        layer_dir = os.path.join(levels_directory(atlas_dir),str(depth))
+        if not force and os.path.exists(os.path.join(layer_dir,'info')):
+            logger.debug(f"Level {depth} already built in {layer_dir}")
+            continue
+        lut = remap.depth_lookup_table(index,depth,volume_ids,dtype=dtype)
+        remap.remap_annotation_volume(annotation_file,lut,layer_dir,
+            resolution=atlas_scale['resolution'],processes=processes)
+    with open(os.path.join(levels_directory(atlas_dir),LEVELS_FILE),'w') as levels_file:
+        json.dump({'levels':sorted(depths)},levels_file)
+    return depths
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the hierarchy levels of the atlases")
+    parser.add_argument('atlas_names',nargs='*',
+        help='keys of ATLAS_ANNOTATION_FILE_DICTIONARY, all atlases with an ontology if none')
+    parser.add_argument('--processes',type=int,default=None)
+    parser.add_argument('--force',action='store_true',help='rebuild levels that were already built')
+    args = parser.parse_args()
+
+    atlas_names = args.atlas_names or list(BaseConfig.ATLAS_ANNOTATION_FILE_DICTIONARY.keys())
+    for atlas_name in atlas_names:
+        ontology_filename = BaseConfig.ATLAS_ONTOLOGY_FILE_DICTIONARY.get(atlas_name)
+        atlas_dir = BaseConfig.ATLAS_PRECOMPUTED_DIRECTORY_DICTIONARY.get(atlas_name)
+        if not ontology_filename or not atlas_dir:
+            logger.info(f"Skipping {atlas_name}, it has no ontology or no precomputed layer")
+            continue
+        logger.info(f"Building the hierarchy levels of {atlas_name}")
+        build_atlas_levels(BaseConfig.ATLAS_ANNOTATION_FILE_DICTIONARY[atlas_name],
+            os.path.join(DATA_PATH,ontology_filename),atlas_dir,
+            processes=args.processes,force=args.force)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+""" Local store of the atlas and annotation volumes.
+
+Reading an atlas tif from /jukebox takes seconds and gives every process
+its own copy. Instead, each tif is converted once into an uncompressed
+.npy file in ATLAS_STORE_DIR on local disk, which every process opens
+with a read only memory map, so they all share the page cache.
+
+The registry (registry.json in the store) records, for each source tif,
+its size, modification time and checksum and the .npy it was converted to.
+A tif whose size or modification time changed is checksummed again and
+converted again if its contents changed.
+
+To convert all of the atlases ahead of time, run in the flask container:
+    python -m lightserv.ontology.atlas_store
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+import tifffile as tif
+
+from lightserv.config import BaseConfig
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate=False
+
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+file_handler = logging.FileHandler('logs/ontology_atlas_store.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+REGISTRY_FILE = 'registry.json'
+LOCK_FILE = 'registry.lock'
+
+def file_checksum(path,block_size=1<<22):
+    sha1 = hashlib.sha1()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(block_size),b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+@contextmanager
+def store_lock(store_dir):
+    """ Only one process at a time reads and updates the registry,
+    so an atlas is converted once even if several workers ask for it """
+    os.makedirs(store_dir,exist_ok=True)
+    with open(os.path.join(store_dir,LOCK_FILE),'w') as lock_file:
+        fcntl.flock(lock_file,fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file,fcntl.LOCK_UN)
+
+def read_registry(store_dir):
+    try:
+        with open(os.path.join(store_dir,REGISTRY_FILE)) as registry_file:
+            return json.load(registry_file)
+    except (OSError,ValueError):
+        return {}
+
+def write_registry(store_dir,registry):
+    tmp_path = os.path.join(store_dir,REGISTRY_FILE + '.tmp')
+    with open(tmp_path,'w') as registry_file:
+        json.dump(registry,registry_file,indent=1)
+    os.replace(tmp_path,os.path.join(store_dir,REGISTRY_FILE))
+
+def convert_atlas(tif_file,npy_path):
+    """ Write the volume of a tif to an uncompressed .npy, atomically """
+    volume = tif.imread(tif_file)
+    tmp_path = npy_path + '.tmp'
+    with open(tmp_path,'wb') as npy_file:
+        np.save(npy_file,volume)
+    os.replace(tmp_path,npy_path)
+    return volume.shape,volume.dtype.str
+
+def atlas_entry(tif_file,store_dir=None):
+    """
+    ---PURPOSE---
+    Get the registry entry of an atlas tif in the store,
+    converting the tif if it is not in the store or it changed
+    ---INPUT---
+    tif_file     The atlas or annotation tif
+    store_dir    The store directory, ATLAS_STORE_DIR if None
+    ---OUTPUT---
+    entry        dict with the npy_path of the .npy in the store, the checksum
+                 of the tif and its shape, dtype, size and mtime_ns
+    """
+    if store_dir is None:
+        store_dir = BaseConfig.ATLAS_STORE_DIR
+    tif_file = os.path.realpath(tif_file)
+    source_stat = os.stat(tif_file)
+    with store_lock(store_dir):
+        registry = read_registry(store_dir)
+        entry = registry.get(tif_file)
+        if entry and os.path.exists(entry['npy_path']):
+            if [entry['size'],entry['mtime_ns']] == [source_stat.st_size,source_stat.st_mtime_ns]:
+                return entry
+        checksum = file_checksum(tif_file)
+        if not (entry and entry['checksum'] == checksum and os.path.exists(entry['npy_path'])):
+            name = os.path.splitext(os.path.basename(tif_file))[0]
+            npy_path = os.path.join(store_dir,f'{name}-{checksum[:16]}.npy')
+            logger.debug(f"Converting {tif_file} to {npy_path}")
+            shape,dtype = convert_atlas(tif_file,npy_path)
+            if entry and entry['npy_path'] != npy_path and os.path.exists(entry['npy_path']):
+                os.remove(entry['npy_path'])
+            entry = dict(npy_path=npy_path,checksum=checksum,
+                shape=list(shape),dtype=dtype)
+        entry.update(size=source_stat.st_size,mtime_ns=source_stat.st_mtime_ns)
+        registry[tif_file] = entry
+        write_registry(store_dir,registry)
+        return entry
+
+def atlas_path(tif_file,store_dir=None):
+    """ The path of the .npy of an atlas tif in the store, see atlas_entry() """
+    return atlas_entry(tif_file,store_dir=store_dir)['npy_path']
+
+def open_atlas(tif_file,store_dir=None):
+    """ A read only memory map of the volume of an atlas tif, see atlas_entry() """
+    return np.load(atlas_path(tif_file,store_dir=store_dir),mmap_mode='r')
+
+def main():
+    """ Convert every atlas and annotation volume in the config """
+    tif_files = set(BaseConfig.ATLAS_NAME_FILE_DICTIONARY.values()) | \
+        set(BaseConfig.ATLAS_ANNOTATION_FILE_DICTIONARY.values())
+    for tif_file in sorted(tif_files):
+        logger.info(f"{tif_file} is stored at {atlas_path(tif_file)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+""" Remap the region ids of an annotation volume to a collapsed ontology.
+
+Every region that is hidden in the collapsed ontology is given the id of
+its closest shown ancestor. Instead of one full volume comparison per region,
+the reassignments are put in a dense lookup table (lut[old_id] = new_id)
+which is applied in a single pass with np.take. The volume is streamed in
+z-slabs from a memory map (see atlas_store.py), optionally across a process
+pool, and each slab is written straight out as one row of chunks of a
+precomputed segmentation layer. """
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import atlas_store
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate=False
+
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+file_handler = logging.FileHandler('logs/ontology_remap.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+""" Chunk size of the precomputed layer, in x,y,z.
+The slabs are one chunk deep in z """
+CHUNK_SIZE = (64,64,64)
+
+def make_lookup_table(ID_reassignment_dict,dtype=np.uint16,max_id=None):
+    """
+    ---PURPOSE---
+    Make the dense lookup table that maps every id in an
+    annotation volume to its id in the collapsed ontology
+    ---INPUT---
+    ID_reassignment_dict     A reassignment dictionary, e.g. {0:[1,2,3,4],5:[6,7,8,9]},
+                             as made by utils.make_ID_reassignment_dict()
+    dtype                    The data type of the annotation volume
+    max_id                   The largest id in the volume. Needed for data types
+                             wider than 16 bits, where a table of every possible
+                             value would be too big
+    ---OUTPUT---
+    lut                      1D array such that lut[old_id] = new_id
+    """
+    dtype = np.dtype(dtype)
+    if max_id is None:
+        max_id = np.iinfo(dtype).max
+    lut = np.arange(max_id+1,dtype=dtype)
+    # ids that do not fit in the lookup table cannot be in the volume
+    for target_val,input_vals in ID_reassignment_dict.items():
+        if target_val > max_id:
+            continue
+        input_vals = np.asarray(input_vals,dtype=np.int64)
+        lut[input_vals[input_vals <= max_id]] = target_val
+    return lut
+
+def check_volume_ids(index,volume_ids):
+    """ Raise if the annotation volume has ids that are not regions of the
+    ontology (other than the background, 0), e.g. an annotation volume whose
+    ids were renumbered to fit in 16 bits, which cannot be merged by the ontology """
+    volume_ids = np.asarray(volume_ids,dtype=np.int64)
+    unknown_ids = np.setdiff1d(volume_ids[volume_ids != 0],index.ids)
+    if len(unknown_ids):
+        raise ValueError(f"{len(unknown_ids)} ids of the annotation volume are not "
+            f"in the ontology, e.g. {unknown_ids[:10].tolist()}")
+
+def depth_lookup_table(index,depth,volume_ids,dtype=np.uint16):
+    """
+    ---PURPOSE---
+    Make the lookup table that merges every region 
+    deeper than depth into its ancestor at depth
+    ---INPUT---
+    index           The OntologyIndex of the atlas ontology
+    depth           The hierarchy level to keep, 0 is the root
+    volume_ids      The ids in the annotation volume, e.g. np.unique(volume).
+                    Every one of them except 0 must be a region of the ontology
+    dtype           The data type of the annotation volume
+    ---OUTPUT---
+    lut             1D array such that lut[old_id] = new_id
+    """
+    dtype = np.dtype(dtype)
+    volume_ids = np.asarray(volume_ids,dtype=np.int64)
+    check_volume_ids(index,volume_ids)
+    # climb every region too deep for this level one parent at a time, all at once
+    ancestor = np.arange(len(index))
+    too_deep = index.depth_array[ancestor] > depth
+    while too_deep.any():
+        ancestor[too_deep] = index.parent_position[ancestor[too_deep]]
+        too_deep = index.depth_array[ancestor] > depth
+    region_ids = volume_ids[volume_ids != 0]
+    positions = np.array([index.position(region_id) for region_id in region_ids],dtype=np.int64)
+    ancestor_ids = index.ids[ancestor[positions]]
+    if len(ancestor_ids) and ancestor_ids.max() > np.iinfo(dtype).max:
+        raise ValueError(f"Level {depth} merges regions into ids up to "
+            f"{ancestor_ids.max()}, which do not fit in {dtype.name}")
+    lut = np.arange(int(volume_ids.max())+1 if len(volume_ids) else 1,dtype=dtype)
+    lut[region_ids] = ancestor_ids
+    return lut
+
+def lookup_table_hash(lut):
+    """ A short name for a lookup table, so that a collapsed
+    ontology that was already remapped does not need to be remapped again """
+    return hashlib.sha1(lut.tobytes()).hexdigest()[:16]
+
+def remap_layer_key(annotation_file,lut):
+    """ The name of the layer that remapping an annotation volume with a
+    lookup table makes. It includes the checksum of the annotation volume
+    in the atlas store, so that a layer remapped from an older
+    version of the volume is not used once the volume changes """
+    checksum = atlas_store.atlas_entry(annotation_file)['checksum']
+    return f'{checksum[:16]}-{lookup_table_hash(lut)}'
+
+def open_volume(annotation_file):
+    """ Memory map the annotation volume from the local atlas store,
+    so slabs are read as they are needed and processes share the pages """
+    return atlas_store.open_atlas(annotation_file)
+
+def scale_key(resolution):
+    return '_'.join(str(int(r)) for r in resolution)
+
+def chunk_name(x0,x1,y0,y1,z0,z1):
+    return f'{x0}-{x1}_{y0}-{y1}_{z0}-{z1}'
+
+def write_info(layer_dir,shape,dtype,resolution,chunk_size=CHUNK_SIZE):
+    """
+    ---PURPOSE---
+    Write the info file of a single scale, raw encoded
+    precomputed segmentation layer
+    ---INPUT---
+    layer_dir     The directory of the precomputed layer
+    shape         The (z,y,x) shape of the volume
+    dtype         The data type of the volume
+    resolution    The (x,y,z) voxel size in nanometers
+    """
+    info = {
+        'type':'segmentation',
+        'data_type':np.dtype(dtype).name,
+        'num_channels':1,
+        'scales':[{
+            'key':scale_key(resolution),
+            'size':[int(shape[2]),int(shape[1]),int(shape[0])],
+            'resolution':[int(r) for r in resolution],
+            'voxel_offset':[0,0,0],
+            'chunk_sizes':[list(chunk_size)],
+            'encoding':'raw'
+            }]
+        }
+    with open(os.path.join(layer_dir,'info'),'w') as info_file:
+        json.dump(info,info_file)
+
+def remap_slab(npy_path,lut,z0,z1,scale_dir,chunk_size=CHUNK_SIZE,compress=True):
+    """
+    ---PURPOSE---
+    Remap the z0:z1 slab of the annotation volume and write it out
+    as chunks of the precomputed layer. Each process opens its own
+    memory map so the volume is never copied between processes
+    ---INPUT---
+    npy_path            The .npy of the annotation volume in the atlas store, in z,y,x order
+    lut                 The lookup table made by make_lookup_table()
+    z0,z1               The slab to remap
+    scale_dir           The directory the chunks go in
+    chunk_size          The (x,y,z) chunk size of the layer
+    compress            Whether to write gzipped chunks (<chunk>.gz)
+    """
+    volume = np.load(npy_path,mmap_mode='r')
+    slab = np.take(lut,volume[z0:z1])
+    chunk_x,chunk_y,_ = chunk_size
+    _,size_y,size_x = volume.shape
+    for y0 in range(0,size_y,chunk_y):
+        y1 = min(y0+chunk_y,size_y)
+        for x0 in range(0,size_x,chunk_x):
+            x1 = min(x0+chunk_x,size_x)
+            # C order bytes of a z,y,x block are x fastest, as precomputed wants
+            data = slab[:,y0:y1,x0:x1].tobytes()
+            path = os.path.join(scale_dir,chunk_name(x0,x1,y0,y1,z0,z1))
+            if compress:
+                with open(path + '.gz','wb') as chunk_file:
+                    chunk_file.write(gzip.compress(data,compresslevel=1))
+            else:
+                with open(path,'wb') as chunk_file:
+                    chunk_file.write(data)
+    return z1 - z0
+
+def _remap_slab_star(args):
+    return remap_slab(*args)
+
+def remap_annotation_volume(annotation_file,lut,layer_dir,resolution,
+    processes=None,chunk_size=CHUNK_SIZE,compress=True):
+    """
+    ---PURPOSE---
+    Remap a whole annotation volume with a lookup table
+    and write it as a precomputed segmentation layer
+    ---INPUT---
+    annotation_file     The annotation tif, in z,y,x order
+    lut                 The lookup table made by make_lookup_table()
+    layer_dir           The directory of the precomputed layer to write
+    resolution          The (x,y,z) voxel size in nanometers
+    processes           How many processes to remap slabs in.
+                        None or 1 remaps in this process
+    chunk_size          The (x,y,z) chunk size of the layer
+    compress            Whether to write gzipped chunks
+    ---OUTPUT---
+    layer_dir
+    """
+    # Every slab reads the same .npy, even if the annotation tif changes while remapping,
+    # and the workers do not each have to lock and check the atlas store
+    npy_path = atlas_store.atlas_path(annotation_file)
+    volume = np.load(npy_path,mmap_mode='r')
+    shape,dtype = volume.shape,volume.dtype
+    del volume
+    if lut.dtype != dtype:
+        lut = lut.astype(dtype)
+    scale_dir = os.path.join(layer_dir,scale_key(resolution))
+    os.makedirs(scale_dir,exist_ok=True)
+    chunk_z = chunk_size[2]
+    slabs = [(npy_path,lut,z0,min(z0+chunk_z,shape[0]),scale_dir,chunk_size,compress)
+        for z0 in range(0,shape[0],chunk_z)]
+    logger.debug(f"Remapping {annotation_file} in {len(slabs)} slabs to {layer_dir}")
+    if processes and processes > 1:
+        with Pool(processes) as p:
+            for _ in p.imap_unordered(_remap_slab_star,slabs):
+                pass
+    else:
+        for slab in slabs:
+            remap_slab(*slab)
+    # The info file goes in last, so a layer with an info file is complete
+    write_info(layer_dir,shape,dtype,resolution,chunk_size=chunk_size)
+    logger.debug(f"Finished remapping to {layer_dir}")
+    return layer_dir
@@ -1,23 +1,40 @@
-from flask import render_template, request, redirect, Blueprint, session, url_for, flash, Markup
+from flask import render_template, request, redirect, Blueprint, session, url_for, flash, Markup, jsonify
 # from lightserv.models import Experiment
 from lightserv import db_lightsheet
+from lightserv.neuroglancer.utils import get_redis
 import pandas as pd
 from . import utils
-from functools import partial
+from . import remap
+from .tasks import start_ontology_remap, remap_status_key
+import logging
 
 
-import numpy as np
 import graphviz 
-import tifffile as tif
-from multiprocessing import Pool #  Process pool
-from multiprocessing import sharedctypes
 
 from lightserv.ontology.forms import OntologySubmitForm
 
 # from lightserv.experiments.routes import experiments
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate=False
+
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+file_handler = logging.FileHandler('logs/ontology_routes.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
 annotation_file = '/jukebox/LightSheetTransfer/atlas/allen_atlas/annotation_2017_25um_sagittal_forDVscans_16bit.tif'
 # annotation_file = '/Users/athair/graphviz/annotation_2017_25um_sagittal_forDVscans_16bit.tif'
+annotation_resolution = (25000,25000,25000) # nm
 
 ontology = Blueprint('ontology',__name__)
 
@@ -25,50 +42,51 @@ ontology = Blueprint('ontology',__name__)
 def interactive_ontology():
 	nodename = request.args.get('input_nodename',None) # The node name which was clicked whose children you want to display
 	contract = request.args.get('contract',False) 
-	if contract:
-		G = utils.contract_graph(input_nodename=nodename)
-	else:
-		G = utils.expand_graph(input_nodename=nodename)
+	""" The graph of each user is kept in their session as the set of expanded regions """
+	expanded_ids = utils.decode_expanded_ids(session.get('ontology_expanded_ids'))
+	region_id = utils.ontology_index.id_of(nodename) if nodename else None
+	if region_id is not None:
+		if contract:
+			expanded_ids = utils.contract_region(expanded_ids,region_id)
+		else:
+			expanded_ids = utils.expand_region(expanded_ids,region_id)
+	expanded_ids = utils.visible_expanded_ids(expanded_ids)
+	session['ontology_expanded_ids'] = utils.encode_expanded_ids(expanded_ids)
 
-	G.attr(rankdir='LR')
-	G_output = G.pipe().decode("utf-8")
-	G_output = Markup(G_output)
+	G_output = Markup(utils.render_graph_svg(expanded_ids))
 	if nodename:
 		section = 'a_{}'.format('_'.join(nodename.split(' ')))
 	else:
 		section = None
 	print(section)
 	form = OntologySubmitForm()
+	remap_status_url = None
 	if form.validate_on_submit():
-		G = utils.my_graph
 		reassignment_dict = {}
-		utils.make_ID_reassignment_dict(ontology_dict=utils.ontology_dict,graph=G,output_dict=reassignment_dict)
-		chunked_list_of_tuples = utils.make_tuple_input(ID_reassignment_dict=reassignment_dict,chunk_size=5)
-		global X
-		X = tif.imread(annotation_file)
-		print("read in annotation volume")
-		result = np.ctypeslib.as_ctypes(X)
-		global shared_array
-		shared_array = sharedctypes.RawArray(result._type_, result)
-		with Pool() as p:
-		    res = p.map(ID_reassignment_parallel,chunked_list_of_tuples)
-		    result = np.ctypeslib.as_array(shared_array)
-
-
-	return render_template('ontology/interactive_graph.html', graph_output=G_output, form=form,section=section)
-
-def ID_reassignment_parallel(list_of_tuples):
-    '''
-    ---PURPOSE---
-    Convert integer values in image from one value to another.
-    Updates img in place
-    ---INPUT---
-    list_of_tuples, like: [(input_val_1,target_val_1),(input_val_2,target_val_2),...], where:
-        input_val        The value of the int you want to convert 
-        target_val       The value you want input_val to be converted to
-    '''
-    tmp = np.ctypeslib.as_array(shared_array)
-    for tup in list_of_tuples:
-        target_val,input_val = tup
-        mask = (X == input_val)
-        tmp[mask] = target_val
\ No newline at end of file
+		utils.make_ID_reassignment_dict(expanded_ids=expanded_ids,output_dict=reassignment_dict)
+		lut = remap.make_lookup_table(reassignment_dict)
+		layer_key = remap.remap_layer_key(annotation_file,lut)
+		""" Remapping the whole brain takes too long for a request,
+		so it is done by a celery task and the page polls for it """
+		kv = get_redis()
+		start_ontology_remap(kv,expanded_ids,layer_key,
+			annotation_file=annotation_file,resolution=annotation_resolution)
+		logger.info(f"Started remapping the annotation volume to {layer_key}")
+		remap_status_url = url_for('ontology.remap_status',layer_key=layer_key)
+
+	return render_template('ontology/interactive_graph.html', graph_output=G_output, form=form,
+		section=section,remap_status_url=remap_status_url)
+
+@ontology.route("/ontology/remap_status/<layer_key>")
+def remap_status(layer_key):
+	""" Report the progress of remapping the annotation volume
+	to a collapsed ontology in the background, see remap_ontology() in tasks.py.
+	Polled by the interactive ontology page.
+
+	Returns JSON with the state: pending, remapping, 
+	ready (with the layer_dir) or failed (with the error) """
+	kv = get_redis()
+	status = kv.hgetall(remap_status_key(layer_key))
+	if not status:
+		return jsonify({'state':'unknown'}), 404
+	return jsonify(status)
@@ -0,0 +1,74 @@
+from flask import current_app
+from lightserv import cel
+from lightserv.neuroglancer.utils import get_redis
+import os
+import logging
+from . import utils
+from . import remap
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate=False
+
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+file_handler = logging.FileHandler('logs/ontology_tasks.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+REMAP_STATUS_TTL_SECONDS = 24*60*60
+
+def remap_status_key(layer_key):
+    """ The redis hash where the progress of remapping to a collapsed
+    ontology is kept, see remap_ontology() """
+    return f'ontology_remap:{layer_key}'
+
+def start_ontology_remap(kv,expanded_ids,layer_key,annotation_file,resolution):
+    """ Remap the annotation volume to the collapsed ontology
+    of expanded_ids in the background, unless it is already being remapped.
+    The progress can be followed in redis, see remap_status_key().
+    Remaps that failed are started again """
+    status_key = remap_status_key(layer_key)
+    if kv.hget(status_key,'state') == 'failed':
+        kv.delete(status_key)
+    if not kv.hsetnx(status_key,'state','pending'):
+        logger.debug(f"Remap {layer_key} was already started")
+        return
+    kv.expire(status_key,REMAP_STATUS_TTL_SECONDS)
+    remap_ontology.delay(list(expanded_ids),layer_key,annotation_file,list(resolution))
+
+@cel.task()
+def remap_ontology(expanded_ids,layer_key,annotation_file,resolution):
+    """ A celery task to remap the annotation volume to the collapsed ontology
+    of the expanded regions of the interactive ontology graph,
+    so the request does not have to wait for the whole brain to be remapped.
+    Writes the state (pending, remapping, ready or failed) and the layer
+    directory or the error to the remap status hash in redis,
+    which the remap_status route reads.
+
+    The remap runs in this worker process, since the children of celery's
+    prefork workers are daemonic and cannot start a process pool. """
+    kv = get_redis()
+    status_key = remap_status_key(layer_key)
+    kv.hset(status_key,'state','remapping')
+    layer_dir = os.path.join(current_app.config['ONTOLOGY_REMAP_DIR'],layer_key)
+    try:
+        if not os.path.exists(os.path.join(layer_dir,'info')):
+            reassignment_dict = {}
+            utils.make_ID_reassignment_dict(expanded_ids=expanded_ids,output_dict=reassignment_dict)
+            lut = remap.make_lookup_table(reassignment_dict)
+            remap.remap_annotation_volume(annotation_file,lut,layer_dir,resolution=resolution)
+    except Exception as e:
+        logger.exception(f"Failed to remap {annotation_file} to {layer_dir}")
+        kv.hmset(status_key,{'state':'failed','error':str(e)})
+        raise
+    logger.info(f"Remapped annotation volume is at {layer_dir}")
+    kv.hmset(status_key,{'state':'ready','layer_dir':layer_dir})
+    return layer_dir
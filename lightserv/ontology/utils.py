@@ -1,9 +1,13 @@
 import pkg_resources
 import json
+import base64
+import binascii
+from functools import lru_cache
 
 from flask import url_for
 import numpy as np
 import graphviz
+from ontology_index import OntologyIndex
 
 DATA_PATH = pkg_resources.resource_filename('lightserv', 'data') # package name first then subdirectory next
 
@@ -15,127 +19,130 @@ ontology_file = DATA_PATH + '/allen_ontology.json'
 with open(ontology_file) as json_file:
     ontology_dict = json.load(json_file)
 
-my_test_graph = graphviz.Digraph(format='svg',strict=True)
-my_test_graph.attr('node',shape='box')
+ontology_index = OntologyIndex.from_dict(ontology_dict)
 
-my_graph = graphviz.Digraph(name=' ',format='svg',strict=True) # strict means you cant have more than 1 edge between nodes. name is set so to " " so that nothing shows up on hover 
-
-my_graph.attr('node',shape='box')
+""" The state of the interactive graph is the set of expanded region ids,
+kept in each user's session, so users no longer share (and corrupt) one graph.
+The graph is rebuilt from that set and the rendered SVG is memoized by it """
+GRAPH_CACHE_SIZE = 256
 
 table_border = 0
 contract_cell_border=1
 tooltip = ' ' # makes it so that nothing appears when mouse hovers over node
-root_body_str = '''\troot [label=<<TABLE BORDER="{0}">\
-<TR><TD id="root" href="/interactive_ontology?input_nodename=root">root</TD>\
-<TD BORDER="{1}" href="/interactive_ontology?input_nodename=root&amp;contract=True">-</TD>\
-</TR></TABLE>> tooltip="{2}"]'''.format(table_border,contract_cell_border,tooltip)
-# print(root_body_str)
 
-def expand_graph(dic=ontology_dict,graph=my_graph,input_nodename='root'):
+def visible_expanded_ids(expanded_ids,index=ontology_index):
     """ 
     ---PURPOSE---
-    Take an existing graph and add to it the children 
-    of an input_nodename. Recursive function.
+    Drop the expanded regions that are hidden because one of 
+    their ancestors is contracted, so that the same graph
+    always has the same state
     ---INPUT---
-    dic             Dictionary representing the entire ontology graph (with "rank" key included)
-    graph           The graphviz graph object that will be updated.
-                    graph may be a subgraph of the entire graph as long as 
-                    input_nodename is a node name in it
-    input_nodename  The name of the node whose children you want to display
+    expanded_ids    Iterable of the ids of the expanded regions
+    index           The OntologyIndex of the ontology
+    ---OUTPUT---
+    Sorted tuple of the ids of the expanded regions that are shown
     """
-    name = dic.get('name')
-
-    children = dic.get('children')
-    if input_nodename == None and root_body_str not in graph.body: # second check is so that I don't keep remaking the root node
-        href_expand = '/interactive_ontology?input_nodename=root'
-        href_contract = '/interactive_ontology?input_nodename=root&amp;contract=True'
-        graph.node('root',label='''<<TABLE BORDER="{0}"><TR><TD id="root" href="{1}">root</TD>\
-<TD BORDER="{2}" href="{3}">-</TD></TR></TABLE>>'''\
-            .format(table_border,href_expand,contract_cell_border,href_contract),tooltip=tooltip)
-    if name == input_nodename:
-        for child in children: # child is a dict
-            child_name = child.get('name')
-            child_anchor_name = '_'.join(child_name.split(' '))
-            href_expand = '/interactive_ontology?input_nodename={0}'.format(child_name)
-            href_contract = '/interactive_ontology?input_nodename={}&amp;contract=True'.format(child_name)
-            graph.node(child_name,label='''<<TABLE BORDER="{0}"><TR><TD id="{1}" href="{2}">{3}</TD>\
+    root_id = int(index.ids[0])
+    kept = set()
+    for region_id in sorted((x for x in expanded_ids if x in index),key=index.depth):
+        if region_id == root_id or index.parent(region_id) in kept:
+            kept.add(region_id)
+    return tuple(sorted(kept))
+
+def expand_region(expanded_ids,region_id):
+    """ Show the children of a region """
+    return visible_expanded_ids(set(expanded_ids) | {region_id})
+
+def contract_region(expanded_ids,region_id,index=ontology_index):
+    """ Hide all descendents of a region """
+    return tuple(x for x in expanded_ids 
+        if x != region_id and not index.is_descendant(x,region_id))
+
+def encode_expanded_ids(expanded_ids,index=ontology_index):
+    """ Encode the expanded regions as a bitmask over the index so that
+    the state fits in the session cookie however much is expanded """
+    mask = np.zeros(len(index),dtype=bool)
+    mask[[index.position(x) for x in expanded_ids]] = True
+    return base64.urlsafe_b64encode(np.packbits(mask).tobytes()).decode('ascii')
+
+def decode_expanded_ids(encoded,index=ontology_index):
+    """ The inverse of encode_expanded_ids() """
+    if not encoded:
+        return ()
+    try:
+        packed = np.frombuffer(base64.urlsafe_b64decode(encoded.encode('ascii')),dtype=np.uint8)
+    except (ValueError,binascii.Error):
+        return ()
+    mask = np.unpackbits(packed)[:len(index)].astype(bool)
+    if len(mask) != len(index):
+        return ()
+    return tuple(sorted(int(x) for x in index.ids[mask]))
+
+def node_label(name):
+    """ The label of a region: its name, which expands it, 
+    and a "-" cell, which contracts it """
+    anchor_name = '_'.join(name.split(' '))
+    href_expand = '/interactive_ontology?input_nodename={0}'.format(name)
+    href_contract = '/interactive_ontology?input_nodename={0}&amp;contract=True'.format(name)
+    return '''<<TABLE BORDER="{0}"><TR><TD id="{1}" href="{2}">{3}</TD>\
 <TD BORDER="{4}" href="{5}">-</TD></TR></TABLE>>'''\
-                       .format(table_border,child_anchor_name,href_expand,child_name,contract_cell_border,href_contract),tooltip=tooltip)
-            graph.edge(name,child_name)
-        return graph
-     
-    for child in children:
-        expand_graph(child,graph,input_nodename=input_nodename)
-    return graph
+        .format(table_border,anchor_name,href_expand,name,contract_cell_border,href_contract)
 
-def contract_graph(dic=ontology_dict,graph=my_graph,input_nodename='root'):
+def make_graph(expanded_ids,index=ontology_index):
     """ 
     ---PURPOSE---
-    Take an existing graph and remove all descendents
-    of an input_nodename. Recursive function.
+    Make the graph showing the root and the children 
+    of every expanded region
     ---INPUT---
-    dic             Dictionary representing the entire ontology graph (with "rank" key included)
-    graph           The graphviz graph object that will be updated.
-                    graph may be a subgraph of the entire graph as long as 
-                    input_nodename is a node name in it
-    input_nodename  The name of the node whose descendents you want to remove
+    expanded_ids    Tuple of the ids of the expanded regions, from visible_expanded_ids()
+    index           The OntologyIndex of the ontology
+    ---OUTPUT---
+    graph           The graphviz graph object
     """
-    name = dic.get('name')
-    name_label = f'"{name}"' if len(name.split())>1 else name
-    children = dic.get('children')
-    if name == input_nodename:
-        for child in children: # child is a dict
-            child_name = child.get('name')
-            child_anchor_name = '_'.join(child_name.split(' '))
-
-            child_label = f'"{child_name}"' if len(child_name.split())>1 else child_name
-            edge_str = f'\t{name_label} -> {child_label}' 
-#             print(edge_st/r)
-            child_body_str = '\t{0} [label=<<TABLE BORDER="{1}"><TR><TD id="{2}" href="/interactive_ontology?input_nodename={3}">{3}</TD>\
-<TD BORDER="{4}" href="/interactive_ontology?input_nodename={3}&amp;contract=True">-</TD></TR></TABLE>> tooltip="{5}"]'.\
-format(child_label,table_border,child_anchor_name,child_name,contract_cell_border,tooltip)
-
-            if edge_str in graph.body:
-                del graph.body[graph.body.index(edge_str)]
-                del graph.body[graph.body.index(child_body_str)]
-                contract_graph(child,graph,input_nodename=child_name)
-    for child in children:
-        contract_graph(child,graph,input_nodename=input_nodename)
+    graph = graphviz.Digraph(name=' ',format='svg',strict=True) # strict means you cant have more than 1 edge between nodes. name is set so to " " so that nothing shows up on hover 
+    graph.attr('node',shape='box')
+    graph.attr(rankdir='LR')
+    root_name = index.name(index.ids[0])
+    graph.node(root_name,label=node_label(root_name),tooltip=tooltip)
+    for region_id in expanded_ids:
+        name = index.name(region_id)
+        for child_id in index.children(region_id):
+            child_name = index.name(child_id)
+            graph.node(child_name,label=node_label(child_name),tooltip=tooltip)
+            graph.edge(name,child_name)
     return graph
 
-def make_ID_reassignment_dict(ontology_dict,graph,output_dict):
+@lru_cache(maxsize=GRAPH_CACHE_SIZE)
+def render_graph_svg(expanded_ids):
+    """ The SVG of make_graph(expanded_ids). expanded_ids must be
+    the hashable tuple from visible_expanded_ids() """
+    return make_graph(expanded_ids).pipe().decode("utf-8")
+
+def make_ID_reassignment_dict(expanded_ids,output_dict,index=ontology_index):
     """ 
     ---PURPOSE---
-    Loop through an ontology dictionary and return a dictionary 
+    Loop through the ontology and return a dictionary 
     whose keys are parent ids at the highest level in the graph and values are a list
     of descendent ids of each of these parents. 
     ---INPUT---
-    ontology_dict        The dictionary containing the entire ontology dictionary
-    graph                The graph whose structure you want to capture
+    expanded_ids         The ids of the expanded regions of the graph whose structure you want to capture
     output_dict          The dictionary which will store the parent to descendents links
+    index                The OntologyIndex of the ontology
     """
-    
-    ID = ontology_dict.get('id')
-    children = ontology_dict.get('children')
-
-    for child in children:
-        child_ID = child.get('id')
-        child_name = child.get('name')
-        child_label = f'"{child_name}"' if len(child_name.split())>1 else child_name
-        # child_str = f'\t{child_label}' 
-        child_body_str = '\t{0} [label=<<TABLE BORDER="{1}"><TR><TD href="/interactive_ontology?input_nodename={2}">{2}</TD>\
-<TD BORDER="{3}" href="/interactive_ontology?input_nodename={2}&amp;contract=True">-</TD></TR></TABLE>> tooltip="{4}"]'.\
-format(child_label,table_border,child_name,contract_cell_border,tooltip)
-        
-        if child_body_str in graph.body:
-            global current_parent
-            current_parent = child_ID
+    current_parent = int(index.ids[0])
+    shown_ids = {current_parent}
+    for region_id in visible_expanded_ids(expanded_ids,index=index):
+        shown_ids.update(index.children(region_id))
+    # The index is in depth first order, so every hidden region is reached 
+    # right after its closest ancestor that is shown in the graph
+    for region_id in index.ids[1:]:
+        region_id = int(region_id)
+        if region_id in shown_ids:
+            current_parent = region_id
         else:
             if current_parent not in output_dict.keys():
                 output_dict[current_parent]=[]
-            output_dict[current_parent].append(child_ID)
-            
-        make_ID_reassignment_dict(child,graph,output_dict)
+            output_dict[current_parent].append(region_id)
     return
 
 def make_tuple_input(ID_reassignment_dict,chunk_size):
@@ -0,0 +1,213 @@
+from flask import current_app
+from lightserv.main.tasks import connect_to_spock
+from lightserv.processing.utils import parse_sacct_output
+
+import itertools
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.propagate = False
+formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
+
+''' Make the file handler to deal with logging to file '''
+
+file_handler = logging.FileHandler('logs/processing_cluster.log')
+file_handler.setFormatter(formatter)
+
+stream_handler = logging.StreamHandler() # level already set at debug from logger.setLevel() above
+
+stream_handler.setFormatter(formatter)
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+class ClusterBackend(object):
+	"""
+	---PURPOSE---
+	The interface the celery tasks use to talk to the cluster.
+	Pipelines are submitted by running a shell script which
+	submits one slurm job per step (each dependent on the previous one)
+	and prints the jobids, one per line.
+
+	Use get_cluster_backend() to get the backend set in the config.
+	"""
+	def run_command(self,command):
+		""" Run a shell command on the cluster.
+		Returns (stdout,stderr) as strings, stdout without the final newline """
+		raise NotImplementedError
+
+	def submit(self,command,n_steps):
+		""" Run a pipeline submission script on the cluster.
+		---INPUT---
+		command     - the shell command that submits the pipeline
+		n_steps     - the number of jobids the script is expected to print
+		---OUTPUT---
+		jobids          - list of jobid strings, one per step
+		error_response  - stderr of the submission script (empty string if none)
+		"""
+		raise NotImplementedError
+
+	def status_batch(self,jobids):
+		""" Get the statuses of any number of jobs at once.
+		Returns a dictionary mapping jobid -> pooled status code
+		(see determine_status_code()), or None if the statuses could not be fetched """
+		raise NotImplementedError
+
+	def cancel(self,jobids):
+		""" Cancel one or more jobs """
+		raise NotImplementedError
+
+class SpockBackend(ClusterBackend):
+	""" Runs everything on spock over the pooled ssh connection """
+	def run_command(self,command):
+		client = connect_to_spock()
+		try:
+			stdin, stdout, stderr = client.exec_command(command)
+			response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+			error_response = str(stderr.read().decode("utf-8"))
+		finally:
+			client.close()
+		return response, error_response
+
+	def submit(self,command,n_steps):
+		response, error_response = self.run_command(command)
+		jobids = [jobid for jobid in response.split('\n') if jobid]
+		if len(jobids) != n_steps:
+			logger.info(f"Expected {n_steps} jobids from submission script but got: {response}")
+		return jobids, error_response
+
+	def status_batch(self,jobids):
+		jobids_str = ','.join(jobids)
+		try:
+			command = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(jobids_str)
+			stdout_str, stderr_str = self.run_command(command)
+			logger.debug("The response from spock is:")
+			logger.debug(stdout_str)
+			sacct_status_dict = parse_sacct_output(stdout_str)
+		except:
+			logger.debug("Something went wrong fetching job statuses from spock.")
+			sacct_status_dict = None
+		return sacct_status_dict
+
+	def cancel(self,jobids):
+		jobids_str = ' '.join(str(jobid) for jobid in jobids)
+		return self.run_command(f'scancel {jobids_str}')
+
+class FakeSlurmBackend(ClusterBackend):
+	"""
+	---PURPOSE---
+	An in-process stand-in for slurm for load testing the status checkers
+	and precomputed pipelines without touching spock.
+	Every step of a submitted pipeline is a fake job that waits in the queue,
+	runs for a random duration and then completes or fails.
+	Like the real pipelines, each step only starts once the previous step
+	completed and is cancelled if the previous step did not complete.
+
+	The job state lives in this process, so celery needs to run
+	with CELERY_ALWAYS_EAGER or a single worker process (--pool=solo)
+	for the submitting and polling tasks to see the same jobs.
+	---INPUT---
+	queue_seconds       - (min,max) time a job spends PENDING before it can start
+	duration_seconds    - (min,max) time a job spends RUNNING
+	failure_rate        - probability that a job ends in FAILED
+	seed                - random seed, for reproducible runs
+	clock               - function returning the current time in seconds
+	"""
+	def __init__(self,queue_seconds=(0,0),duration_seconds=(5,30),
+		failure_rate=0.0,seed=None,clock=time.time):
+		self.queue_seconds = queue_seconds
+		self.duration_seconds = duration_seconds
+		self.failure_rate = failure_rate
+		self.random = random.Random(seed)
+		self.clock = clock
+		self.lock = threading.Lock()
+		self.jobid_counter = itertools.count(1000000)
+		self.jobs = {} # jobid -> dict of job info
+
+	def run_command(self,command):
+		logger.debug(f"Fake slurm ignoring command: {command}")
+		return 'fakeslurm', ''
+
+	def submit(self,command,n_steps):
+		now = self.clock()
+		jobids = []
+		with self.lock:
+			previous_jobid = None
+			for step in range(n_steps):
+				jobid = str(next(self.jobid_counter))
+				self.jobs[jobid] = {
+					'submitted':now,
+					'queue':self.random.uniform(*self.queue_seconds),
+					'duration':self.random.uniform(*self.duration_seconds),
+					'fails':self.random.random() < self.failure_rate,
+					'dependency':previous_jobid,
+					'cancelled_at':None}
+				jobids.append(jobid)
+				previous_jobid = jobid
+		logger.debug(f"Fake slurm submitted jobids: {jobids}")
+		return jobids, ''
+
+	def _end_time(self,jobid):
+		""" When this job finishes (or would finish) and with which status """
+		job = self.jobs[jobid]
+		start = job['submitted'] + job['queue']
+		if job['dependency'] is not None:
+			dependency_end,dependency_status = self._end_time(job['dependency'])
+			if dependency_status != 'COMPLETED':
+				return dependency_end,'CANCELLED'
+			start = max(start,dependency_end)
+		end = start + job['duration']
+		if job['cancelled_at'] is not None and job['cancelled_at'] < end:
+			return job['cancelled_at'],'CANCELLED'
+		return end,'FAILED' if job['fails'] else 'COMPLETED'
+
+	def _status(self,jobid,now):
+		job = self.jobs[jobid]
+		end,final_status = self._end_time(jobid)
+		if now >= end:
+			return final_status
+		start = job['submitted'] + job['queue']
+		if job['dependency'] is not None:
+			start = max(start,self._end_time(job['dependency'])[0])
+		return 'RUNNING' if now >= start else 'PENDING'
+
+	def status_batch(self,jobids):
+		now = self.clock()
+		with self.lock:
+			return {jobid:self._status(jobid,now) for jobid in jobids if jobid in self.jobs}
+
+	def cancel(self,jobids):
+		now = self.clock()
+		with self.lock:
+			for jobid in jobids:
+				jobid = str(jobid)
+				if jobid in self.jobs and self.jobs[jobid]['cancelled_at'] is None:
+					self.jobs[jobid]['cancelled_at'] = now
+		return '', ''
+
+_cluster_backends = {}
+
+def get_cluster_backend():
+	"""
+	---PURPOSE---
+	Get the cluster backend set by the CLUSTER_BACKEND config,
+	either 'spock' or 'fake_slurm'.
+	One backend is kept per process so the fake slurm keeps its jobs between tasks.
+	---OUTPUT---
+	backend     - ClusterBackend() instance
+	"""
+	backend_name = current_app.config['CLUSTER_BACKEND']
+	if backend_name not in _cluster_backends:
+		if backend_name == 'spock':
+			_cluster_backends[backend_name] = SpockBackend()
+		elif backend_name == 'fake_slurm':
+			_cluster_backends[backend_name] = FakeSlurmBackend(
+				queue_seconds=current_app.config['FAKE_SLURM_QUEUE_SECONDS'],
+				duration_seconds=current_app.config['FAKE_SLURM_DURATION_SECONDS'],
+				failure_rate=current_app.config['FAKE_SLURM_FAILURE_RATE'])
+		else:
+			raise ValueError(f"Unknown CLUSTER_BACKEND: {backend_name}")
+	return _cluster_backends[backend_name]
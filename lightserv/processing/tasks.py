@@ -2,10 +2,13 @@ from flask import (render_template, url_for, flash,
 				   redirect, request, abort, Blueprint,session,
 				   Markup, current_app,jsonify)
 from lightserv.main.utils import mymkdir,prettyprinter,db_table_determiner
-from lightserv.processing.utils import determine_status_code,get_job_statuses
+from lightserv.processing.utils import (get_job_statuses,
+	get_latest_spock_job_contents,get_active_spock_job_contents,get_outstanding_jobids,
+	fetch_sacct_statuses,insert_spock_jobs,is_active_job,ongoing_codes,
+	spock_job_table_names,BulkUpdater)
 from lightserv import cel, db_lightsheet, db_spockadmin
-from lightserv.main.tasks import (send_email, send_admin_email,
-	connect_to_spock)
+from lightserv.main.tasks import send_email, send_admin_email
+from lightserv.processing.cluster import get_cluster_backend
 
 import datajoint as dj
 from datetime import datetime
@@ -367,15 +370,17 @@ def run_lightsheet_pipeline(username,request_name,
 					n_channels_total
 				)
 			
-			client = connect_to_spock()
+			cluster_backend = get_cluster_backend()
 
 			logger.debug("Command:")
 			logger.debug(command)
-			stdin, stdout, stderr = client.exec_command(command)
-			response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+			if no_registration_channels:
+				n_steps = 3
+			else:
+				n_steps = 4
+			jobids, error_response = cluster_backend.submit(command,n_steps=n_steps)
 			logger.debug("Response:")
-			logger.debug(response)
-			error_response = str(stderr.read().decode("utf-8"))
+			logger.debug(jobids)
 			logger.debug("Error Response:")
 			logger.debug(error_response)
 
@@ -383,9 +388,9 @@ def run_lightsheet_pipeline(username,request_name,
 			entry_dict = {}
 			if no_registration_channels:
 				# Then we didn't run step 3 in the pipeline
-				jobid_step0, jobid_step1, jobid_step2 = response.split('\n')
+				jobid_step0, jobid_step1, jobid_step2 = jobids
 			else:
-				jobid_step0, jobid_step1, jobid_step2, jobid_step3 = response.split('\n')
+				jobid_step0, jobid_step1, jobid_step2, jobid_step3 = jobids
 				entry_dict['jobid_step3'] = jobid_step3
 				entry_dict['status_step3'] = status
 			
@@ -401,7 +406,7 @@ def run_lightsheet_pipeline(username,request_name,
 			""" Update the job status table in spockadmin schema"""
 			logger.debug("Made it here")
 			logger.debug(entry_dict)
-			db_spockadmin.ProcessingPipelineSpockJob.insert1(entry_dict)    
+			insert_spock_jobs(db_spockadmin.ProcessingPipelineSpockJob,[entry_dict])    
 			logger.info(f"ProcessingResolutionRequest() request was successfully submitted to spock, jobid (step 0): {jobid_step0}")
 			""" Update the request tables in lightsheet schema """ 
 			if no_registration_channels:
@@ -414,13 +419,10 @@ def run_lightsheet_pipeline(username,request_name,
 
 			""" Get the brainpipe commit and add it to processing request contents table """
 			
-			stdin_commit, stdout_commit, stderr_commit = client.exec_command(command_get_commit)
-			brainpipe_commit = str(stdout_commit.read().decode("utf-8").strip('\n'))
+			brainpipe_commit, _ = cluster_backend.run_command(command_get_commit)
 			processing_resolution_update_dict['brainpipe_commit'] = brainpipe_commit						
 			db_lightsheet.Request.ProcessingResolutionRequest().update1(processing_resolution_update_dict)
 			logger.debug("Updated ProcessingResolutionRequest() table")
-
-			client.close()
 	return "SUBMITTED spock job"
 
 @cel.task()
@@ -493,8 +495,10 @@ def smartspim_stitch(**kwargs):
 		)
 
 	
+	cluster_backend = get_cluster_backend()
 	try:
-		client = connect_to_spock()
+		# Grab brainpipe commit
+		brainpipe_commit, _ = cluster_backend.run_command(command_get_commit)
 	except paramiko.ssh_exception.AuthenticationException:
 		logger.info(f"Failed to connect to spock to start job. ")
 		# Send email alerting processing admins
@@ -514,21 +518,18 @@ def smartspim_stitch(**kwargs):
 
 		return "FAILED"
 
-	# Grab brainpipe commit
-	stdin_commit, stdout_commit, stderr_commit = client.exec_command(command_get_commit)
-	brainpipe_commit = str(stdout_commit.read().decode("utf-8").strip('\n'))
 	logger.debug("BRAINPIPE COMMIT")
 	logger.debug(brainpipe_commit)
 	
-	# Run the stitching command
+	# Run the stitching command. 4 jobs for the alignment channel, 3 for each other channel
 	logger.debug("Running command:")
 	logger.debug(command)
-	stdin, stdout, stderr = client.exec_command(command)
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+	n_steps = 4 + 3*(len(kwargs['channel_dict'])-1)
+	jobids_list, error_response = cluster_backend.submit(command,n_steps=n_steps)
+	response = '\n'.join(jobids_list)
 	logger.debug("Stdout Response:")
 	logger.debug(response)
 	
-	error_response = str(stderr.read().decode("utf-8"))
 	if error_response:
 		logger.debug("Stderr Response:")
 		logger.debug(error_response)
@@ -549,7 +550,6 @@ def smartspim_stitch(**kwargs):
 		logger.debug("No Stderr Response")
 	
 	status = 'SUBMITTED'
-	jobids_list = response.split('\n')
 	
 	for ii,channel_name in enumerate(['785','642','561','488']): # use longest available wavelength channel as the channel to find the displacements  
 		if channel_name not in kwargs['channel_dict']:
@@ -577,7 +577,7 @@ def smartspim_stitch(**kwargs):
 
 		""" Update the job status table in spockadmin schema """
 		logger.debug(entry_dict)
-		spockadmin_table.insert1(entry_dict)    
+		insert_spock_jobs(spockadmin_table,[entry_dict])    
 		logger.info(f"{spockadmin_table}() entry successfully inserted, jobid (step 0): {jobids[0]}")
 
 		""" Update the request tables in lightsheet schema """ 
@@ -601,7 +601,6 @@ def smartspim_stitch(**kwargs):
 		logger.debug(stitching_channel_insert_dict)
 		db_lightsheet.Request.SmartspimStitchedChannel().insert1(
 				stitching_channel_insert_dict,skip_duplicates=True) 
-	client.close()
 	return "SUBMITTED spock job"
 
 @cel.task()
@@ -686,29 +685,27 @@ def smartspim_pystripe(**kwargs):
 			corrected_output_dir,
 		)
 	
+	logger.debug("Command:")
+	logger.debug(command)
 	try:
-		client = connect_to_spock()
+		jobids, error_response = get_cluster_backend().submit(command,n_steps=1)
 	except paramiko.ssh_exception.AuthenticationException:
 		logger.info(f"Failed to connect to spock to start job. ")
 		pystripe_channel_insert_dict['smartspim_stitching_spock_job_progress'] = 'NOT_SUBMITTED'
 
 		db_lightsheet.Request.SmartspimPystripeChannel().insert1(
 			pystripe_channel_insert_dict) 
+		return "FAILED"
 		
-	logger.debug("Command:")
-	logger.debug(command)
-	stdin, stdout, stderr = client.exec_command(command)
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
 	logger.debug("Stdout Response:")
-	logger.debug(response)
-	error_response = str(stderr.read().decode("utf-8"))
+	logger.debug(jobids)
 	if error_response:
 		logger.debug("Stderr Response:")
 		logger.debug(error_response)
 	else:
 		logger.debug("No Stderr Response")
 	logger.debug("")
-	jobid_step0 = response.split('\n')
+	jobid_step0 = jobids[0]
 	status = 'SUBMITTED'
 	entry_dict = {}
 	entry_dict['username'] = username
@@ -717,7 +714,7 @@ def smartspim_pystripe(**kwargs):
 
 	""" Update the job status table in spockadmin schema """
 	logger.debug(entry_dict)
-	db_spockadmin.SmartspimPystripeSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.SmartspimPystripeSpockJob,[entry_dict])    
 	logger.info(f"SmartspimPystripeSpockJob() entry successfully inserted, jobid (step 0): {jobid_step0}")
 
 	""" Update the request tables in lightsheet schema """ 
@@ -731,7 +728,6 @@ def smartspim_pystripe(**kwargs):
 	logger.debug(pystripe_channel_insert_dict)
 	db_lightsheet.Request.SmartspimPystripeChannel().insert1(
 			pystripe_channel_insert_dict,replace=True) 
-	client.close()
 	return "SUBMITTED pystripe spock job"
 
 @cel.task()
@@ -829,13 +825,10 @@ def make_precomputed_stitched_data(**kwargs):
 				   f"/jukebox/wang/ahoag/precomputed/lavision/stitched_pipeline/precomputed_pipeline_stitched.sh {viz_dir}")
 		# command = "cd /jukebox/wang/ahoag/precomputed/testing; ./test_pipeline.sh "
 	
-	client = connect_to_spock()
-	stdin, stdout, stderr = client.exec_command(command)
-	# jobid_final_step = str(stdout.read().decode("utf-8").strip('\n'))
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+	jobids, error_response = get_cluster_backend().submit(command,n_steps=3)
 	logger.debug("response from spock:")
-	logger.debug(response)
-	jobid_step0, jobid_step1, jobid_step2 = response.split('\n')
+	logger.debug(jobids)
+	jobid_step0, jobid_step1, jobid_step2 = jobids
 
 	status_step0 = 'SUBMITTED'
 	status_step1 = 'SUBMITTED'
@@ -851,7 +844,7 @@ def make_precomputed_stitched_data(**kwargs):
 				}
 	logger.debug("Inserting into StitchedPrecomputedSpockJob():")
 	logger.debug(entry_dict)
-	db_spockadmin.StitchedPrecomputedSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.StitchedPrecomputedSpockJob,[entry_dict])    
 	logger.info(f"Precomputed (stitched data) job inserted into StitchedPrecomputedSpockJob() table: {entry_dict}")
 	logger.info(f"Precomputed (stitched data) job successfully submitted to spock, jobid_step2: {jobid_step2}")
 	# logger.debug(type(jobid_step2))
@@ -933,13 +926,10 @@ def make_precomputed_blended_data(**kwargs):
 	else:
 		command = ("cd /jukebox/wang/ahoag/precomputed/lavision/blended_pipeline; "
 				   f"/jukebox/wang/ahoag/precomputed/lavision/blended_pipeline/precomputed_pipeline_blended.sh {viz_dir}")   # command = "cd /jukebox/wang/ahoag/precomputed/testing; ./test_pipeline.sh "
-	client = connect_to_spock()
-	stdin, stdout, stderr = client.exec_command(command)
-	# jobid_final_step = str(stdout.read().decode("utf-8").strip('\n'))
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+	jobids, error_response = get_cluster_backend().submit(command,n_steps=3)
 	logger.debug("response from spock:")
-	logger.debug(response)
-	jobid_step0, jobid_step1, jobid_step2 = response.split('\n')
+	logger.debug(jobids)
+	jobid_step0, jobid_step1, jobid_step2 = jobids
 
 	status_step0 = 'SUBMITTED'
 	status_step1 = 'SUBMITTED'
@@ -954,7 +944,7 @@ def make_precomputed_blended_data(**kwargs):
 				}
 	logger.debug("Inserting into BlendedPrecomputedSpockJob():")
 	logger.debug(entry_dict)
-	db_spockadmin.BlendedPrecomputedSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.BlendedPrecomputedSpockJob,[entry_dict])    
 	logger.info(f"Precomputed (Blended data) job inserted into BlendedPrecomputedSpockJob() table: {entry_dict}")
 	logger.info(f"Precomputed (Blended data) job successfully submitted to spock, jobid_step2: {jobid_step2}")
 	# logger.debug(type(jobid_step2))
@@ -1024,13 +1014,10 @@ def make_precomputed_downsized_data(**kwargs):
 		# command = "cd /jukebox/wang/ahoag/precomputed/downsized_pipeline/testing; ./test_pipeline.sh "
 	logger.debug("command:")
 	logger.debug(command)
-	client = connect_to_spock()
-	stdin, stdout, stderr = client.exec_command(command)
-	# jobid_final_step = str(stdout.read().decode("utf-8").strip('\n'))
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+	jobids, error_response = get_cluster_backend().submit(command,n_steps=2)
 	logger.debug("response from spock:")
-	logger.debug(response)
-	jobid_step0, jobid_step1 = response.split('\n')
+	logger.debug(jobids)
+	jobid_step0, jobid_step1 = jobids
 
 	status_step0 = 'SUBMITTED'
 	status_step1 = 'SUBMITTED'
@@ -1043,7 +1030,7 @@ def make_precomputed_downsized_data(**kwargs):
 				}
 	logger.debug("Inserting into DownsizedPrecomputedSpockJob():")
 	logger.debug(entry_dict)
-	db_spockadmin.DownsizedPrecomputedSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.DownsizedPrecomputedSpockJob,[entry_dict])    
 	logger.info(f"Precomputed (downsized data) job inserted into DownsizedPrecomputedSpockJob() table: {entry_dict}")
 	logger.info(f"Precomputed (downsized data) job successfully submitted to spock, jobid_step1: {jobid_step1}")
 	restrict_dict = dict(
@@ -1111,13 +1098,10 @@ def make_precomputed_registered_data(**kwargs):
 	logger.debug("command:")
 	logger.debug(command)
 	
-	client = connect_to_spock()
-
-	stdin, stdout, stderr = client.exec_command(command)
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+	jobids, error_response = get_cluster_backend().submit(command,n_steps=2)
 	logger.debug("response from spock:")
-	logger.debug(response)
-	jobid_step0, jobid_step1 = response.split('\n')
+	logger.debug(jobids)
+	jobid_step0, jobid_step1 = jobids
 
 	status_step0 = 'SUBMITTED'
 	status_step1 = 'SUBMITTED'
@@ -1130,7 +1114,7 @@ def make_precomputed_registered_data(**kwargs):
 				}
 	logger.debug("Inserting into RegisteredPrecomputedSpockJob():")
 	logger.debug(entry_dict)
-	db_spockadmin.RegisteredPrecomputedSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.RegisteredPrecomputedSpockJob,[entry_dict])    
 	logger.info(f"Precomputed (registered data) job inserted into RegisteredPrecomputedSpockJob() table: {entry_dict}")
 	logger.info(f"Precomputed (registered data) job successfully submitted to spock, jobid_step1: {jobid_step1}")
 	restrict_dict = dict(
@@ -1213,13 +1197,10 @@ def make_precomputed_smartspim_corrected_data(**kwargs):
 				   f"/jukebox/wang/ahoag/precomputed/smartspim/corrected_pipeline/precomputed_pipeline_corrected.sh "
 				   f"{viz_dir} {image_resolution} {channel_name}")
 	
-	client = connect_to_spock()
-
-	stdin, stdout, stderr = client.exec_command(command)
-	response = str(stdout.read().decode("utf-8").strip('\n')) # strips off the final newline
+	jobids, error_response = get_cluster_backend().submit(command,n_steps=4)
 	logger.debug("response from spock:")
-	logger.debug(response)
-	jobid_step0, jobid_step1, jobid_step2, jobid_step3  = response.split('\n')
+	logger.debug(jobids)
+	jobid_step0, jobid_step1, jobid_step2, jobid_step3 = jobids
 
 	status_step0 = 'SUBMITTED'
 	status_step1 = 'SUBMITTED'
@@ -1237,7 +1218,7 @@ def make_precomputed_smartspim_corrected_data(**kwargs):
 				}
 	logger.debug("Inserting into SmartspimCorrectedPrecomputedSpockJob():")
 	logger.debug(entry_dict)
-	db_spockadmin.SmartspimCorrectedPrecomputedSpockJob.insert1(entry_dict)    
+	insert_spock_jobs(db_spockadmin.SmartspimCorrectedPrecomputedSpockJob,[entry_dict])    
 	logger.info(f"Precomputed (corrected data) job inserted into SmartspimCorrectedPrecomputedSpockJob() table: {entry_dict}")
 	logger.info(f"Precomputed (corrected data) job successfully submitted to spock, jobid_step3: {jobid_step3}")
 	
@@ -1264,7 +1245,56 @@ def make_precomputed_smartspim_corrected_data(**kwargs):
 #################################################
 
 @cel.task()
-def processing_spock_job_status_checker(reg=True):
+def spock_job_status_poller():
+	""" 
+	A celery task that will be run in a schedule
+
+	Collects the outstanding jobids (all steps) from every 
+	spock job table listed in the SPOCK_JOB_STATUS_HANDLERS config,
+	fetches all of their statuses in a single sacct query
+	over a single ssh connection and then hands the statuses to each of 
+	the status checker tasks, which are run synchronously here.
+	"""
+	handlers = current_app.config['SPOCK_JOB_STATUS_HANDLERS']
+	
+	""" Find the outstanding jobs in each spock table only once, 
+	even if the table has several handlers """
+	spock_dbtable_strs = []
+	for handler in handlers:
+		if handler['spock_dbtable_str'] not in spock_dbtable_strs:
+			spock_dbtable_strs.append(handler['spock_dbtable_str'])
+	
+	outstanding_jobids = set()
+	for spock_dbtable_str in spock_dbtable_strs:
+		spock_dbtable = getattr(db_spockadmin,spock_dbtable_str)
+		unique_contents = get_active_spock_job_contents(spock_dbtable)
+		outstanding_jobids_this_table = get_outstanding_jobids(unique_contents)
+		logger.debug(f"{len(outstanding_jobids_this_table)} outstanding jobids in {spock_dbtable_str}")
+		outstanding_jobids.update(outstanding_jobids_this_table)
+	
+	if not outstanding_jobids:
+		return "No spock jobs need checking"
+
+	sacct_status_dict = fetch_sacct_statuses(outstanding_jobids)
+	if sacct_status_dict is None:
+		return "Error fetching job statuses from spock"
+
+	""" Fan the statuses out to the status checkers. 
+	A failure in one of them should not stop the others from running """
+	for handler in handlers:
+		status_checker = cel.tasks[handler['task']]
+		try:
+			result = status_checker(sacct_status_dict=sacct_status_dict,
+				**handler['kwargs'])
+			logger.debug(f"{handler['task']} with kwargs {handler['kwargs']}: {result}")
+		except:
+			logger.exception(f"Status checker {handler['task']} "
+							 f"with kwargs {handler['kwargs']} failed")
+
+	return f"Polled statuses of {len(outstanding_jobids)} spock jobs"
+
+@cel.task()
+def processing_spock_job_status_checker(reg=True,sacct_status_dict=None):
 	""" 
 	A celery task that will be run in a schedule
 
@@ -1281,6 +1311,9 @@ def processing_spock_job_status_checker(reg=True):
 	set the processing_progress in the ProcessingRequest() 
 	table to 'failed'. If all jobs completed, then set 
 	processing_progress to 'complete'
+
+	sacct_status_dict is passed in when this is run
+	as a handler by spock_job_status_poller()
 	"""
 	if reg:
 		max_step_index = 3
@@ -1292,116 +1325,145 @@ def processing_spock_job_status_checker(reg=True):
 	lightsheet_column_name = 'lightsheet_pipeline_spock_jobid'
 	
 	# First get all rows with latest timestamps """
-	job_contents = db_spockadmin.ProcessingPipelineSpockJob()
-	unique_contents = dj.U('jobid_step0','username',).aggr(
-		job_contents,timestamp='max(timestamp)')*job_contents
+	unique_contents = get_active_spock_job_contents(
+		db_spockadmin.ProcessingPipelineSpockJob)
+	
+	""" Remember the current statuses of the jobs that are being checked
+	so we can tell which steps complete in this check """
+	incomplete_contents = unique_contents & f'status_step{max_step_index} in {ongoing_codes}'
+	previous_job_dicts = {job_dict['jobid_step0']:job_dict for job_dict in \
+		incomplete_contents.fetch('jobid_step0','status_step1','status_step3',as_dict=True)}
 	
 	""" Get a list of all jobs we need to check up on, i.e.
 	those that could conceivably change. Also list the problematic_codes
 	which will be used later for error reporting to the user.
 	"""
+	""" All of the lightsheet table updates from this check are collected
+	and applied together at the end """
+	bulk_updater = BulkUpdater()
 	job_insert_list = get_job_statuses(
 		unique_contents=unique_contents,
 		max_step_index=max_step_index,
 		lightsheet_dbtable=db_lightsheet.Request.ProcessingResolutionRequest,
-		lightsheet_column_name='lightsheet_pipeline_spock_jobid')
+		lightsheet_column_name='lightsheet_pipeline_spock_jobid',
+		sacct_status_dict=sacct_status_dict,
+		bulk_updater=bulk_updater)
 	
 	logger.debug("Insert list:")
 	logger.debug(job_insert_list)
-	db_spockadmin.ProcessingPipelineSpockJob.insert(job_insert_list)
+	insert_spock_jobs(db_spockadmin.ProcessingPipelineSpockJob,job_insert_list)
 	logger.debug("Entry in ProcessingPipelineSpockJob() admin table with latest status")
 
 	if not job_insert_list:
 		return "No spock jobs need checking"
-		
-	# Now loop over jobs we checked and perform an action if they completed or failed	
-	for job_status_dict in job_insert_list:
-		jobid_maxstep = job_status_dict[f'jobid_step{max_step_index}']
-		status_maxstep = job_status_dict[f'status_step{max_step_index}']
-
-		this_processing_resolution_content = lightsheet_dbtable() & {lightsheet_column_name:jobid_maxstep}
-
-		(username,request_name,sample_name,imaging_request_number,
-		processing_request_number,image_resolution) = this_processing_resolution_content.fetch1(
-			"username","request_name","sample_name",
-			"imaging_request_number","processing_request_number",
-			"image_resolution")
-		
-		if status_maxstep == 'COMPLETED':
-			# Find all processing channels from this same processing resolution request
-			logger.debug("checking to see whether all processing resolution requests "
-						 "are complete in this processing request are complete")
-
-			restrict_dict_processing = dict(username=username,request_name=request_name,
-				sample_name=sample_name,imaging_request_number=imaging_request_number,
-				processing_request_number=processing_request_number)
-			processing_request_contents = all_processing_request_contents & restrict_dict_processing
-			processing_resolution_contents = db_lightsheet.Request.ProcessingResolutionRequest() & \
-				restrict_dict_processing
-			
-			""" Loop through and pool all of the job statuses """
-			processing_request_job_statuses = []
-			
-			for processing_resolution_dict in processing_resolution_contents:
-				job_status = processing_resolution_dict['lightsheet_pipeline_spock_job_progress']
-				processing_request_job_statuses.append(job_status)
-
-			logger.debug("job statuses for this processing request:")
-			logger.debug(processing_request_job_statuses)
-			data_bucket_rootpath = current_app.config['DATA_BUCKET_ROOTPATH']
-
-			output_directory = os.path.join(data_bucket_rootpath,username,
-							 request_name,sample_name,
-							 f"imaging_request_{imaging_request_number}",
-							 "output",
-							 f"processing_request_{processing_request_number}",
-							 f"resolution_{image_resolution}")
-			if all(x=='COMPLETED' for x in processing_request_job_statuses):
-				logger.debug("The processing pipeline for all processing resolution requests"
-							 " in this processing request are complete!")
-				
-				restrict_dict_request = {'username':username,'request_name':request_name}
-				
-				request_contents = db_lightsheet.Request() & restrict_dict_request
-				processing_request_update_dict = processing_request_contents.fetch1()
-				processing_request_update_dict['processing_progress'] = 'complete'
-				db_lightsheet.Request.ProcessingRequest().update1(processing_request_update_dict)
-				logger.info("Updated processing_progress in ProcessingRequest() table ")
-
-				""" Now figure out if all other processing requests for this request have been
-				fulfilled. If so, email the user """
-				processing_requests = all_processing_request_contents & restrict_dict_request
-				processing_progresses = processing_requests.fetch('processing_progress')
-				logger.debug("processing progresses for this request:")
-				logger.debug(processing_progresses)
-				if all([x=='complete' for x in processing_progresses]):
-					logger.debug("All processing requests complete in this request. Sending email to user.")
-					processed_products_directory = os.path.join(data_bucket_rootpath,username,
-							 request_name,'$sample_name',
-							 f"imaging_request_{imaging_request_number}",
-							 "output",
-							 f"processing_request_{processing_request_number}")
-					subject = 'Lightserv automated email: Processing done.'
-					body = ('The processing is now complete for all samples in your request:\n\n'
-							f'username: {username}\n'
-							f'request_name: {request_name}\n\n'
-							f'The processed products are available in each sample directory: {processed_products_directory}')
-					correspondence_email = request_contents.fetch1('correspondence_email')
-					recipients = [correspondence_email]
-					if not os.environ['FLASK_MODE'] == 'TEST':
-						send_email.delay(subject=subject,body=body,recipients=recipients)
-
-					request_contents = db_lightsheet.Request() & restrict_dict_request
-					request_update_dict = request_contents.fetch1()
-					request_update_dict['sent_processing_email'] = True
-					db_lightsheet.Request().update1(request_update_dict)
-					logger.info("Updated Request() Table")
-			else:
-				logger.debug("Not all processing resolution requests in this "
-							 "processing request are completely converted to "
-							 "precomputed format")
-
-
+	
+	""" Start any precomputed pipelines that were waiting on a step that just completed """
+	emit_step_completed_events(job_insert_list,previous_job_dicts)
+	
+	""" Find the processing requests of the jobs that completed in this check,
+	fetching all of their processing resolution requests at once """
+	completed_jobids = [job_status_dict[f'jobid_step{max_step_index}'] for job_status_dict \
+		in job_insert_list if job_status_dict[f'status_step{max_step_index}'] == 'COMPLETED']
+	processing_request_keys = ["username","request_name","sample_name",
+		"imaging_request_number","processing_request_number"]
+	completed_resolution_dicts = (lightsheet_dbtable() & \
+		[{lightsheet_column_name:jobid} for jobid in completed_jobids]).fetch(
+		*processing_request_keys,as_dict=True)
+	restrict_dicts_processing = []
+	for completed_resolution_dict in completed_resolution_dicts:
+		if completed_resolution_dict not in restrict_dicts_processing:
+			restrict_dicts_processing.append(completed_resolution_dict)
+	
+	if restrict_dicts_processing:
+		logger.debug("checking to see whether all processing resolution requests "
+					 "are complete in these processing requests")
+		processing_resolution_dicts = (db_lightsheet.Request.ProcessingResolutionRequest() & \
+			restrict_dicts_processing).fetch(*processing_request_keys,
+			'lightsheet_pipeline_spock_jobid','lightsheet_pipeline_spock_job_progress',as_dict=True)
+	else:
+		processing_resolution_dicts = []
+	
+	""" Pool the job statuses of each processing request, 
+	including the ones updated in this check which are not applied yet """
+	processing_request_job_statuses = {}
+	for processing_resolution_dict in processing_resolution_dicts:
+		restrict_tuple = tuple(processing_resolution_dict[key] for key in processing_request_keys)
+		job_status = bulk_updater.pending_value(lightsheet_dbtable,
+			{lightsheet_column_name:processing_resolution_dict['lightsheet_pipeline_spock_jobid']},
+			'lightsheet_pipeline_spock_job_progress',
+			default=processing_resolution_dict['lightsheet_pipeline_spock_job_progress'])
+		processing_request_job_statuses.setdefault(restrict_tuple,[]).append(job_status)
+	
+	restrict_dicts_request = []
+	for restrict_dict_processing in restrict_dicts_processing:
+		restrict_tuple = tuple(restrict_dict_processing[key] for key in processing_request_keys)
+		job_statuses = processing_request_job_statuses.get(restrict_tuple,[])
+		logger.debug(f"job statuses for processing request: {restrict_dict_processing}")
+		logger.debug(job_statuses)
+		if all(x=='COMPLETED' for x in job_statuses):
+			logger.debug("The processing pipeline for all processing resolution requests"
+						 " in this processing request are complete!")
+			bulk_updater.add(db_lightsheet.Request.ProcessingRequest,restrict_dict_processing,
+				{'processing_progress':'complete'})
+			restrict_dict_request = {'username':restrict_dict_processing['username'],
+				'request_name':restrict_dict_processing['request_name']}
+			if restrict_dict_request not in restrict_dicts_request:
+				restrict_dicts_request.append(restrict_dict_request)
+		else:
+			logger.debug("Not all processing resolution requests in this "
+						 "processing request are completely converted to "
+						 "precomputed format")
+	
+	""" Now figure out if all other processing requests for these requests have been
+	fulfilled. If so, email the user """
+	if restrict_dicts_request:
+		processing_request_dicts = (all_processing_request_contents & \
+			restrict_dicts_request).fetch(*processing_request_keys,'processing_progress',as_dict=True)
+		correspondence_emails = {(request_dict['username'],request_dict['request_name']):request_dict['correspondence_email'] \
+			for request_dict in (db_lightsheet.Request() & restrict_dicts_request).fetch(
+			'username','request_name','correspondence_email',as_dict=True)}
+	else:
+		processing_request_dicts = []
+		correspondence_emails = {}
+	
+	emails_to_send = []
+	data_bucket_rootpath = current_app.config['DATA_BUCKET_ROOTPATH']
+	for restrict_dict_request in restrict_dicts_request:
+		username = restrict_dict_request['username']
+		request_name = restrict_dict_request['request_name']
+		processing_progresses = [bulk_updater.pending_value(db_lightsheet.Request.ProcessingRequest,
+			{key:processing_request_dict[key] for key in processing_request_keys},
+			'processing_progress',default=processing_request_dict['processing_progress']) \
+			for processing_request_dict in processing_request_dicts \
+			if processing_request_dict['username'] == username and \
+			processing_request_dict['request_name'] == request_name]
+		logger.debug("processing progresses for this request:")
+		logger.debug(processing_progresses)
+		if all([x=='complete' for x in processing_progresses]):
+			logger.debug("All processing requests complete in this request. Sending email to user.")
+			restrict_dict_processing = [d for d in restrict_dicts_processing if \
+				d['username'] == username and d['request_name'] == request_name][0]
+			processed_products_directory = os.path.join(data_bucket_rootpath,username,
+					 request_name,'$sample_name',
+					 f"imaging_request_{restrict_dict_processing['imaging_request_number']}",
+					 "output",
+					 f"processing_request_{restrict_dict_processing['processing_request_number']}")
+			subject = 'Lightserv automated email: Processing done.'
+			body = ('The processing is now complete for all samples in your request:\n\n'
+					f'username: {username}\n'
+					f'request_name: {request_name}\n\n'
+					f'The processed products are available in each sample directory: {processed_products_directory}')
+			recipients = [correspondence_emails[(username,request_name)]]
+			emails_to_send.append(dict(subject=subject,body=body,recipients=recipients))
+			bulk_updater.add(db_lightsheet.Request,restrict_dict_request,
+				{'sent_processing_email':True})
+	
+	""" Apply all of the updates, then send the emails once they are committed """
+	bulk_updater.apply()
+	logger.info("Updated ProcessingResolutionRequest(), ProcessingRequest() and Request() tables")
+	if not os.environ['FLASK_MODE'] == 'TEST':
+		for email_kwargs in emails_to_send:
+			send_email.delay(**email_kwargs)
 	
 	return "Checked processing job statuses"
 
@@ -1410,7 +1472,8 @@ def smartspim_spock_job_status_checker(
 	spock_dbtable_str,
 	lightsheet_dbtable_str,
 	lightsheet_column_name,
-	max_step_index):
+	max_step_index,
+	sacct_status_dict=None):
 	""" 
 	---PURPOSE---
 	A generalized celery task for checking job statuses on spock
@@ -1425,6 +1488,7 @@ def smartspim_spock_job_status_checker(
 	lightsheet_dbtable_str  - string name for the table in schemas/lightsheet.py
 	lightsheet_column_name  - string name of the column in the lightsheet table that contains the spock job id
 	max_step_index          - the step id of the last step, 0-indexed
+	sacct_status_dict       - (optional) statuses passed in by spock_job_status_poller()
 	"""
 	lightsheet_dbtable = db_table_determiner(schema_str='db_lightsheet',
 		dbtable_str=lightsheet_dbtable_str)
@@ -1433,22 +1497,21 @@ def smartspim_spock_job_status_checker(
 	all_lightsheet_entries = lightsheet_dbtable()
    
 	""" First get all rows with latest timestamps from spock admin table"""
-	job_contents = spock_dbtable()
-	unique_contents = dj.U('jobid_step0','username',).aggr(
-		job_contents,timestamp='max(timestamp)')*job_contents
+	unique_contents = get_active_spock_job_contents(spock_dbtable)
 	
 	job_insert_list = get_job_statuses(
 		unique_contents,
 		max_step_index,
 		lightsheet_dbtable,
-		lightsheet_column_name)
+		lightsheet_column_name,
+		sacct_status_dict=sacct_status_dict)
 	if not job_insert_list:
 		return "No spock jobs need checking"
 
 	# insert into spockadmin table  
 	logger.debug(f"Inserting job list into {spock_dbtable_str}")
 	logger.debug(job_insert_list)
-	spock_dbtable.insert(job_insert_list)
+	insert_spock_jobs(spock_dbtable,job_insert_list)
 	
 	# Now loop over jobs we checked and perform an action if they completed or failed	
 	for job_status_dict in job_insert_list:
@@ -1519,7 +1582,8 @@ def precomputed_spock_job_status_checker(
 	spock_dbtable_str,
 	lightsheet_dbtable_str,
 	lightsheet_column_name,
-	max_step_index):
+	max_step_index,
+	sacct_status_dict=None):
 	""" 
 	A celery task that will be run in a schedule
 
@@ -1528,6 +1592,8 @@ def precomputed_spock_job_status_checker(
 	and updates statuses in the 
 	in the corresponding db_spockadmin table and in ProcessingChannel() in db_lightsheet 
 
+	sacct_status_dict is passed in when this is run
+	as a handler by spock_job_status_poller()
 	"""
 	if 'downsized' in lightsheet_column_name:
 		precomputed_pipeline = 'downsized'
@@ -1546,9 +1612,7 @@ def precomputed_spock_job_status_checker(
 		dbtable_str=spock_dbtable_str)
 
 	# Get all rows with latest timestamps 
-	job_contents = spock_dbtable()
-	unique_contents = dj.U('jobid_step0','username').aggr(
-		job_contents,timestamp='max(timestamp)')*job_contents
+	unique_contents = get_active_spock_job_contents(spock_dbtable)
 	
 	# Check statuses of outstanding jobs
 	job_insert_list = get_job_statuses(
@@ -1556,21 +1620,23 @@ def precomputed_spock_job_status_checker(
 		max_step_index=max_step_index,
 		lightsheet_dbtable=lightsheet_dbtable,
 		lightsheet_column_name=lightsheet_column_name,
-		is_precomputed_task=True)
+		is_precomputed_task=True,
+		sacct_status_dict=sacct_status_dict)
 
 	for job_status_dict in job_insert_list:
 
 		jobid_maxstep = job_status_dict[f'jobid_step{max_step_index}']
 		status_maxstep = job_status_dict[f'status_step{max_step_index}']
 		
+		lightsheet_column_name_thisjob = lightsheet_column_name
 		if 'stitched' in lightsheet_column_name:
 			lightsheet_thisjob = job_status_dict['lightsheet']
 			if lightsheet_thisjob == 'left':
-				lightsheet_column_name = "left_lightsheet_" + lightsheet_column_name
+				lightsheet_column_name_thisjob = "left_lightsheet_" + lightsheet_column_name
 			else:
-				lightsheet_column_name = "right_lightsheet_" + lightsheet_column_name
+				lightsheet_column_name_thisjob = "right_lightsheet_" + lightsheet_column_name
 
-		this_lightsheet_table_content = lightsheet_dbtable() & {lightsheet_column_name:jobid_maxstep}
+		this_lightsheet_table_content = lightsheet_dbtable() & {lightsheet_column_name_thisjob:jobid_maxstep}
 		
 		if len(this_lightsheet_table_content) == 0:
 			logger.debug(f"No {lightsheet_dbtable_str}() entry associated with this jobid. Skipping")
@@ -1604,245 +1670,349 @@ def precomputed_spock_job_status_checker(
 	if job_insert_list:
 		logger.debug("Insert list:")
 		logger.debug(job_insert_list)
-		spock_dbtable.insert(job_insert_list)
+		insert_spock_jobs(spock_dbtable,job_insert_list)
 		logger.debug(f"Entry in {spock_dbtable_str} spockadmin table with latest status")
 	else:
 		logger.debug("No jobs to insert")
 
 	return f"Checked {precomputed_pipeline} precomputed job statuses"
 
-@cel.task()
-def check_for_spock_jobs_ready_for_making_precomputed_data():
+def emit_step_completed_events(job_insert_list,previous_job_dicts):
 	""" 
-	A celery task that will be run in a schedule
-
-	Checks the status of spock jobs that ran 
-	the light sheet pipeline  for which the various 
-	steps are complete but whose various precomputed pipelines
-	are not yet started.
+	---PURPOSE---
+	Figure out which light sheet pipeline steps just changed to COMPLETED 
+	and send a start_precomputed_pipeline task to the pipeline events queue
+	for each precomputed pipeline that was waiting on that step
+	(see PRECOMPUTED_PIPELINE_TRIGGER_STEPS in config.py)
+	---INPUT---
+	job_insert_list     - the new ProcessingPipelineSpockJob() rows from get_job_statuses()
+	previous_job_dicts  - dictionary mapping jobid_step0 to the previous row of that job
+	---OUTPUT---
+	n_events            - the number of events sent
+	"""
+	trigger_steps = current_app.config['PRECOMPUTED_PIPELINE_TRIGGER_STEPS']
+	n_events = 0
+	for job_insert_dict in job_insert_list:
+		jobid_step0 = job_insert_dict['jobid_step0']
+		previous_job_dict = previous_job_dicts.get(jobid_step0,{})
+		for precomputed_pipeline,step in trigger_steps.items():
+			status_key = f'status_step{step}'
+			if job_insert_dict.get(status_key) != 'COMPLETED':
+				continue
+			if previous_job_dict.get(status_key) == 'COMPLETED':
+				continue
+			logger.info(f"Step {step} of jobid_step0={jobid_step0} completed. "
+						f"Sending event to start the {precomputed_pipeline} precomputed pipeline")
+			start_precomputed_pipeline.delay(
+				precomputed_pipeline=precomputed_pipeline,
+				processing_pipeline_jobid_step0=jobid_step0,
+				processing_pipeline_jobid_step2=job_insert_dict['jobid_step2'],
+				processing_pipeline_jobid_step3=job_insert_dict.get('jobid_step3'))
+			n_events += 1
+	return n_events
 
-	For each spock job that satisfies those criteria,
-	start the precomputed pipeline(s) that are ready
-	to be started given that that step in the pipeline is complete. 
+@cel.task()
+def start_precomputed_pipeline(precomputed_pipeline,
+	processing_pipeline_jobid_step0,
+	processing_pipeline_jobid_step2,
+	processing_pipeline_jobid_step3=None):
+	""" 
+	---PURPOSE---
+	Start a precomputed pipeline for all channels 
+	of a light sheet pipeline job once the step it depends on is complete.
+	This task is sent by emit_step_completed_events() whenever
+	the status checker sees the step complete. 
+
+	It is safe to run more than once for the same job: an entry 
+	in PrecomputedPipelineStart() is inserted first, so only the first
+	run actually starts the pipeline.
+	---INPUT---
+	precomputed_pipeline               - 'blending', 'registered' or 'downsized'
+	processing_pipeline_jobid_step0    - jobid_step0 in ProcessingPipelineSpockJob()
+	processing_pipeline_jobid_step2    - jobid_step2 in ProcessingPipelineSpockJob()
+	processing_pipeline_jobid_step3    - jobid_step3 in ProcessingPipelineSpockJob(), None if no registration
 	"""
 	data_bucket_rootpath = current_app.config['DATA_BUCKET_ROOTPATH']
 
-	all_spock_job_contents = db_spockadmin.ProcessingPipelineSpockJob()
-	
-	step_dict = {
-		'blending':1,
-		'registered':3
-		}
-
 	spock_table_dict = {
 		'blending':db_spockadmin.BlendedPrecomputedSpockJob,
-		'registered':db_spockadmin.RegisteredPrecomputedSpockJob
+		'registered':db_spockadmin.RegisteredPrecomputedSpockJob,
+		'downsized':db_spockadmin.DownsizedPrecomputedSpockJob
 	}
-	
-	for precomputed_pipeline in ['blending','registered']:
-		logger.info(f"Checking for jobs ready for {precomputed_pipeline} precomputed pipeline")
-		
-		step = step_dict[precomputed_pipeline]
-		spock_dbtable = spock_table_dict[precomputed_pipeline]
+	spock_dbtable = spock_table_dict[precomputed_pipeline]
+
+	""" Pipelines started before PrecomputedPipelineStart() existed
+	only have entries in the precomputed spock table """
+	idempotency_key = dict(precomputed_pipeline=precomputed_pipeline,
+		processing_pipeline_jobid_step0=processing_pipeline_jobid_step0)
+	precomputed_spock_job_contents = spock_dbtable() & {
+		'processing_pipeline_jobid_step0':processing_pipeline_jobid_step0
+	}
+	if len(precomputed_spock_job_contents) > 0:
+		logger.info("Precomputed pipeline already started for this job")
+		# so check_for_spock_jobs_ready_for_making_precomputed_data() skips it from now on
+		db_spockadmin.PrecomputedPipelineStart().insert1(idempotency_key,skip_duplicates=True)
+		return "Already started"
 
-		job_contents = all_spock_job_contents & {
-			f'status_step{step}':'COMPLETED'
-			}
+	try:
+		db_spockadmin.PrecomputedPipelineStart().insert1(idempotency_key)
+	except dj.errors.DuplicateError:
+		logger.info(f"{precomputed_pipeline} precomputed pipeline already started "
+					f"for jobid_step0={processing_pipeline_jobid_step0}")
+		return "Already started"
 
-		unique_contents = dj.U('jobid_step0','username',).aggr(
-			job_contents,timestamp='max(timestamp)')*job_contents
+	try:
+		precomputed_kwargs_list = make_precomputed_kwargs_list(
+			precomputed_pipeline=precomputed_pipeline,
+			processing_pipeline_jobid_step0=processing_pipeline_jobid_step0,
+			processing_pipeline_jobid_step2=processing_pipeline_jobid_step2,
+			processing_pipeline_jobid_step3=processing_pipeline_jobid_step3,
+			data_bucket_rootpath=data_bucket_rootpath)
+	except:
+		# Nothing was started, so allow the pipeline to be started by a later event
+		(db_spockadmin.PrecomputedPipelineStart() & idempotency_key).delete_quick()
+		raise
+
+	precomputed_task_dict = {
+		'blending':make_precomputed_blended_data,
+		'registered':make_precomputed_registered_data,
+		'downsized':make_precomputed_downsized_data
+	}
+	try:
+		for precomputed_kwargs in precomputed_kwargs_list:
+			if not os.environ['FLASK_MODE'] == 'TEST':
+				precomputed_task_dict[precomputed_pipeline].delay(**precomputed_kwargs)
+				logger.info(f"Sent task to start the {precomputed_pipeline} pipeline")
+	except:
+		# Sending failed, e.g. the broker could not be reached, so the pipeline
+		# may never start. Allow a later event to start it
+		(db_spockadmin.PrecomputedPipelineStart() & idempotency_key).delete_quick()
+		raise
+
+	return f"Started {precomputed_pipeline} pipeline for {len(precomputed_kwargs_list)} channels"
+
+def make_precomputed_kwargs_list(precomputed_pipeline,
+	processing_pipeline_jobid_step0,
+	processing_pipeline_jobid_step2,
+	processing_pipeline_jobid_step3,
+	data_bucket_rootpath):
+	""" 
+	---PURPOSE---
+	Make the keyword arguments for the precomputed pipeline task 
+	for each processing channel of a light sheet pipeline job 
+	and make the layer directories that the pipeline writes to
+	---INPUT---
+	see start_precomputed_pipeline()
+	---OUTPUT---
+	precomputed_kwargs_list   - list of kwarg dictionaries, one per channel
+	"""
+	if processing_pipeline_jobid_step3:
+		this_processing_resolution_request = db_lightsheet.Request.ProcessingResolutionRequest() & {
+			'lightsheet_pipeline_spock_jobid':processing_pipeline_jobid_step3
+		}
+	else:
+		this_processing_resolution_request = db_lightsheet.Request.ProcessingResolutionRequest() & {
+			'lightsheet_pipeline_spock_jobid':processing_pipeline_jobid_step2
+		}
 
-		processing_pipeline_jobids_step0 = unique_contents.fetch('jobid_step0') 
-		
-		""" For each of these jobs, figure out the ones for which the
-		precomputed pipeline has not already been started """
+	# Find the ProcessingChannel() entries 
+	# for this processing resolution request
+	
+	joined_processing_channel_contents = this_processing_resolution_request * \
+		db_lightsheet.Request.ProcessingChannel() * \
+		db_lightsheet.Request.ImagingChannel()
+	
+	precomputed_kwargs_list = []
+	# for each of these channels, set up the precomputed pipeline
+	for this_processing_channel_contents in joined_processing_channel_contents:
+		username=this_processing_channel_contents['username']
+		request_name = this_processing_channel_contents['request_name']
+		sample_name = this_processing_channel_contents['sample_name']
+		imaging_request_number = this_processing_channel_contents['imaging_request_number']
+		processing_request_number = this_processing_channel_contents['processing_request_number']
+		image_resolution = this_processing_channel_contents['image_resolution']
+		channel_name = this_processing_channel_contents['channel_name']
+		ventral_up = this_processing_channel_contents['ventral_up']
+		channel_index = this_processing_channel_contents['imspector_channel_index']
+		rawdata_subfolder = this_processing_channel_contents['rawdata_subfolder']
+		z_step = this_processing_channel_contents['z_step'] 
+		lightsheet_channel_str = this_processing_channel_contents['lightsheet_channel_str']
+		atlas_name = this_processing_channel_contents['atlas_name']
 		
-		for processing_pipeline_jobid_step0 in processing_pipeline_jobids_step0:
-			logger.debug(f"Checking out jobid: {processing_pipeline_jobid_step0} ")
-			
-			stitched_precomputed_spock_job_contents = spock_dbtable() & {
-				'processing_pipeline_jobid_step0':processing_pipeline_jobid_step0
-			}
+		# Set up kwarg dict of common keys 
+		precomputed_kwargs = dict(
+			username=username,
+			request_name=request_name,
+			sample_name=sample_name,
+			imaging_request_number=imaging_request_number,
+			processing_request_number=processing_request_number,
+			image_resolution=image_resolution,channel_name=channel_name,
+			ventral_up=ventral_up,
+			channel_index=channel_index,
+			z_step=z_step,
+			processing_pipeline_jobid_step0=processing_pipeline_jobid_step0)
+
+		output_rootpath = os.path.join(
+			data_bucket_rootpath,
+			username,
+			request_name,sample_name,
+			f"imaging_request_{imaging_request_number}",
+			"output",
+			f"processing_request_{processing_request_number}")
+
+		viz_rootpath = os.path.join(data_bucket_rootpath,username,
+				 request_name,sample_name,
+				 f"imaging_request_{imaging_request_number}",
+				 "viz",
+				 f"processing_request_{processing_request_number}")
 
-			if len(stitched_precomputed_spock_job_contents) > 0:
-				logger.info("Precomputed pipeline already started for this job")
-				continue
-			
-			# Get the kwarg dictionary for 
-			# this processing resolution request.
-			
-			# Is this a spock job that ran steps 0-2 
-			# or 0-3 (i.e. used registration) 
-			processing_pipeline_db_contents = unique_contents & \
-				f'jobid_step0="{processing_pipeline_jobid_step0}"'
-			(processing_pipeline_jobid_step2,
-				processing_pipeline_jobid_step3) = processing_pipeline_db_contents.fetch1(
-				'jobid_step2','jobid_step3')
-
-			if processing_pipeline_jobid_step3:
-				this_processing_resolution_request = db_lightsheet.Request.ProcessingResolutionRequest() & {
-					'lightsheet_pipeline_spock_jobid':processing_pipeline_jobid_step3
-				}
+		if ventral_up:
+			resolution_dirname = f"resolution_{image_resolution}_ventral_up"
+		else:
+			resolution_dirname = f"resolution_{image_resolution}"
+
+		# Handle specific things for the different pipelines
+		if precomputed_pipeline == 'blending':
+			channel_index_padded = str(channel_index).zfill(2)
+			blended_data_path = os.path.join(output_rootpath, 
+				 resolution_dirname,
+				 "full_sizedatafld",
+				 f"{rawdata_subfolder}_ch{channel_index_padded}")
+			viz_dir = os.path.join(viz_rootpath,"blended")
+			if ventral_up:
+				channel_viz_dir = os.path.join(viz_dir,f'channel_{channel_name}_ventral_up')
 			else:
-				this_processing_resolution_request = db_lightsheet.Request.ProcessingResolutionRequest() & {
-					'lightsheet_pipeline_spock_jobid':processing_pipeline_jobid_step2
-				}
+				channel_viz_dir = os.path.join(viz_dir,f'channel_{channel_name}')
 
-			# Find the ProcessingChannel() entries 
-			# for this processing resolution request
+			precomputed_kwargs['blended_data_path'] = blended_data_path
+			layer_name = f'channel{channel_name}_blended'
 			
-			joined_processing_channel_contents = this_processing_resolution_request * \
-				db_lightsheet.Request.ProcessingChannel() * \
-				db_lightsheet.Request.ImagingChannel()
-			
-			# for each of these channels, start the precomputed pipeline
-			for this_processing_channel_contents in joined_processing_channel_contents:
-				username=this_processing_channel_contents['username']
-				request_name = this_processing_channel_contents['request_name']
-				sample_name = this_processing_channel_contents['sample_name']
-				imaging_request_number = this_processing_channel_contents['imaging_request_number']
-				processing_request_number = this_processing_channel_contents['processing_request_number']
-				image_resolution = this_processing_channel_contents['image_resolution']
-				channel_name = this_processing_channel_contents['channel_name']
-				ventral_up = this_processing_channel_contents['ventral_up']
-				channel_index = this_processing_channel_contents['imspector_channel_index']
-				rawdata_subfolder = this_processing_channel_contents['rawdata_subfolder']
-				left_lightsheet_used = this_processing_channel_contents['left_lightsheet_used']
-				right_lightsheet_used = this_processing_channel_contents['right_lightsheet_used']
-				z_step = this_processing_channel_contents['z_step'] 
-				lightsheet_channel_str = this_processing_channel_contents['lightsheet_channel_str']
-				
-				# Set up kwarg dict of common keys 
-				precomputed_kwargs = dict(
-					username=username,
-					request_name=request_name,
-					sample_name=sample_name,
-					imaging_request_number=imaging_request_number,
-					processing_request_number=processing_request_number,
-					image_resolution=image_resolution,channel_name=channel_name,
-					ventral_up=ventral_up,
-					channel_index=channel_index,
-					z_step=z_step,
-					processing_pipeline_jobid_step0=processing_pipeline_jobid_step0)
-
-				# Handle specific things for blending vs. registered pipelines
-				if precomputed_pipeline == 'blending':
-
-					blended_data_rootpath = os.path.join(
-						data_bucket_rootpath,
-						username,
-						request_name,sample_name,
-						f"imaging_request_{imaging_request_number}",
-						"output",
-						f"processing_request_{processing_request_number}")
-
-					viz_dir = os.path.join(data_bucket_rootpath,username,
-							 request_name,sample_name,
-							 f"imaging_request_{imaging_request_number}",
-							 "viz",
-							 f"processing_request_{processing_request_number}",
-							 "blended")
-
-					channel_index_padded = str(channel_index).zfill(2)
-					
-					if ventral_up:
-
-						blended_data_path = os.path.join(blended_data_rootpath, 
-							 f"resolution_{image_resolution}_ventral_up",
-							 "full_sizedatafld",
-							 f"{rawdata_subfolder}_ch{channel_index_padded}")
-
-						channel_viz_dir = os.path.join(viz_dir,f'channel_{channel_name}_ventral_up')
-
-					else:
-						blended_data_path = os.path.join(blended_data_rootpath,
-							 f"resolution_{image_resolution}",
-							 "full_sizedatafld",
-							 f"{rawdata_subfolder}_ch{channel_index_padded}")
-					
-						channel_viz_dir = os.path.join(viz_dir,f'channel_{channel_name}')
-
-					precomputed_kwargs['blended_data_path'] = blended_data_path
-					layer_name = f'channel{channel_name}_blended'
-					
-				elif precomputed_pipeline == 'registered':
-					this_processing_resolution_content = db_lightsheet.Request.ProcessingResolutionRequest() & \
-	                       {
-	                       'username':username,
-	                       'sample_name':sample_name,
-	                       'imaging_request_number':imaging_request_number,
-	                       'processing_request_number':processing_request_number,
-	                       'image_resolution':image_resolution,
-	                       'ventral_up':ventral_up}
-					atlas_name = this_processing_resolution_content.fetch1('atlas_name')
-
-					registered_data_rootpath = os.path.join(
-						data_bucket_rootpath,username,
-						request_name,sample_name,
-						f"imaging_request_{imaging_request_number}",
-						"output",
-						 f"processing_request_{processing_request_number}")
-
-					viz_dir = os.path.join(data_bucket_rootpath,username,
-							 request_name,sample_name,
-							 f"imaging_request_{imaging_request_number}",
-							 "viz",
-							 f"processing_request_{processing_request_number}",
-							 "registered")
-
-					if ventral_up:
-
-						registered_data_path = os.path.join(registered_data_rootpath, 
-									 f"resolution_{image_resolution}_ventral_up",
-									 "elastix")
-
-						channel_viz_dir = os.path.join(viz_dir,
-							f'channel_{channel_name}_{lightsheet_channel_str}_ventral_up')
-
-						layer_name = f'channel{channel_name}_registered_ventral_up'
-					else:
-						
-						registered_data_path = os.path.join(registered_data_rootpath,
-									 f"resolution_{image_resolution}",
-									 "elastix")
-
-						channel_viz_dir = os.path.join(viz_dir,
-							f'channel_{channel_name}_{lightsheet_channel_str}')
-
-						layer_name = f'channel{channel_name}_registered'
-
-					precomputed_kwargs['registered_data_path'] = registered_data_path
-					precomputed_kwargs['lightsheet_channel_str'] = lightsheet_channel_str
-					precomputed_kwargs['rawdata_subfolder'] = rawdata_subfolder
-					precomputed_kwargs['atlas_name'] = atlas_name
-
-				precomputed_kwargs['viz_dir'] = channel_viz_dir
-				# Make precomputed layer directory
-				layer_dir = os.path.join(channel_viz_dir,layer_name)
-				mymkdir(layer_dir)
-				logger.debug(f"Created directory {layer_dir}")
-				st = os.stat(layer_dir)
-				logger.info(f"wrote direcotry: {layer_dir}")
-				logger.debug("Permissions on dir are originally:")
-				logger.debug(st.st_mode)
-				# Add group write permissions to both parent dir and layer dir so that lightserv-test can write the progress dir and layer data to it 
-				os.chmod(channel_viz_dir,st.st_mode | stat.S_IWGRP)
-				os.chmod(layer_dir,st.st_mode | stat.S_IWGRP)
-
-				precomputed_kwargs['layer_name'] = layer_name
-				
+		elif precomputed_pipeline == 'registered':
+			registered_data_path = os.path.join(output_rootpath, 
+						 resolution_dirname,
+						 "elastix")
+			viz_dir = os.path.join(viz_rootpath,"registered")
+			if ventral_up:
+				channel_viz_dir = os.path.join(viz_dir,
+					f'channel_{channel_name}_{lightsheet_channel_str}_ventral_up')
+				layer_name = f'channel{channel_name}_registered_ventral_up'
+			else:
+				channel_viz_dir = os.path.join(viz_dir,
+					f'channel_{channel_name}_{lightsheet_channel_str}')
+				layer_name = f'channel{channel_name}_registered'
+
+			precomputed_kwargs['registered_data_path'] = registered_data_path
+			precomputed_kwargs['lightsheet_channel_str'] = lightsheet_channel_str
+			precomputed_kwargs['rawdata_subfolder'] = rawdata_subfolder
+			precomputed_kwargs['atlas_name'] = atlas_name
+
+		elif precomputed_pipeline == 'downsized':
+			downsized_data_path = os.path.join(output_rootpath,resolution_dirname)
+			viz_dir = os.path.join(viz_rootpath,"downsized")
+			if ventral_up:
+				channel_viz_dir = os.path.join(viz_dir,f'channel_{channel_name}_ventral_up')
+			else:
+				channel_viz_dir = os.path.join(viz_dir,f'channel_{channel_name}')
+			layer_name = f'channel{channel_name}_downsized'
+
+			precomputed_kwargs['downsized_data_path'] = downsized_data_path
+			precomputed_kwargs['rawdata_subfolder'] = rawdata_subfolder
+			precomputed_kwargs['atlas_name'] = atlas_name
+
+		precomputed_kwargs['viz_dir'] = channel_viz_dir
+		# Make precomputed layer directory
+		layer_dir = os.path.join(channel_viz_dir,layer_name)
+		mymkdir(layer_dir)
+		logger.debug(f"Created directory {layer_dir}")
+		st = os.stat(layer_dir)
+		logger.info(f"wrote direcotry: {layer_dir}")
+		logger.debug("Permissions on dir are originally:")
+		logger.debug(st.st_mode)
+		# Add group write permissions to both parent dir and layer dir so that lightserv-test can write the progress dir and layer data to it 
+		os.chmod(channel_viz_dir,st.st_mode | stat.S_IWGRP)
+		os.chmod(layer_dir,st.st_mode | stat.S_IWGRP)
+
+		precomputed_kwargs['layer_name'] = layer_name
+		precomputed_kwargs_list.append(precomputed_kwargs)
+	
+	return precomputed_kwargs_list
 
-				if not os.environ['FLASK_MODE'] == 'TEST':
-					if precomputed_pipeline == 'blending':
-						make_precomputed_blended_data.delay(**precomputed_kwargs)
-					elif precomputed_pipeline == 'registered':
-						make_precomputed_registered_data.delay(**precomputed_kwargs)
-					logger.info(f"Sent task to start the {precomputed_pipeline} pipeline")
+@cel.task()
+def check_for_spock_jobs_ready_for_making_precomputed_data():
+	""" 
+	A celery task for catching up on precomputed pipelines 
+	that were never started, e.g. because the step completed event
+	was lost when sending it failed or the worker died after the status checker
+	stored the new status. Run on a low frequency schedule in production.
+
+	Sends a start_precomputed_pipeline event for every job whose step
+	is complete but whose precomputed pipeline has not been started.
+	Those tasks make sure each pipeline is only started once.
+
+	Only the latest status of each job is looked at, using SpockJobCurrentStatus(),
+	and only jobs whose status changed in the last 
+	PRECOMPUTED_READY_CHECK_WINDOW_HOURS, so the work does not
+	grow with the history of the ProcessingPipelineSpockJob() table.
+	"""
+	window_hours = current_app.config['PRECOMPUTED_READY_CHECK_WINDOW_HOURS']
+	recent_status_contents = db_spockadmin.SpockJobCurrentStatus() & \
+		{'spock_dbtable':'ProcessingPipelineSpockJob'} & \
+		f'timestamp > NOW() - INTERVAL {int(window_hours)} HOUR'
+	latest_spock_job_contents = db_spockadmin.ProcessingPipelineSpockJob() * \
+		recent_status_contents.proj('timestamp',jobid_step0='jobid')
+	
+	trigger_steps = current_app.config['PRECOMPUTED_PIPELINE_TRIGGER_STEPS']
+	
+	n_events = 0
+	for precomputed_pipeline,step in trigger_steps.items():
+		logger.info(f"Checking for jobs ready for {precomputed_pipeline} precomputed pipeline")
+		
+		job_contents = latest_spock_job_contents & {
+			f'status_step{step}':'COMPLETED'
+			}
+		started_contents = db_spockadmin.PrecomputedPipelineStart() & \
+			{'precomputed_pipeline':precomputed_pipeline}
+		not_started_contents = job_contents - started_contents.proj(
+			jobid_step0='processing_pipeline_jobid_step0')
+
+		for job_dict in not_started_contents.fetch(
+			'jobid_step0','jobid_step2','jobid_step3',as_dict=True):
+			start_precomputed_pipeline.delay(
+				precomputed_pipeline=precomputed_pipeline,
+				processing_pipeline_jobid_step0=job_dict['jobid_step0'],
+				processing_pipeline_jobid_step2=job_dict['jobid_step2'],
+				processing_pipeline_jobid_step3=job_dict['jobid_step3'])
+			n_events += 1
+
+	return f"Sent {n_events} events for light sheet pipeline jobs which are ready for precomputed pipelines"
 
-	return "Checked for light sheet pipeline jobs which are ready for precomputed pipelines"
+@cel.task()
+def rebuild_spock_job_current_status():
+	""" 
+	A celery task for (re)building the SpockJobCurrentStatus() table
+	from the full history of the spock job tables. 
+	Needs to be run once after SpockJobCurrentStatus() is created,
+	since rows inserted before then are not in it. 
+	Not run on a schedule.
+	"""
+	n_rows = 0
+	for spock_dbtable_str in spock_job_table_names:
+		spock_dbtable = getattr(db_spockadmin,spock_dbtable_str)
+		jobid_column = spock_dbtable().primary_key[0]
+		unique_contents = get_latest_spock_job_contents(spock_dbtable,
+			jobid_column=jobid_column)
+		current_status_rows = [dict(
+			spock_dbtable=spock_dbtable_str,
+			jobid=job_dict[jobid_column],
+			timestamp=job_dict['timestamp'],
+			is_active=int(is_active_job(job_dict))) for job_dict in unique_contents.fetch(as_dict=True)]
+		logger.info(f"Rebuilding {len(current_status_rows)} current statuses for {spock_dbtable_str}")
+		db_spockadmin.SpockJobCurrentStatus.insert(current_status_rows,replace=True)
+		n_rows += len(current_status_rows)
+	return f"Rebuilt {n_rows} rows of SpockJobCurrentStatus"
 
 @cel.task()
-def smartspim_corrected_precomputed_job_status_checker():
+def smartspim_corrected_precomputed_job_status_checker(sacct_status_dict=None):
 	""" 
 	A celery task that will be run in a schedule
 
@@ -1851,119 +2021,31 @@ def smartspim_corrected_precomputed_job_status_checker():
 	and updates their status in the SmartspimCorrectedPrecomputedSpockJob()
 	in db_spockadmin
 	and SmartspimPystripeChannel() in db_lightsheet 
+
+	sacct_status_dict is passed in when this is run
+	as a handler by spock_job_status_poller()
 	"""
    
 	""" First get all rows with latest timestamps """
-	job_contents = db_spockadmin.SmartspimCorrectedPrecomputedSpockJob()
-	unique_contents = dj.U('jobid_step3','username',).aggr(
-		job_contents,timestamp='max(timestamp)')*job_contents
+	unique_contents = get_active_spock_job_contents(
+		db_spockadmin.SmartspimCorrectedPrecomputedSpockJob)
 	
-	""" Get a list of all jobs we need to check up on, i.e.
-	those that could conceivably change. """
-
-	ongoing_codes = ('SUBMITTED','RUNNING','PENDING','REQUEUED','RESIZING','SUSPENDED')
-	incomplete_contents = unique_contents & f'status_step3 in {ongoing_codes}'
-	jobids = list(incomplete_contents.fetch('jobid_step3'))
-	if jobids == []:
+	""" Get the statuses of the jobs that could conceivably change
+	and update their progress in the SmartspimPystripeChannel() table """
+	job_insert_list = get_job_statuses(
+		unique_contents=unique_contents,
+		max_step_index=3,
+		lightsheet_dbtable=db_lightsheet.Request.SmartspimPystripeChannel,
+		lightsheet_column_name='smartspim_corrected_precomputed_spock_jobid',
+		sacct_status_dict=sacct_status_dict)
+	if not job_insert_list:
 		return "No jobs to check"
-	jobids_str = ','.join(str(jobid) for jobid in jobids)
-	logger.debug(f"Outstanding job ids are: {jobids}")
-	
-	client = connect_to_spock()
-	logger.debug("connected to spock")
-	try:
-		command = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(jobids_str)
-		stdin, stdout, stderr = client.exec_command(command)
-
-		stdout_str = stdout.read().decode("utf-8")
-		logger.debug("The response from spock is:")
-		logger.debug(stdout_str)
-		response_lines = stdout_str.strip('\n').split('\n')
-		jobids_received = [x.split('|')[0].split('_')[0] for x in response_lines] # They could be listed as array jobs, e.g. 18521829_[0-5], 18521829_1, or just 18521829 depending on their status
-		status_codes_received = [x.split('|')[1] for x in response_lines]
-		logger.debug("Job ids received")
-		logger.debug(jobids_received)
-		logger.debug("Status codes received")
-		logger.debug(status_codes_received)
-		job_status_indices_dict = {jobid:[i for i, x in enumerate(jobids_received) if x == jobid] for jobid in set(jobids_received)} 
-		job_insert_list = []
-	except:
-		logger.debug("Something went wrong fetching job statuses from spock.")
-		client.close()
-		return "Error fetching job statuses from spock"
 
-	""" Loop through the jobids and determine 
-	their status from the list of statuses for each of their array jobs"""
-	for jobid,indices_list in job_status_indices_dict.items():
-		logger.debug(f"Working on jobid={jobid}")
-		job_insert_dict = {'jobid_step3':jobid}
-		status_codes = [status_codes_received[ii] for ii in indices_list]
-		status_step3 = determine_status_code(status_codes)
-		logger.debug(f"Status code for this job is: {status_step3}")
-		job_insert_dict['status_step3'] = status_step3
-		""" Find the username, other jobids associated with this jobid """
-		(username_thisjob,jobid_step0,jobid_step1,jobid_step2) = (
-				unique_contents & f'jobid_step3={jobid}').fetch1(
-				'username','jobid_step0',
-				'jobid_step1','jobid_step2')
-		job_insert_dict['username']=username_thisjob
-		job_insert_dict['jobid_step0']=jobid_step0
-		job_insert_dict['jobid_step1']=jobid_step1
-		job_insert_dict['jobid_step2']=jobid_step2
-		jobid_step_dict = {
-			'step0':jobid_step0,
-			'step1':jobid_step1,
-			'step2':jobid_step2}
-		
-		""" Similarly, figure out the status codes for the earlier dependency jobs """
-		this_run_earlier_jobids_str = ','.join([jobid_step0,jobid_step1,jobid_step2])
-		try:
-			command_earlier_steps = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(this_run_earlier_jobids_str)
-			stdin_earlier_steps, stdout_earlier_steps, stderr_earlier_steps = client.exec_command(command_earlier_steps)
-		except:
-			logger.debug("Something went wrong fetching steps 0-1 job statuses from spock.")
-			client.close()
-			return "Error fetching steps 0-1 job statuses from spock"
-		stdout_str_earlier_steps = stdout_earlier_steps.read().decode("utf-8")
-		try:
-			response_lines_earlier_steps = stdout_str_earlier_steps.strip('\n').split('\n')
-			jobids_received_earlier_steps = [x.split('|')[0].split('_')[0] for x in response_lines_earlier_steps] # They will be listed as array jobs, e.g. 18521829_[0-5], 18521829_1 depending on their status
-			status_codes_received_earlier_steps = [x.split('|')[1] for x in response_lines_earlier_steps]
-		except:
-			logger.debug("Something went wrong parsing output of sacct query for steps 0-2 on spock")
-			client.close()
-			return "Error parsing sacct query of jobids for steps 0-2 on spock"
-
-		job_status_indices_dict_earlier_steps = {jobid:[i for i, x in enumerate(jobids_received_earlier_steps) \
-			if x == jobid] for jobid in set(jobids_received_earlier_steps)} 
-		
-		""" Loop through the jobids from the earlier steps
-		and figure out their statuses from their array job statuses"""
-		for step_counter in range(2):
-			step = f'step{step_counter}'
-			jobid_earlier_step = jobid_step_dict[step]
-			indices_list_earlier_step = job_status_indices_dict_earlier_steps[jobid_earlier_step]
-			status_codes_earlier_step = [status_codes_received_earlier_steps[ii] for ii in indices_list_earlier_step]
-			status = determine_status_code(status_codes_earlier_step)
-			status_step_str = f'status_step{step_counter}'
-			job_insert_dict[status_step_str] = status
-			step_counter +=1 
-
-		job_insert_list.append(job_insert_dict)
-
-		""" Get the pystripe channel entry associated with this jobid
-		and update the progress """
+	for job_insert_dict in job_insert_list:
+		jobid = job_insert_dict['jobid_step3']
+		status_step3 = job_insert_dict['status_step3']
 		restrict_dict = dict(smartspim_corrected_precomputed_spock_jobid=jobid)
-		replace_key = 'smartspim_corrected_precomputed_spock_job_progress'
 		this_pystripe_channel_content = db_lightsheet.Request.SmartspimPystripeChannel() & restrict_dict
-		logger.debug("this pystripe channel content:")
-		logger.debug(this_pystripe_channel_content)
-
-		pystripe_channel_update_dict = this_pystripe_channel_content.fetch1()
-		pystripe_channel_update_dict[replace_key] = status_step3
-		db_lightsheet.Request.SmartspimPystripeChannel().update1(pystripe_channel_update_dict)
-
-		logger.info(f"Updated {replace_key} in SmartspimPystripeChannel() table ")
 
 		""" If this pipeline run is now 100 percent complete,
 		figure out if all of the other stitched precomputed
@@ -2055,9 +2137,7 @@ def smartspim_corrected_precomputed_job_status_checker():
 				send_admin_email.delay(subject=subject,body=admin_body)
 	logger.debug("Insert list:")
 	logger.debug(job_insert_list)
-	db_spockadmin.SmartspimCorrectedPrecomputedSpockJob.insert(job_insert_list)
+	insert_spock_jobs(db_spockadmin.SmartspimCorrectedPrecomputedSpockJob,job_insert_list)
 	logger.debug("Entry in SmartspimCorrectedPrecomputedSpockJob() spockadmin table with latest status")
 
-	client.close()
-
 	return "Checked smartspim corrected precomptued job statuses"
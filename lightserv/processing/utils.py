@@ -1,4 +1,6 @@
-from lightserv.main.tasks import connect_to_spock
+from lightserv import db_spockadmin
+import datajoint as dj
+import time
 
 import logging
 logger = logging.getLogger(__name__)
@@ -46,152 +48,361 @@ def determine_status_code(status_codes):
 		status = 'CANCELLED'
 	return status
 
+def parse_sacct_output(stdout_str):
+	""" 
+	---PURPOSE---
+	Parse the output of the sacct query made in SpockBackend.status_batch()
+	into a dictionary of pooled statuses, one per jobid.
+	Array jobs are listed once per array task, e.g. 18521829_[0-5], 18521829_1,
+	so their statuses are pooled with determine_status_code()
+	---INPUT---
+	stdout_str    - the decoded stdout of the sacct command
+	---OUTPUT---
+	sacct_status_dict - dictionary like {'18521829':'RUNNING','18521830':'COMPLETED'}
+	"""
+	response_lines = [x for x in stdout_str.strip('\n').split('\n') if x.strip() != '']
+	status_codes_by_jobid = {}
+	for line in response_lines:
+		jobid_str,status_code = line.split('|')[0:2]
+		jobid = jobid_str.split('_')[0]
+		status_codes_by_jobid.setdefault(jobid,[]).append(status_code)
+	sacct_status_dict = {jobid:determine_status_code(status_codes) \
+		for jobid,status_codes in status_codes_by_jobid.items()}
+	return sacct_status_dict
+
+def fetch_sacct_statuses(jobids):
+	""" 
+	---PURPOSE---
+	Get the statuses of any number of spock jobs 
+	(and all of their steps) with a single query to the cluster backend
+	---INPUT---
+	jobids        - iterable of jobids (strings or ints). Duplicates and Nones are ignored
+	---OUTPUT---
+	sacct_status_dict - dictionary mapping jobid -> pooled status code,
+						or None if the query failed
+	"""
+	from lightserv.processing.cluster import get_cluster_backend
+	jobids = sorted(set(str(jobid) for jobid in jobids if jobid))
+	if jobids == []:
+		return {}
+	logger.debug(f"Fetching statuses for {len(jobids)} job ids")
+	return get_cluster_backend().status_batch(jobids)
+
+spock_job_table_names = ('ProcessingPipelineSpockJob','SmartspimStitchingSpockJob',
+	'SmartspimDependentStitchingSpockJob','SmartspimPystripeSpockJob',
+	'RawPrecomputedSpockJob','StitchedPrecomputedSpockJob','BlendedPrecomputedSpockJob',
+	'DownsizedPrecomputedSpockJob','RegisteredPrecomputedSpockJob',
+	'SmartspimCorrectedPrecomputedSpockJob')
+
+def get_latest_spock_job_contents(spock_dbtable,jobid_column='jobid_step0'):
+	""" 
+	---PURPOSE---
+	The spock job tables are append-only, so a job has one row
+	per status check. Return the rows with the latest timestamp for each job.
+	This aggregates over the whole history of the table, so the 
+	status checkers use get_active_spock_job_contents() instead.
+	---INPUT---
+	spock_dbtable  - a table class from db_spockadmin
+	jobid_column   - the jobid column that identifies a job in this table
+	---OUTPUT---
+	unique_contents - datajoint expression of the latest rows
+	"""
+	job_contents = spock_dbtable()
+	unique_contents = dj.U(jobid_column,'username').aggr(
+		job_contents,timestamp='max(timestamp)')*job_contents
+	return unique_contents
+
+def get_active_spock_job_contents(spock_dbtable):
+	""" 
+	---PURPOSE---
+	Return the latest rows of the jobs in a spock job table 
+	that can still change status, using the SpockJobCurrentStatus() table.
+	Only rows whose primary key is in SpockJobCurrentStatus() are read,
+	so this does not get slower as the table grows.
+	---INPUT---
+	spock_dbtable  - a table class from db_spockadmin
+	---OUTPUT---
+	active_contents - datajoint expression of the latest rows of the active jobs
+	"""
+	jobid_column = spock_dbtable().primary_key[0]
+	active_jobs = db_spockadmin.SpockJobCurrentStatus() & {
+		'spock_dbtable':spock_dbtable.__name__,'is_active':1}
+	active_contents = spock_dbtable() * active_jobs.proj(
+		'timestamp',**{jobid_column:'jobid'})
+	return active_contents
+
+def is_active_job(job_dict):
+	""" Whether any step of a spock job could still change status """
+	return any(val in ongoing_codes for key,val in job_dict.items() \
+		if key.startswith('status_step'))
+
+def insert_spock_jobs(spock_dbtable,job_insert_list):
+	""" 
+	---PURPOSE---
+	Insert new rows into an append-only spock job table and 
+	point SpockJobCurrentStatus() at them in the same transaction. 
+	All inserts into the spock job tables should go through here
+	so that the status checkers see the latest rows.
+	---INPUT---
+	spock_dbtable    - a table class from db_spockadmin
+	job_insert_list  - list of row dictionaries (without timestamp)
+	"""
+	if not job_insert_list:
+		return
+	table = spock_dbtable()
+	connection = table.connection
+	# Use the database's clock, the same one CURRENT_TIMESTAMP would use 
+	now = connection.query('SELECT CURRENT_TIMESTAMP').fetchone()[0]
+	jobid_column = table.primary_key[0]
+	spock_dbtable_str = spock_dbtable.__name__
+	rows = [dict(job_insert_dict,timestamp=now) for job_insert_dict in job_insert_list]
+	current_status_rows = [dict(
+		spock_dbtable=spock_dbtable_str,
+		jobid=row[jobid_column],
+		timestamp=now,
+		is_active=int(is_active_job(row))) for row in rows]
+	with connection.transaction:
+		table.insert(rows)
+		db_spockadmin.SpockJobCurrentStatus.insert(current_status_rows,replace=True)
+	logger.debug(f"Inserted {len(rows)} rows into {spock_dbtable_str}")
+
+class BulkUpdater(object):
+	""" 
+	---PURPOSE---
+	Collects the column updates made during one status check 
+	and applies them with a few set-based UPDATE statements 
+	in a single transaction, instead of a fetch1() and update1() 
+	(two round trips to the database) per row.
+
+	Updates that set the same values in the same table are grouped into
+	one statement: UPDATE table SET ... WHERE (key columns) IN (...),
+	which is split into batches of at most batch_size rows. 
+	The time taken by each batch is logged and kept in self.timings.
+	---INPUT---
+	batch_size   - maximum number of rows to put in the IN clause of one statement
+	"""
+	def __init__(self,batch_size=500):
+		self.batch_size = batch_size
+		self.updates = {} # (table,key columns,set items) -> list of key values
+		self.timings = []
+
+	def add(self,dbtable,restrict_dict,update_dict):
+		""" 
+		Queue an update of the columns in update_dict
+		for the rows of dbtable matching restrict_dict.
+		restrict_dict does not have to be a primary key, e.g. {'lightsheet_pipeline_spock_jobid':jobid}
+		"""
+		key_columns = tuple(sorted(restrict_dict.keys()))
+		set_items = tuple(sorted(update_dict.items()))
+		group = (dbtable,key_columns,set_items)
+		key_values = tuple(restrict_dict[column] for column in key_columns)
+		key_values_list = self.updates.setdefault(group,[])
+		if key_values not in key_values_list:
+			key_values_list.append(key_values)
+
+	def pending_value(self,dbtable,restrict_dict,column,default=None):
+		""" The value that column will be set to for a row once the updates are applied,
+		or default if no update to that column has been queued for that row """
+		key_columns = tuple(sorted(restrict_dict.keys()))
+		key_values = tuple(restrict_dict[key_column] for key_column in key_columns)
+		value = default
+		for (group_table,group_key_columns,set_items),key_values_list in self.updates.items():
+			if group_table is dbtable and group_key_columns == key_columns \
+				and key_values in key_values_list:
+				value = dict(set_items).get(column,value)
+		return value
+
+	def __len__(self):
+		return sum(len(key_values_list) for key_values_list in self.updates.values())
+
+	def make_statements(self):
+		""" Turn the queued updates into a list of (query,args) tuples """
+		statements = []
+		for (dbtable,key_columns,set_items),key_values_list in self.updates.items():
+			set_str = ', '.join(f'`{column}`=%s' for column,_ in set_items)
+			set_args = [value for _,value in set_items]
+			key_columns_str = ','.join(f'`{column}`' for column in key_columns)
+			row_placeholder = '(' + ','.join(['%s']*len(key_columns)) + ')'
+			for start in range(0,len(key_values_list),self.batch_size):
+				batch = key_values_list[start:start+self.batch_size]
+				in_str = ','.join([row_placeholder]*len(batch))
+				query = (f'UPDATE {dbtable().full_table_name} SET {set_str} '
+						 f'WHERE ({key_columns_str}) IN ({in_str})')
+				args = set_args + [value for key_values in batch for value in key_values]
+				statements.append((query,args))
+		return statements
+
+	def apply(self):
+		""" Run all queued updates in one transaction and clear the queue """
+		if not self.updates:
+			return
+		statements = self.make_statements()
+		connection = dj.conn()
+		start_transaction = time.time()
+		with connection.transaction:
+			for query,args in statements:
+				start = time.time()
+				n_rows = connection.query(query,args=args).rowcount
+				elapsed = time.time() - start
+				self.timings.append({'query':query.split(' WHERE')[0],
+					'n_rows':n_rows,'seconds':elapsed})
+				logger.debug(f"{query.split(' WHERE')[0]} updated {n_rows} rows in {elapsed:.3f} s")
+		logger.info(f"Applied {len(self)} updates with {len(statements)} statements "
+					f"in {time.time() - start_transaction:.3f} s")
+		self.updates = {}
+
+def get_outstanding_jobids(unique_contents):
+	""" 
+	---PURPOSE---
+	Find every jobid (of every step) belonging to jobs 
+	that have at least one step that could still change status
+	---INPUT---
+	unique_contents  - datajoint expression, see get_active_spock_job_contents()
+	---OUTPUT---
+	jobids           - set of jobid strings
+	"""
+	step_indices = [int(name.replace('status_step','')) for name in \
+		unique_contents.heading.names if name.startswith('status_step')]
+	restriction = ' OR '.join(f'status_step{ii} in {ongoing_codes}' for ii in step_indices)
+	outstanding_contents = unique_contents & restriction
+	jobid_columns = [f'jobid_step{ii}' for ii in step_indices]
+	jobids = set()
+	for job_dict in outstanding_contents.fetch(*jobid_columns,as_dict=True):
+		jobids.update(jobid for jobid in job_dict.values() if jobid)
+	return jobids
+
+def make_job_insert_dict(job_dict,max_step_index,sacct_status_dict):
+	""" 
+	---PURPOSE---
+	Fill in the statuses of all steps 0-max_step_index of a job
+	using the statuses returned by sacct. If sacct did not report on 
+	an earlier step the previously recorded status is kept.
+	---INPUT---
+	job_dict          - dictionary of the fields fetched from a spock job table
+	max_step_index    - the step id of the last step, 0-indexed
+	sacct_status_dict - see fetch_sacct_statuses()
+	---OUTPUT---
+	job_insert_dict   - dictionary ready to insert into the spock job table
+	"""
+	job_insert_dict = {key:val for key,val in job_dict.items() if key != 'timestamp'}
+	for step_counter in range(max_step_index+1):
+		jobid_this_step = job_insert_dict.get(f'jobid_step{step_counter}')
+		status_step_str = f'status_step{step_counter}'
+		if jobid_this_step in sacct_status_dict:
+			job_insert_dict[status_step_str] = sacct_status_dict[jobid_this_step]
+		logger.debug(f"status of step{step_counter} is {job_insert_dict.get(status_step_str)}")
+	return job_insert_dict
+
 def get_job_statuses(
 	unique_contents,
 	max_step_index,
 	lightsheet_dbtable,
 	lightsheet_column_name,
-	is_precomputed_task=False):
+	is_precomputed_task=False,
+	sacct_status_dict=None,
+	bulk_updater=None):
+	""" 
+	---PURPOSE---
+	Figure out the latest statuses of all outstanding jobs
+	in a spock job table and update the job progress in the lightsheet table
+	---INPUT---
+	unique_contents        - latest rows of the spock job table, see get_active_spock_job_contents()
+	max_step_index         - the step id of the last step, 0-indexed
+	lightsheet_dbtable     - the db_lightsheet table that keeps track of the job progress
+	lightsheet_column_name - the column in lightsheet_dbtable containing the spock jobid
+	is_precomputed_task    - whether this is one of the precomputed pipelines
+	sacct_status_dict      - (optional) statuses of all steps, as returned by fetch_sacct_statuses().
+							 This is passed in by spock_job_status_poller() which fetches the statuses
+							 for all spock job tables at once. If not provided, a single sacct 
+							 query is made here for all steps of the outstanding jobs.
+	bulk_updater           - (optional) BulkUpdater() to queue the lightsheet table updates on.
+							 The caller is then responsible for calling its apply() method.
+							 If not provided, the updates are applied before returning.
+	---OUTPUT---
+	job_insert_list        - list of dictionaries to insert into the spock job table
+	"""
 	# Get a list of all jobs we need to check up on
 	incomplete_contents = unique_contents & f'status_step{max_step_index} in {ongoing_codes}'
-	jobids = list(incomplete_contents.fetch(f'jobid_step{max_step_index}'))
 	
-	if jobids == []:
+	# Find the username, other jobids associated with the jobs 
+	jobids_to_fetch = [f'jobid_step{ii}' for ii in range(max_step_index+1)] 
+	fields_to_fetch = ['username'] + jobids_to_fetch + \
+		[f'status_step{ii}' for ii in range(max_step_index)]
+	if is_precomputed_task:
+		fields_to_fetch += ['processing_pipeline_jobid_step0']
+		if 'stitched' in lightsheet_column_name:
+			fields_to_fetch += ['lightsheet'] 
+	
+	if lightsheet_column_name == "lightsheet_pipeline_spock_jobid":
+		fields_to_fetch += ['stitching_method']
+	
+	outstanding_job_dicts = incomplete_contents.fetch(*fields_to_fetch,as_dict=True)
+
+	if outstanding_job_dicts == []:
 		logger.debug("No jobs to check")
 		return []
 
-	jobids_str = ','.join(str(jobid) for jobid in jobids)
-	logger.debug(f"Outstanding job ids are: {jobids}")
+	logger.debug("Outstanding job ids are: {}".format(
+		[job_dict[f'jobid_step{max_step_index}'] for job_dict in outstanding_job_dicts]))
 	
-	job_insert_list = []
+	if sacct_status_dict is None:
+		all_step_jobids = [job_dict[jobid_column] for job_dict in outstanding_job_dicts \
+			for jobid_column in jobids_to_fetch]
+		sacct_status_dict = fetch_sacct_statuses(all_step_jobids)
+		if sacct_status_dict is None:
+			return []
+
+	""" Find which of the jobs have an entry in the lightsheet table with a single query.
+	The stitched precomputed jobs are in one of two columns depending on the light sheet """
+	if 'stitched' in lightsheet_column_name:
+		lightsheet_column_names = ["left_lightsheet_" + lightsheet_column_name,
+			"right_lightsheet_" + lightsheet_column_name]
+	else:
+		lightsheet_column_names = [lightsheet_column_name]
+	maxstep_jobids = [job_dict[f'jobid_step{max_step_index}'] for job_dict in outstanding_job_dicts]
+	existing_lightsheet_jobids = {}
+	for column_name in lightsheet_column_names:
+		this_lightsheet_contents = lightsheet_dbtable() & \
+			[{column_name:jobid} for jobid in maxstep_jobids]
+		existing_lightsheet_jobids[column_name] = set(this_lightsheet_contents.fetch(column_name))
 	
-	# connect via ssh
-	client = connect_to_spock()
-	logger.debug("connected to spock")
-
-	try:
-		command = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(jobids_str)
-		stdin, stdout, stderr = client.exec_command(command)
-
-		stdout_str = stdout.read().decode("utf-8")
-		logger.debug("The response from spock is:")
-		logger.debug(stdout_str)
-
-		response_lines = stdout_str.strip('\n').split('\n')
-		jobids_received = [x.split('|')[0].split('_')[0] for x in response_lines] # They will be listed as array jobs, e.g. 18521829_[0-5], 18521829_1 depending on their status
-		status_codes_received = [x.split('|')[1] for x in response_lines]
-		logger.debug("Job ids received")
-		logger.debug(jobids_received)
-		logger.debug("Status codes received")
-		logger.debug(status_codes_received)
-		
-		# Make a dictionary keeping track of the statuses of array jobs of a given jobid
-		# like {'1234567':[0,1,2],'1234568':[0]} for a jobid that has 3 array jobs 
-		# and one that has no array jobs 
-		job_status_indices_dict = {
-			jobid:[i for i, x in enumerate(jobids_received) if x == jobid] \
-			for jobid in set(jobids_received)} 
-		
-	except:
-		logger.debug("Something went wrong fetching job statuses from spock.")
-		client.close()
-		return "Error fetching job statuses from spock"
+	apply_updates = bulk_updater is None
+	if apply_updates:
+		bulk_updater = BulkUpdater()
 
+	job_insert_list = []
+	
 	# Loop through outstanding jobs and determine their statuses
-	# Use array jobs to make a "pooled" status if necessary 
-	for jobid,indices_list in job_status_indices_dict.items():
+	for job_dict in outstanding_job_dicts:
+		jobid = job_dict[f'jobid_step{max_step_index}']
 		logger.debug(f"Working on jobid={jobid}")
+		if jobid not in sacct_status_dict:
+			logger.debug(f"No status returned by sacct for jobid={jobid}. Skipping")
+			continue
 		
-		# Start assembling an insert for the spock table
-		job_insert_dict = {f'jobid_step{max_step_index}':jobid}
-
-		status_codes = [status_codes_received[ii] for ii in indices_list]
-		status_maxstep = determine_status_code(status_codes)
+		job_insert_dict = make_job_insert_dict(job_dict,max_step_index,sacct_status_dict)
+		status_maxstep = job_insert_dict[f'status_step{max_step_index}']
 		logger.debug(f"Status code for this job is: {status_maxstep}")
-		job_insert_dict[f'status_step{max_step_index}'] = status_maxstep
-		
-		# Find the username, other jobids associated with this jobid 
-		jobids_to_fetch = [f'jobid_step{ii}' for ii in range(max_step_index)] 
-		fields_to_fetch = ['username'] + jobids_to_fetch
-		if is_precomputed_task:
-			fields_to_fetch += ['processing_pipeline_jobid_step0']
-			if 'stitched' in lightsheet_column_name:
-				fields_to_fetch += ['lightsheet'] 
-		
-		if lightsheet_column_name == "lightsheet_pipeline_spock_jobid":
-			fields_to_fetch += ['stitching_method']
-
-		this_content = unique_contents & {f'jobid_step{max_step_index}':jobid}
-		fetched_contents=this_content.fetch(*fields_to_fetch,as_dict=True)[0]
-		for key,val in fetched_contents.items(): 
-			job_insert_dict[key]=val
-		jobid_step_dict = {f'step{ii}':job_insert_dict[f'jobid_step{ii}'] for ii in range(max_step_index)}
 
 		# update spock job progress in lightsheet table
+		lightsheet_column_name_thisjob = lightsheet_column_name
 		if 'stitched' in lightsheet_column_name:
-			lightsheet_thisjob = job_status_dict['lightsheet']
+			lightsheet_thisjob = job_insert_dict['lightsheet']
 			if lightsheet_thisjob == 'left':
-				lightsheet_column_name = "left_lightsheet_" + lightsheet_column_name
+				lightsheet_column_name_thisjob = "left_lightsheet_" + lightsheet_column_name
 			else:
-				lightsheet_column_name = "right_lightsheet_" + lightsheet_column_name
-		this_lightsheet_content = lightsheet_dbtable() & {lightsheet_column_name:jobid}
-
-		if len(this_lightsheet_content) == 0:
+				lightsheet_column_name_thisjob = "right_lightsheet_" + lightsheet_column_name
+		if jobid not in existing_lightsheet_jobids[lightsheet_column_name_thisjob]:
 			logger.debug(f"No entry found in lightsheet table: {lightsheet_dbtable}")
 			continue
-		logger.debug("this lightsheet content:")
-		logger.debug(this_lightsheet_content)
-		this_lightsheet_dict = this_lightsheet_content.fetch1()
-		replace_lightsheet_dict =  this_lightsheet_dict.copy()
-		lightsheet_replace_key = lightsheet_column_name.replace('jobid','job_progress')
-		replace_lightsheet_dict[lightsheet_replace_key] = status_maxstep
-		
-		lightsheet_dbtable().update1(replace_lightsheet_dict,)
-		logger.debug("Updated smartspim_stitching_spock_job_progress in SmartspimStitchedChannel() table ")
-		
-		# Figure out the status codes for the earlier dependency jobs
-		this_run_earlier_jobids_str = ','.join([job_insert_dict[f'jobid_step{ii}'] for ii in range(max_step_index)])
+		lightsheet_replace_key = lightsheet_column_name_thisjob.replace('jobid','job_progress')
+		bulk_updater.add(lightsheet_dbtable,{lightsheet_column_name_thisjob:jobid},
+			{lightsheet_replace_key:status_maxstep})
 		
-		if this_run_earlier_jobids_str != '':			
-		
-			try:
-				command_earlier_steps = """sacct -X -b -P -n -a  -j {} | cut -d "|" -f1,2""".format(this_run_earlier_jobids_str)
-				stdin_earlier_steps, stdout_earlier_steps, stderr_earlier_steps = client.exec_command(command_earlier_steps)
-			except:
-				logger.debug("Something went wrong fetching job statuses from spock.")
-				client.close()
-				return "Error fetching job statuses from spock"
-			
-			stdout_str_earlier_steps = stdout_earlier_steps.read().decode("utf-8")
-			
-			try:
-				response_lines_earlier_steps = stdout_str_earlier_steps.strip('\n').split('\n')
-				jobids_received_earlier_steps = [x.split('|')[0].split('_')[0] for x in response_lines_earlier_steps] # They will be listed as array jobs, e.g. 18521829_[0-5], 18521829_1 depending on their status
-				status_codes_received_earlier_steps = [x.split('|')[1] for x in response_lines_earlier_steps]
-			except:
-				logger.debug("Something went wrong parsing output of sacct query for earlier steps on spock")
-				client.close()
-				return "Error parsing sacct query of jobids for steps 0-2 on spock"
-
-			job_status_indices_dict_earlier_steps = {jobid:[i for i, x in enumerate(jobids_received_earlier_steps) \
-				if x == jobid] for jobid in set(jobids_received_earlier_steps)} 
-			
-			# Loop through the earlier steps and figure out their statuses 
-			logger.debug("looping through earlier steps (if any) to figure out statuses")
-
-			for step_counter in range(max_step_index):
-				step = f'step{step_counter}'
-				jobid_earlier_step = jobid_step_dict[step]
-				indices_list_earlier_step = job_status_indices_dict_earlier_steps[jobid_earlier_step]
-				status_codes_earlier_step = [status_codes_received_earlier_steps[ii] for ii in indices_list_earlier_step]
-				status = determine_status_code(status_codes_earlier_step)
-				status_step_str = f'status_step{step_counter}'
-				job_insert_dict[status_step_str] = status
-				logger.debug(f"status of {step} is {status}")
-				step_counter +=1 
-			logger.debug("done with earlier steps")
 		job_insert_list.append(job_insert_dict)
-
-	client.close()
 	
-	return job_insert_list
\ No newline at end of file
+	if apply_updates:
+		bulk_updater.apply()
+		logger.debug(f"Updated job progress in {lightsheet_dbtable.__name__}() table ")
+	
+	return job_insert_list
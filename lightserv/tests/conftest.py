@@ -275,6 +275,7 @@ def test_delete_spockadmin_db_contents(test_client):
 	db_spockadmin.BlendedPrecomputedSpockJob().delete()	
 	db_spockadmin.DownsizedPrecomputedSpockJob().delete()	
 	db_spockadmin.RegisteredPrecomputedSpockJob().delete()	
+	db_spockadmin.PrecomputedPipelineStart().delete()
 
 ################################
 """ Fixtures for requests    """
@@ -143,3 +143,122 @@ def test_nonadmin_cannot_access_dash(test_client,test_login_nonadmin):
 		follow_redirects=True)
 	assert b'Core Facility Dashboard' not in response.data
 	assert b'That page is restricted' in response.data 
+
+""" Tests for the pool of ssh connections to spock """
+
+class FakeTransport(object):
+	def __init__(self):
+		self.active = True
+
+	def is_active(self):
+		return self.active
+
+	def set_keepalive(self,interval):
+		pass
+
+class FakeSSHClient(object):
+	""" Stands in for paramiko.SSHClient. Set fail_next to make
+	the next exec_command() fail like a dropped connection """
+	instances = []
+
+	def __init__(self):
+		self.transport = FakeTransport()
+		self.closed = False
+		self.fail_next = False
+		FakeSSHClient.instances.append(self)
+
+	def load_system_host_keys(self):
+		pass
+
+	def set_missing_host_key_policy(self,policy):
+		pass
+
+	def connect(self,hostname,**kwargs):
+		pass
+
+	def get_transport(self):
+		return self.transport
+
+	def exec_command(self,command,**kwargs):
+		import paramiko
+		if self.fail_next:
+			self.transport.active = False
+			raise paramiko.SSHException("connection dropped")
+		return command
+
+	def close(self):
+		self.closed = True
+
+def make_fake_spock_connection_pool(monkeypatch,**pool_kwargs):
+	from lightserv.main import utils
+	FakeSSHClient.instances = []
+	monkeypatch.setattr(utils.paramiko,'SSHClient',FakeSSHClient)
+	return utils.SpockConnectionPool('spock.pni.princeton.edu','lightserv-test',**pool_kwargs)
+
+def test_spock_connection_pool_reuses_connections(monkeypatch):
+	""" Test that the pool opens a new connection only when 
+	all of the open ones have max_channels users and there 
+	is room for another one, and that released connections stay open """
+	pool = make_fake_spock_connection_pool(monkeypatch,max_connections=2,max_channels=2)
+	clients = [pool.acquire() for ii in range(5)]
+	assert len(FakeSSHClient.instances) == 2
+	stats = pool.get_stats()
+	assert (stats['hits'],stats['misses']) == (3,2)
+	assert stats['open_connections'] == 2
+	assert stats['users'] == 5
+	for client in clients:
+		client.close()
+	assert pool.get_stats()['users'] == 0
+	assert not any(fake_client.closed for fake_client in FakeSSHClient.instances)
+	with pool.acquire() as client:
+		assert client.exec_command('squeue') == 'squeue'
+	stats = pool.get_stats()
+	assert (stats['hits'],stats['misses']) == (4,2)
+	assert stats['users'] == 0
+
+def test_spock_connection_pool_reconnects(monkeypatch):
+	""" Test that a dropped connection is taken out of the pool, 
+	that every task using it gets a new connection without going
+	over max_connections and that releasing the dropped one 
+	afterwards does not leak users """
+	pool = make_fake_spock_connection_pool(monkeypatch,max_connections=1,max_channels=8)
+	client1 = pool.acquire()
+	client2 = pool.acquire()
+	dropped_client = FakeSSHClient.instances[0]
+	dropped_client.fail_next = True
+	assert client1.exec_command('sacct') == 'sacct'
+	stats = pool.get_stats()
+	assert stats['reconnects'] == 1
+	assert stats['open_connections'] == 1
+	assert len(FakeSSHClient.instances) == 2
+	# still used by client2, so not closed yet
+	assert not dropped_client.closed
+	assert client2.exec_command('squeue') == 'squeue'
+	stats = pool.get_stats()
+	assert stats['open_connections'] == 1
+	assert stats['users'] == 2
+	assert dropped_client.closed
+	assert len(FakeSSHClient.instances) == 2
+	client1.close()
+	client2.close()
+	stats = pool.get_stats()
+	assert stats['users'] == 0
+	assert stats['open_connections'] == 1
+	assert not FakeSSHClient.instances[1].closed
+
+def test_spock_connection_pool_release_after_reconnect(monkeypatch):
+	""" Test that a task that releases a connection that was 
+	dropped by another task closes it without touching the new one """
+	pool = make_fake_spock_connection_pool(monkeypatch,max_connections=1,max_channels=8)
+	client1 = pool.acquire()
+	client2 = pool.acquire()
+	FakeSSHClient.instances[0].fail_next = True
+	client1.exec_command('sacct')
+	client2.close()
+	assert FakeSSHClient.instances[0].closed
+	stats = pool.get_stats()
+	assert stats['users'] == 1
+	assert stats['open_connections'] == 1
+	client1.close()
+	assert pool.get_stats()['users'] == 0
+	assert not FakeSSHClient.instances[1].closed
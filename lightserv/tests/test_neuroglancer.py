@@ -1,4 +1,4 @@
-from flask import url_for
+from flask import url_for, current_app
 import tempfile
 import webbrowser
 from lightserv import db_lightsheet
@@ -154,3 +154,48 @@ def test_general_data_setup_form_loads_with_all_pipelines_single_tile(test_clien
 	""" Make sure there are 5 total tables - the overview, raw table,
 	blended table, downsampled table and registered table """
 	assert len(table_tags) == 5
+
+""" tests for viewer_launch_status() """
+
+def test_viewer_launch_status_unknown_session(test_client):
+	""" Test that the status of a session that was never
+	started is reported as unknown with a 404 """
+	response = test_client.get(url_for('neuroglancer.viewer_launch_status',
+		session_name='not_a_real_session'))
+	assert response.status_code == 404
+	assert response.get_json() == {'state':'unknown'}
+
+""" tests for layer_set_hash() """
+
+def test_layer_set_hash_ignores_order():
+	""" Test that two requests for the same layers in a different order
+	are given the same session, but a different viewer is not """
+	from lightserv.neuroglancer.utils import layer_set_hash
+	cv_dict_list = [
+		{'cv_path':'/jukebox/LightSheetData/a/channel488','layer_type':'image','cv_name':'488'},
+		{'cv_path':'/jukebox/LightSheetData/a/channel647','layer_type':'image','cv_name':'647'}]
+	payload = {'session_name':'abc','cv_dict_list':cv_dict_list,'ng_launcher':'ng_raw_launcher'}
+	payload_reversed = {'session_name':'def','cv_dict_list':cv_dict_list[::-1],'ng_launcher':'ng_raw_launcher'}
+	payload_other_viewer = {'session_name':'ghi','cv_dict_list':cv_dict_list,'ng_launcher':'nglauncher'}
+	assert layer_set_hash(payload) == layer_set_hash(payload_reversed)
+	assert layer_set_hash(payload) != layer_set_hash(payload_other_viewer)
+
+""" tests for parse_route_timestamp() """
+
+def test_parse_route_timestamp():
+	""" Test that the last activity of a confproxy route
+	is read as UTC """
+	from lightserv.neuroglancer.utils import parse_route_timestamp
+	assert parse_route_timestamp('1970-01-01T00:01:00.500Z') == 60.5
+
+""" tests for session_cost() """
+
+def test_session_cost_counts_cvserver_only_with_cloudvolumes(test_client):
+	""" Test that a session without cloudvolumes is charged 
+	for the neuroglancer container alone """
+	from lightserv.neuroglancer.scheduler import session_cost
+	container_memory_mb = current_app.config['NG_CONTAINER_MEMORY_MB']
+	cv_dict_list = [{'cv_path':'/jukebox/LightSheetData/a/channel488','layer_type':'image','cv_name':'488'}]
+	assert session_cost({'cv_dict_list':[]}) == (1,container_memory_mb['neuroglancer'])
+	assert session_cost({'cv_dict_list':cv_dict_list}) == \
+		(2,container_memory_mb['neuroglancer'] + container_memory_mb['cvserver'])
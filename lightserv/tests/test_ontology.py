@@ -0,0 +1,335 @@
+""" Tests for the ontology index and the ontology tools built on it """
+import os
+import json
+import pkg_resources
+import numpy as np
+import pytest
+
+DATA_PATH = pkg_resources.resource_filename('lightserv', 'data') # package name first then subdirectory next
+
+def walk_ontology(node,parent_id=None,depth=0):
+	""" Yields (node,parent id,depth) for every node of a nested ontology dictionary """
+	yield node,parent_id,depth
+	for child in node.get('children',[]):
+		yield from walk_ontology(child,parent_id=node['id'],depth=depth+1)
+
+def all_descendant_ids(node):
+	return [descendant['id'] for child in node.get('children',[]) \
+		for descendant,_,_ in walk_ontology(child)]
+
+@pytest.mark.parametrize('ontology_filename',['test_ontology.json','allen_ontology.json','PMA_ontology.json'])
+def test_ontology_index_matches_json(ontology_filename):
+	""" Test that the parent, children, descendants and depth of every region
+	in the index are the ones in the nested ontology JSON file """
+	from ontology_index import OntologyIndex
+	ontology_file = os.path.join(DATA_PATH,ontology_filename)
+	with open(ontology_file) as json_file:
+		ontology_dict = json.load(json_file)
+	index = OntologyIndex.from_json(ontology_file)
+	nodes = list(walk_ontology(ontology_dict))
+	assert len(index) == len(nodes)
+	assert index.parent(ontology_dict['id']) is None
+	for node,parent_id,depth in nodes:
+		region_id = node['id']
+		assert region_id in index
+		assert index.name(region_id) == node['name']
+		assert index.id_of(node['name']) == region_id
+		assert index.parent(region_id) == parent_id
+		assert index.depth(region_id) == depth
+		assert index.children(region_id) == [child['id'] for child in node.get('children',[])]
+		descendant_ids = all_descendant_ids(node)
+		assert index.descendants(region_id).tolist() == descendant_ids
+		for descendant_id in descendant_ids[:5]:
+			assert index.is_descendant(descendant_id,region_id)
+			assert not index.is_descendant(region_id,descendant_id)
+		if parent_id is not None:
+			assert index.ancestors(region_id)[0] == parent_id
+			assert index.ancestors(region_id)[-1] == ontology_dict['id']
+	assert index.id_of('not a region') is None
+
+def test_ontology_index_is_read_only():
+	""" Test that the views returned by the index cannot be used to change it """
+	from ontology_index import OntologyIndex
+	index = OntologyIndex.from_json(os.path.join(DATA_PATH,'test_ontology.json'))
+	descendants = index.descendants(997)
+	with pytest.raises(ValueError):
+		descendants[0] = 1
+
+def test_ontology_index_save_load(tmp_path):
+	""" Test that an index written by save() loads back the same,
+	with the id offset used by the ontology neuroglancer viewers """
+	from ontology_index import OntologyIndex
+	index = OntologyIndex.from_json(os.path.join(DATA_PATH,'allen_ontology.json'),
+		id_key='graph_order',id_offset=1)
+	index_file = str(tmp_path / 'ontology_index.npz')
+	index.save(index_file)
+	loaded_index = OntologyIndex.load(index_file)
+	assert np.array_equal(loaded_index.ids,index.ids)
+	assert np.array_equal(loaded_index.names,index.names)
+	assert np.array_equal(loaded_index.acronyms,index.acronyms)
+	assert np.array_equal(loaded_index.parent_position,index.parent_position)
+	assert np.array_equal(loaded_index.depth_array,index.depth_array)
+	assert np.array_equal(loaded_index.subtree_end,index.subtree_end)
+	root_id = int(index.ids[0])
+	assert root_id == 1 # graph_order 0 plus the offset
+	assert loaded_index.children(root_id) == index.children(root_id)
+	assert loaded_index.descendant_names(root_id) == index.descendant_names(root_id)
+
+""" Tests for remapping annotation volumes """
+
+def read_precomputed_layer(layer_dir):
+	""" Read a single scale, raw encoded precomputed layer 
+	written by remap_annotation_volume() back into a z,y,x volume """
+	import gzip
+	from lightserv.ontology import remap
+	with open(os.path.join(layer_dir,'info')) as info_file:
+		info = json.load(info_file)
+	scale = info['scales'][0]
+	size_x,size_y,size_z = scale['size']
+	chunk_x,chunk_y,chunk_z = scale['chunk_sizes'][0]
+	volume = np.zeros((size_z,size_y,size_x),dtype=info['data_type'])
+	scale_dir = os.path.join(layer_dir,scale['key'])
+	for z0 in range(0,size_z,chunk_z):
+		z1 = min(z0+chunk_z,size_z)
+		for y0 in range(0,size_y,chunk_y):
+			y1 = min(y0+chunk_y,size_y)
+			for x0 in range(0,size_x,chunk_x):
+				x1 = min(x0+chunk_x,size_x)
+				path = os.path.join(scale_dir,remap.chunk_name(x0,x1,y0,y1,z0,z1))
+				if os.path.exists(path + '.gz'):
+					with open(path + '.gz','rb') as chunk_file:
+						data = gzip.decompress(chunk_file.read())
+				else:
+					with open(path,'rb') as chunk_file:
+						data = chunk_file.read()
+				volume[z0:z1,y0:y1,x0:x1] = np.frombuffer(data,
+					dtype=volume.dtype).reshape((z1-z0,y1-y0,x1-x0))
+	return volume
+
+@pytest.fixture(scope='function')
+def test_annotation_file(tmp_path,monkeypatch):
+	""" A small annotation tif with the ids of test_ontology.json and background,
+	with the atlas store in a temporary directory. Yields (tif path, volume) """
+	import tifffile
+	from lightserv.config import BaseConfig
+	monkeypatch.setattr(BaseConfig,'ATLAS_STORE_DIR',str(tmp_path / 'atlas_store'))
+	rng = np.random.RandomState(0)
+	region_ids = np.array([0,997,8,567,688,695],dtype=np.uint16)
+	volume = region_ids[rng.randint(len(region_ids),size=(40,50,45))]
+	annotation_file = str(tmp_path / 'annotation_16bit.tif')
+	tifffile.imwrite(annotation_file,volume)
+	yield annotation_file,volume
+
+def test_make_lookup_table():
+	""" Test that the lookup table maps every reassigned id to its target
+	and every other id to itself """
+	from lightserv.ontology import remap
+	lut = remap.make_lookup_table({567:[688,695],8:[9]})
+	assert lut.dtype == np.uint16
+	assert len(lut) == 2**16
+	assert lut[688] == lut[695] == 567
+	assert lut[9] == 8
+	assert lut[567] == 567
+	assert lut[0] == 0
+	assert np.array_equal(np.delete(lut,[688,695,9]),np.delete(np.arange(2**16),[688,695,9]))
+	# wider data types only go up to the largest id
+	lut = remap.make_lookup_table({567:[688]},dtype=np.uint32,max_id=1000)
+	assert lut.dtype == np.uint32
+	assert len(lut) == 1001
+	assert lut[688] == 567
+
+@pytest.mark.parametrize('processes,compress',[(None,True),(2,False)])
+def test_remap_annotation_volume(tmp_path,test_annotation_file,processes,compress):
+	""" Test that the precomputed layer written by remap_annotation_volume() 
+	is the annotation volume with the lookup table applied,
+	over several chunks that do not fit the volume exactly """
+	from lightserv.ontology import remap
+	annotation_file,volume = test_annotation_file
+	lut = remap.make_lookup_table({567:[688,695]})
+	layer_dir = str(tmp_path / 'remapped' / remap.lookup_table_hash(lut))
+	returned_layer_dir = remap.remap_annotation_volume(annotation_file,lut,layer_dir,
+		resolution=(25000,25000,25000),processes=processes,chunk_size=(32,32,16),
+		compress=compress)
+	assert returned_layer_dir == layer_dir
+	with open(os.path.join(layer_dir,'info')) as info_file:
+		info = json.load(info_file)
+	assert info['type'] == 'segmentation'
+	assert info['data_type'] == 'uint16'
+	assert info['scales'][0]['size'] == [45,50,40]
+	assert info['scales'][0]['key'] == '25000_25000_25000'
+	remapped_volume = read_precomputed_layer(layer_dir)
+	assert np.array_equal(remapped_volume,np.take(lut,volume))
+	assert not np.isin(remapped_volume,[688,695]).any()
+	assert np.array_equal(remapped_volume == 567,np.isin(volume,[567,688,695]))
+
+""" Tests for the state of the interactive ontology graph """
+
+@pytest.fixture(scope='module')
+def test_ontology_index():
+	""" The OntologyIndex of test_ontology.json:
+	root (997) -> Basic cell groups and regions (8), Cerebrum (567) 
+	-> Cerebral cortex (688), Cortical plate (695) """
+	from lightserv.ontology import utils
+	from ontology_index import OntologyIndex
+	return OntologyIndex.from_dict(utils.test_ontology_dict)
+
+def test_encode_decode_expanded_ids(test_ontology_index):
+	""" Test that the expanded regions survive the round trip through
+	the session cookie and that a bad cookie gives the collapsed graph """
+	from lightserv.ontology import utils
+	index = utils.ontology_index
+	root_id = int(index.ids[0])
+	expanded_ids = utils.visible_expanded_ids(
+		[root_id] + index.children(root_id) + index.children(index.children(root_id)[0]))
+	encoded = utils.encode_expanded_ids(expanded_ids)
+	assert utils.decode_expanded_ids(encoded) == expanded_ids
+	assert utils.decode_expanded_ids(utils.encode_expanded_ids(())) == ()
+	assert utils.decode_expanded_ids(None) == ()
+	assert utils.decode_expanded_ids('not base64!') == ()
+	assert utils.decode_expanded_ids(encoded[:8]) == ()
+	encoded = utils.encode_expanded_ids((997,567,688),index=test_ontology_index)
+	assert utils.decode_expanded_ids(encoded,index=test_ontology_index) == (567,688,997)
+
+def test_visible_and_contracted_regions(test_ontology_index):
+	""" Test that expanded regions under a contracted region are dropped
+	and that contracting a region contracts everything below it """
+	from lightserv.ontology import utils
+	index = test_ontology_index
+	# nothing is shown below a region that is not expanded
+	assert utils.visible_expanded_ids((567,688),index=index) == ()
+	assert utils.visible_expanded_ids((997,688),index=index) == (997,)
+	assert utils.visible_expanded_ids((688,567,997),index=index) == (567,688,997)
+	assert utils.contract_region((567,688,997),567,index=index) == (997,)
+	assert utils.contract_region((567,688,997),688,index=index) == (567,997)
+	assert utils.contract_region((567,688,997),997,index=index) == ()
+
+def test_make_ID_reassignment_dict(test_ontology_index):
+	""" Test that every region hidden in the graph is assigned 
+	to its closest ancestor that is shown """
+	from lightserv.ontology import utils
+	index = test_ontology_index
+	expected_dicts = [
+		((),{997:[8,567,688,695]}),
+		((997,),{567:[688,695]}),
+		((997,567),{}),
+		# 688 is not shown when 567 is contracted
+		((997,688),{567:[688,695]}),
+	]
+	for expanded_ids,expected_dict in expected_dicts:
+		output_dict = {}
+		utils.make_ID_reassignment_dict(expanded_ids=expanded_ids,
+			output_dict=output_dict,index=index)
+		assert output_dict == expected_dict
+
+""" Tests for the hierarchy levels of the atlases """
+
+def test_depth_lookup_table(test_ontology_index):
+	""" Test that each level merges the regions below it into their ancestor
+	at that depth, and that ids which are not in the ontology are refused """
+	from lightserv.ontology import remap
+	index = test_ontology_index
+	volume_ids = np.array([0,997,8,567,688,695])
+	lut = remap.depth_lookup_table(index,0,volume_ids)
+	assert lut[volume_ids].tolist() == [0,997,997,997,997,997]
+	lut = remap.depth_lookup_table(index,1,volume_ids)
+	assert lut[volume_ids].tolist() == [0,997,8,567,567,567]
+	lut = remap.depth_lookup_table(index,2,volume_ids)
+	assert lut[volume_ids].tolist() == volume_ids.tolist()
+	assert len(lut) == 998 # only up to the largest id in the volume
+	with pytest.raises(ValueError):
+		remap.depth_lookup_table(index,1,np.array([0,567,1234]))
+	with pytest.raises(ValueError):
+		remap.check_volume_ids(index,np.array([0,70000]))
+	remap.check_volume_ids(index,volume_ids)
+
+""" Tests for the local store of the atlas volumes """
+
+def test_atlas_path_converts_changed_tifs(tmp_path,test_annotation_file):
+	""" Test that a tif is converted once, is not converted again 
+	when only its modification time changes and is converted again 
+	when its contents change """
+	import tifffile
+	from lightserv.ontology import atlas_store
+	annotation_file,volume = test_annotation_file
+	store_dir = str(tmp_path / 'atlas_store')
+	npy_path = atlas_store.atlas_path(annotation_file)
+	assert os.path.dirname(npy_path) == store_dir
+	assert np.array_equal(np.load(npy_path),volume)
+	converted_mtime_ns = os.stat(npy_path).st_mtime_ns
+	assert atlas_store.atlas_path(annotation_file) == npy_path
+
+	""" Same contents, new modification time """
+	source_stat = os.stat(annotation_file)
+	os.utime(annotation_file,ns=(source_stat.st_atime_ns,source_stat.st_mtime_ns + 10**10))
+	assert atlas_store.atlas_path(annotation_file) == npy_path
+	assert os.stat(npy_path).st_mtime_ns == converted_mtime_ns
+	registry_entry = atlas_store.read_registry(store_dir)[os.path.realpath(annotation_file)]
+	assert registry_entry['mtime_ns'] == source_stat.st_mtime_ns + 10**10
+
+	""" New contents """
+	new_volume = volume[::-1].copy()
+	tifffile.imwrite(annotation_file,new_volume)
+	new_npy_path = atlas_store.atlas_path(annotation_file)
+	assert new_npy_path != npy_path
+	assert not os.path.exists(npy_path)
+	atlas_volume = atlas_store.open_atlas(annotation_file)
+	assert np.array_equal(atlas_volume,new_volume)
+	assert not atlas_volume.flags.writeable
+	assert len(atlas_store.read_registry(store_dir)) == 1
+
+def test_remap_layer_key_changes_with_annotation_volume(test_annotation_file):
+	""" Test that the layer a lookup table is remapped to changes
+	when the annotation volume changes, so an old remap is not served """
+	import tifffile
+	from lightserv.ontology import remap
+	annotation_file,volume = test_annotation_file
+	lut = np.arange(int(volume.max())+1,dtype=volume.dtype)
+	layer_key = remap.remap_layer_key(annotation_file,lut)
+	assert remap.remap_layer_key(annotation_file,lut) == layer_key
+	assert layer_key.endswith(remap.lookup_table_hash(lut))
+	tifffile.imwrite(annotation_file,volume[::-1].copy())
+	assert remap.remap_layer_key(annotation_file,lut) != layer_key
+
+""" Tests for remapping to a collapsed ontology in the background """
+
+class FakeRedis():
+	""" Just the hash commands of redis that start_ontology_remap() uses """
+	def __init__(self):
+		self.hashes = {}
+
+	def hget(self,key,field):
+		return self.hashes.get(key,{}).get(field)
+
+	def hsetnx(self,key,field,value):
+		if field in self.hashes.get(key,{}):
+			return 0
+		self.hashes.setdefault(key,{})[field] = value
+		return 1
+
+	def hset(self,key,field,value):
+		self.hashes.setdefault(key,{})[field] = value
+
+	def delete(self,key):
+		self.hashes.pop(key,None)
+
+	def expire(self,key,seconds):
+		pass
+
+def test_start_ontology_remap_only_starts_once(monkeypatch):
+	""" Test that a remap is not started again while it is running
+	but is started again once it has failed """
+	from lightserv.ontology import tasks
+	sent = []
+	monkeypatch.setattr(tasks.remap_ontology,'delay',lambda *args: sent.append(args))
+	kv = FakeRedis()
+	start_kwargs = dict(annotation_file='annotation.tif',resolution=(25000,25000,25000))
+	tasks.start_ontology_remap(kv,(8,567),'layer',**start_kwargs)
+	assert sent == [([8,567],'layer','annotation.tif',[25000,25000,25000])]
+	assert kv.hget(tasks.remap_status_key('layer'),'state') == 'pending'
+	kv.hset(tasks.remap_status_key('layer'),'state','remapping')
+	tasks.start_ontology_remap(kv,(8,567),'layer',**start_kwargs)
+	assert len(sent) == 1
+	kv.hset(tasks.remap_status_key('layer'),'state','failed')
+	tasks.start_ontology_remap(kv,(8,567),'layer',**start_kwargs)
+	assert len(sent) == 2
+	assert kv.hget(tasks.remap_status_key('layer'),'state') == 'pending'
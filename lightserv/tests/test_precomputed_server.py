@@ -0,0 +1,207 @@
+""" Tests for the precomputed volume server of the cloudvolume containers,
+cloudvolume-docker/precomputed_server.py. It is not part of the lightserv package,
+so it is loaded from its file """
+import os
+import gzip
+import json
+import threading
+import http.client
+import importlib.util
+import pytest
+
+precomputed_server_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'..','..','cloudvolume-docker','precomputed_server.py')
+spec = importlib.util.spec_from_file_location('precomputed_server',precomputed_server_file)
+precomputed_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(precomputed_server)
+
+def test_parse_range():
+	""" Test that single byte ranges are parsed into inclusive (start,end),
+	clipped to the size, and that unsatisfiable ranges raise ValueError """
+	parse_range = precomputed_server.parse_range
+	assert parse_range(None,100) is None
+	assert parse_range('',100) is None
+	assert parse_range('bytes=0-9',100) == (0,9)
+	assert parse_range('bytes=90-',100) == (90,99)
+	assert parse_range('bytes=95-200',100) == (95,99)
+	# suffix ranges are the last bytes of the file
+	assert parse_range('bytes=-10',100) == (90,99)
+	assert parse_range('bytes=-200',100) == (0,99)
+	for range_header in ['bytes=100-','bytes=-','bytes=5-3','items=0-1','bytes=0-1,5-6']:
+		with pytest.raises(ValueError):
+			parse_range(range_header,100)
+
+def make_cached_file(size,gzipped=False,etag='etag'):
+	return precomputed_server.CachedFile(b'x'*size,gzipped,etag)
+
+def test_memory_tier_evicts_least_recently_used():
+	""" Test that the memory tier stays under its size
+	by evicting the least recently used files """
+	memory = precomputed_server.MemoryTier(max_bytes=10)
+	memory.put('a',make_cached_file(4))
+	memory.put('b',make_cached_file(4))
+	assert memory.get('a') is not None # a is now more recently used than b
+	memory.put('c',make_cached_file(4))
+	assert memory.get('b') is None
+	assert memory.get('a') is not None
+	assert memory.get('c') is not None
+	assert memory.total_bytes == 8
+	# putting a key again replaces it
+	memory.put('c',make_cached_file(2))
+	assert memory.total_bytes == 6
+	# files bigger than the whole tier are not kept
+	memory.put('d',make_cached_file(11))
+	assert memory.get('d') is None
+	assert memory.total_bytes == 6
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+	""" Test that the disk tier keeps the files with their gzipped flag and etag
+	and removes the files it evicts """
+	disk = precomputed_server.DiskTier(str(tmp_path / 'chunk_cache'),max_bytes=10)
+	disk.put('a',make_cached_file(4,gzipped=True,etag='etag-a'))
+	disk.put('b',make_cached_file(4))
+	cached = disk.get('a')
+	assert cached.data == b'x'*4
+	assert cached.gzipped
+	assert cached.etag == 'etag-a'
+	disk.put('c',make_cached_file(4))
+	assert disk.get('b') is None
+	assert not os.path.exists(disk.path('b'))
+	assert os.path.exists(disk.path('a'))
+	assert disk.total_bytes == 8
+	assert len(os.listdir(disk.directory)) == 2
+
+def test_chunk_cache_does_not_cache_info_files(tmp_path):
+	""" Test that chunks are served from the cache once read
+	but that info files are always read from disk """
+	chunk_path = tmp_path / '0-64_0-64_0-64'
+	chunk_path.write_bytes(b'first')
+	info_path = tmp_path / 'info'
+	info_path.write_text('{"scales":[]}')
+	cache = precomputed_server.ChunkCache(1024,
+		disk_directory=str(tmp_path / 'chunk_cache'),disk_bytes=1024)
+	assert cache.read(str(chunk_path)).data == b'first'
+	assert cache.read(str(info_path)).data == b'{"scales":[]}'
+	chunk_path.write_bytes(b'second')
+	info_path.write_text('{"scales":[1]}')
+	assert cache.read(str(chunk_path)).data == b'first'
+	assert cache.read(str(info_path)).data == b'{"scales":[1]}'
+	# the disk tier refills the memory tier
+	cache.memory = precomputed_server.MemoryTier(1024)
+	assert cache.read(str(chunk_path)).data == b'first'
+	assert cache.read(str(tmp_path / 'missing')) is None
+
+def test_scale_chunk_names():
+	""" Test that the chunks of a scale are clipped at the edges of the volume
+	and start at its voxel offset """
+	scale = {'size':[100,64,30],'chunk_sizes':[[64,64,32]]}
+	assert list(precomputed_server.scale_chunk_names(scale)) == [
+		'0-64_0-64_0-30','64-100_0-64_0-30']
+	scale['voxel_offset'] = [10,0,5]
+	assert list(precomputed_server.scale_chunk_names(scale)) == [
+		'10-74_0-64_5-35','74-110_0-64_5-35']
+
+def test_neighbour_chunk_names():
+	""" Test that only the neighbours inside the volume are given,
+	clipped at its edges, and that other file names have no neighbours """
+	neighbour_chunk_names = precomputed_server.neighbour_chunk_names
+	scale = {'size':[100,128,64],'chunk_sizes':[[64,64,64]]}
+	assert neighbour_chunk_names(scale,'0-64_0-64_0-64') == [
+		'64-100_0-64_0-64','0-64_64-128_0-64']
+	assert neighbour_chunk_names(scale,'64-100_64-128_0-64') == [
+		'0-64_64-128_0-64','64-100_0-64_0-64']
+	scale['voxel_offset'] = [10,0,0]
+	assert neighbour_chunk_names(scale,'10-74_0-64_0-64') == [
+		'74-110_0-64_0-64','10-74_64-128_0-64']
+	assert neighbour_chunk_names(scale,'info') == []
+
+@pytest.fixture(scope='function')
+def precomputed_server_url(tmp_path):
+	""" A precomputed server for one volume in a temporary directory,
+	with a gzipped chunk and a raw chunk. Yields (host,port,volume directory) """
+	volume_dir = tmp_path / 'volume'
+	scale_dir = volume_dir / '1000_1000_1000'
+	scale_dir.mkdir(parents=True)
+	info = {'type':'segmentation','data_type':'uint8','num_channels':1,
+		'scales':[{'key':'1000_1000_1000','size':[64,64,2],'resolution':[1000,1000,1000],
+		'voxel_offset':[0,0,0],'chunk_sizes':[[64,64,1]],'encoding':'raw'}]}
+	(volume_dir / 'info').write_text(json.dumps(info))
+	(scale_dir / '0-64_0-64_0-1.gz').write_bytes(gzip.compress(bytes(range(64))*64))
+	(scale_dir / '0-64_0-64_1-2').write_bytes(bytes(64*64))
+	(tmp_path / 'secret').write_text('outside of the volume')
+	cache = precomputed_server.ChunkCache(1024*1024)
+	server = precomputed_server.make_server(
+		precomputed_server.SingleVolumeRegistry(str(volume_dir)),port=0,cache=cache)
+	server_thread = threading.Thread(target=server.serve_forever,daemon=True)
+	server_thread.start()
+	yield 'localhost',server.server_address[1],volume_dir
+	server.shutdown()
+	server.server_close()
+
+def get(host,port,path,headers={}):
+	connection = http.client.HTTPConnection(host,port,timeout=5)
+	connection.request('GET',path,headers=headers)
+	response = connection.getresponse()
+	body = response.read()
+	connection.close()
+	return response,body
+
+def test_precomputed_server_etags(precomputed_server_url):
+	""" Test that the info file and chunks have an ETag that
+	gives a 304 when it matches, and are revalidated by the browser """
+	host,port,volume_dir = precomputed_server_url
+	response,body = get(host,port,'/info')
+	assert response.status == 200
+	assert json.loads(body)['type'] == 'segmentation'
+	assert response.getheader('Cache-Control') == 'no-cache'
+	etag = response.getheader('ETag')
+	response,body = get(host,port,'/info',{'If-None-Match':etag})
+	assert response.status == 304
+	assert body == b''
+	response,body = get(host,port,'/1000_1000_1000/0-64_0-64_1-2')
+	assert response.status == 200
+	assert body == bytes(64*64)
+	# chunk paths are not content addressed, so they are always revalidated
+	assert response.getheader('Cache-Control') == 'no-cache'
+	response,body = get(host,port,'/1000_1000_1000/0-64_0-64_1-2',
+		{'If-None-Match':response.getheader('ETag')})
+	assert response.status == 304
+
+def test_precomputed_server_gzip_and_ranges(precomputed_server_url):
+	""" Test that gzipped chunks are passed through to clients that accept gzip,
+	decompressed for the others and for range requests,
+	which are answered with the bytes of the decompressed chunk """
+	host,port,volume_dir = precomputed_server_url
+	chunk_path = '/1000_1000_1000/0-64_0-64_0-1'
+	chunk_data = bytes(range(64))*64
+	response,body = get(host,port,chunk_path,{'Accept-Encoding':'gzip'})
+	assert response.status == 200
+	assert response.getheader('Content-Encoding') == 'gzip'
+	assert gzip.decompress(body) == chunk_data
+	gzip_etag = response.getheader('ETag')
+	response,body = get(host,port,chunk_path)
+	assert response.status == 200
+	assert response.getheader('Content-Encoding') is None
+	assert body == chunk_data
+	assert response.getheader('ETag') != gzip_etag
+	response,body = get(host,port,chunk_path,
+		{'Accept-Encoding':'gzip','Range':'bytes=62-65'})
+	assert response.status == 206
+	assert response.getheader('Content-Encoding') is None
+	assert response.getheader('Content-Range') == f'bytes 62-65/{len(chunk_data)}'
+	assert body == bytes([62,63,0,1])
+	response,body = get(host,port,chunk_path,{'Range':f'bytes={len(chunk_data)}-'})
+	assert response.status == 416
+	assert response.getheader('Content-Range') == f'bytes */{len(chunk_data)}'
+
+def test_precomputed_server_not_found(precomputed_server_url):
+	""" Test that missing files and paths outside of the volume are not found """
+	host,port,volume_dir = precomputed_server_url
+	response,body = get(host,port,'/1000_1000_1000/64-128_0-64_0-1')
+	assert response.status == 404
+	response,body = get(host,port,'/../secret')
+	assert response.status == 404
+	response,body = get(host,port,'/%2E%2E/secret')
+	assert response.status == 404
+	response,body = get(host,port,'/')
+	assert response.status == 404
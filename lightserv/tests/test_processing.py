@@ -451,6 +451,59 @@ def test_determine_status_code():
 	status_code5 = determine_status_code(status_codes5)
 	assert status_code5 == 'CANCELLED'
 
+def test_parse_sacct_output():
+	""" Test that the output of a single sacct query 
+	on several jobids (including array jobs) is parsed into 
+	one pooled status per jobid
+	"""
+	from lightserv.processing.utils import parse_sacct_output
+
+	stdout_str = ('18521829_[2-5]|PENDING\n'
+				  '18521829_0|RUNNING\n'
+				  '18521829_1|COMPLETED\n'
+				  '18521830|COMPLETED\n'
+				  '18521831_0|CANCELLED by 1234\n'
+				  '18521831_1|COMPLETED\n')
+	sacct_status_dict = parse_sacct_output(stdout_str)
+	assert sacct_status_dict == {
+		'18521829':'RUNNING',
+		'18521830':'COMPLETED',
+		'18521831':'FAILED'}
+	# Empty response, e.g. if sacct does not know about the jobs
+	assert parse_sacct_output('') == {}
+
+def test_fake_slurm_backend():
+	""" Test that the fake slurm cluster backend runs the steps
+	of a pipeline one after another and cancels the remaining steps
+	when a step fails or is cancelled """
+	from lightserv.processing.cluster import FakeSlurmBackend
+	now = [0]
+	backend = FakeSlurmBackend(queue_seconds=(0,0),duration_seconds=(10,10),
+		failure_rate=0.0,clock=lambda: now[0])
+	jobids, error_response = backend.submit('pipeline.sh',n_steps=3)
+	assert len(jobids) == 3
+	assert error_response == ''
+	assert backend.status_batch(jobids) == {jobids[0]:'RUNNING',
+		jobids[1]:'PENDING',jobids[2]:'PENDING'}
+	now[0] = 15
+	assert backend.status_batch(jobids) == {jobids[0]:'COMPLETED',
+		jobids[1]:'RUNNING',jobids[2]:'PENDING'}
+	now[0] = 30
+	assert backend.status_batch(jobids)[jobids[2]] == 'COMPLETED'
+	# cancelling a running step cancels the ones that depend on it
+	jobids = backend.submit('pipeline.sh',n_steps=2)[0]
+	now[0] = 35
+	backend.cancel([jobids[0]])
+	assert backend.status_batch(jobids) == {jobids[0]:'CANCELLED',
+		jobids[1]:'CANCELLED'}
+	# jobs that fail 
+	failing_backend = FakeSlurmBackend(queue_seconds=(0,0),duration_seconds=(1,1),
+		failure_rate=1.0,clock=lambda: now[0])
+	jobids = failing_backend.submit('pipeline.sh',n_steps=2)[0]
+	now[0] = 40
+	assert failing_backend.status_batch(jobids) == {jobids[0]:'FAILED',
+		jobids[1]:'CANCELLED'}
+
 """ Test for processing tasks """
 
 def test_lightsheet_pipeline_starts(test_client,
@@ -629,6 +682,76 @@ def test_blended_precomputed_pipeline_starts(test_client,
 	print(table_contents)
 	assert len(table_contents) > 0
 
+def test_start_precomputed_pipeline_only_starts_once(test_client,
+	test_delete_spockadmin_db_contents):
+	""" Test that a second step completed event for the same 
+	light sheet pipeline job does not start the precomputed pipeline again """
+	from lightserv.processing import tasks
+	processing_pipeline_jobid_step0='12345690' # just some dummy numbers
+	processing_pipeline_jobid_step2='12345692'
+	result = tasks.start_precomputed_pipeline.run(precomputed_pipeline='blending',
+		processing_pipeline_jobid_step0=processing_pipeline_jobid_step0,
+		processing_pipeline_jobid_step2=processing_pipeline_jobid_step2)
+	assert result.startswith('Started blending pipeline')
+	start_contents = db_spockadmin.PrecomputedPipelineStart() & \
+		{'processing_pipeline_jobid_step0':processing_pipeline_jobid_step0}
+	assert len(start_contents) == 1
+	result = tasks.start_precomputed_pipeline.run(precomputed_pipeline='blending',
+		processing_pipeline_jobid_step0=processing_pipeline_jobid_step0,
+		processing_pipeline_jobid_step2=processing_pipeline_jobid_step2)
+	assert result == 'Already started'
+	assert len(start_contents) == 1
+
+def test_start_precomputed_pipeline_failure_allows_retry(test_client,
+	test_delete_spockadmin_db_contents,monkeypatch):
+	""" Test that if setting up the precomputed pipeline fails,
+	its entry in PrecomputedPipelineStart() is deleted 
+	so a later event can start it """
+	from lightserv.processing import tasks
+	import pytest
+	processing_pipeline_jobid_step0='12345693' # just some dummy numbers
+	processing_pipeline_jobid_step2='12345695'
+	def failing_make_precomputed_kwargs_list(**kwargs):
+		raise OSError("bucket not mounted")
+	monkeypatch.setattr(tasks,'make_precomputed_kwargs_list',
+		failing_make_precomputed_kwargs_list)
+	with pytest.raises(OSError):
+		tasks.start_precomputed_pipeline.run(precomputed_pipeline='registered',
+			processing_pipeline_jobid_step0=processing_pipeline_jobid_step0,
+			processing_pipeline_jobid_step2=processing_pipeline_jobid_step2)
+	start_contents = db_spockadmin.PrecomputedPipelineStart() & \
+		{'processing_pipeline_jobid_step0':processing_pipeline_jobid_step0}
+	assert len(start_contents) == 0
+	monkeypatch.undo()
+	result = tasks.start_precomputed_pipeline.run(precomputed_pipeline='registered',
+		processing_pipeline_jobid_step0=processing_pipeline_jobid_step0,
+		processing_pipeline_jobid_step2=processing_pipeline_jobid_step2)
+	assert result.startswith('Started registered pipeline')
+	assert len(start_contents) == 1
+
+def test_start_precomputed_pipeline_send_failure_allows_retry(test_client,
+	test_delete_spockadmin_db_contents,monkeypatch):
+	""" Test that if sending the precomputed pipeline tasks fails,
+	its entry in PrecomputedPipelineStart() is deleted
+	so a later event can start it """
+	from lightserv.processing import tasks
+	import pytest
+	processing_pipeline_jobid_step0='12345696' # just some dummy numbers
+	processing_pipeline_jobid_step2='12345698'
+	def failing_delay(**kwargs):
+		raise ConnectionError("broker not reachable")
+	monkeypatch.setattr(tasks,'make_precomputed_kwargs_list',
+		lambda **kwargs: [{}])
+	monkeypatch.setattr(tasks.make_precomputed_registered_data,'delay',failing_delay)
+	monkeypatch.setenv('FLASK_MODE','PROD') # so the tasks are sent
+	with pytest.raises(ConnectionError):
+		tasks.start_precomputed_pipeline.run(precomputed_pipeline='registered',
+			processing_pipeline_jobid_step0=processing_pipeline_jobid_step0,
+			processing_pipeline_jobid_step2=processing_pipeline_jobid_step2)
+	start_contents = db_spockadmin.PrecomputedPipelineStart() & \
+		{'processing_pipeline_jobid_step0':processing_pipeline_jobid_step0}
+	assert len(start_contents) == 0
+
 def test_downsized_precomputed_pipeline_starts(test_client,
 	test_delete_spockadmin_db_contents):
 	""" Test that the downsized precomputed pipeline task runs through,
@@ -860,3 +983,34 @@ def test_job_status_checker_sends_email(test_client,
 		{'username':username,'request_name':request_name}
 	sent_email = request_contents.fetch1('sent_processing_email')
 	assert sent_email == 1
+
+def test_bulk_updater_statements():
+	""" Test that the bulk updater groups updates setting the same values
+	into one UPDATE statement per batch and keeps track of the pending values """
+	from lightserv.processing.utils import BulkUpdater
+	lightsheet_dbtable = db_lightsheet.Request.ProcessingResolutionRequest
+	bulk_updater = BulkUpdater(batch_size=2)
+	for jobid in ['1','2','3']:
+		bulk_updater.add(lightsheet_dbtable,{'lightsheet_pipeline_spock_jobid':jobid},
+			{'lightsheet_pipeline_spock_job_progress':'COMPLETED'})
+	bulk_updater.add(lightsheet_dbtable,{'lightsheet_pipeline_spock_jobid':'4'},
+		{'lightsheet_pipeline_spock_job_progress':'FAILED'})
+	# adding the same update twice does not make a second row
+	bulk_updater.add(lightsheet_dbtable,{'lightsheet_pipeline_spock_jobid':'4'},
+		{'lightsheet_pipeline_spock_job_progress':'FAILED'})
+	assert len(bulk_updater) == 4
+	statements = bulk_updater.make_statements()
+	assert len(statements) == 3
+	query,args = statements[0]
+	assert query.startswith(f'UPDATE {lightsheet_dbtable().full_table_name} '
+		'SET `lightsheet_pipeline_spock_job_progress`=%s')
+	assert query.endswith('WHERE (`lightsheet_pipeline_spock_jobid`) IN ((%s),(%s))')
+	assert args == ['COMPLETED','1','2']
+	assert statements[1][1] == ['COMPLETED','3']
+	assert statements[2][1] == ['FAILED','4']
+	assert bulk_updater.pending_value(lightsheet_dbtable,
+		{'lightsheet_pipeline_spock_jobid':'4'},
+		'lightsheet_pipeline_spock_job_progress') == 'FAILED'
+	assert bulk_updater.pending_value(lightsheet_dbtable,
+		{'lightsheet_pipeline_spock_jobid':'5'},
+		'lightsheet_pipeline_spock_job_progress',default='RUNNING') == 'RUNNING'
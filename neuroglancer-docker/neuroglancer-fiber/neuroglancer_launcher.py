@@ -105,6 +105,9 @@ with viewer.txn() as s:
 viewer_dict = {"host": "nglancer", "port": "8080", "token": viewer.token}
 viewer_json_str = json.dumps(viewer_dict)
 kv.hmset(session_name,{'viewer': viewer_json_str})
+# Let lightserv know the viewer is ready, it waits on this list with BLPOP
+kv.rpush(f'{session_name}_viewer_ready', viewer_json_str)
+kv.expire(f'{session_name}_viewer_ready', 600)
 
 # Keep the viewer running
 while 1:
@@ -7,7 +7,7 @@ from time import sleep
 import redis
 import os
 import json
-import graphviz
+from ontology_index import OntologyIndex
 
 
 hosturl = os.environ['HOSTURL']
@@ -39,6 +39,31 @@ session_dict = kv.hgetall(session_name) # gets a dict of all key,val pairs in th
 logging.debug("session dict:")
 logging.debug(session_dict)
 
+""" If the atlas has pre-built hierarchy levels (see lightserv/ontology/atlas_levels.py),
+p and c swap the source of the atlas layer to the next coarser or finer level.
+Otherwise they merge and split regions with the equivalences of the layer """
+atlas_levels = [int(x) for x in session_dict.get('atlas_levels','').split(',') if x]
+atlas_levels_url = f"https://{hosturl}/cv/atlas/{session_dict.get('atlas_levels_name')}/levels"
+atlas_level_position = len(atlas_levels) - 1 # start at the finest level
+
+def switch_atlas_level(selected_layer_name,step):
+    """ Show the atlas layer at the level step above (-1) or below (+1) the current one """
+    global atlas_level_position
+    new_position = atlas_level_position + step
+    if not 0 <= new_position < len(atlas_levels):
+        with viewer.config_state.txn() as st:
+            if step < 0:
+                st.status_messages['hello'] = 'Already at the top of the hierarchy'
+            else:
+                st.status_messages['hello'] = 'Already at the bottom of the hierarchy'
+        return
+    atlas_level_position = new_position
+    level = atlas_levels[atlas_level_position]
+    with viewer.txn() as txn:
+        txn.layers[selected_layer_name] = neuroglancer.SegmentationLayer(
+            source=f"precomputed://{atlas_levels_url}/{level}")
+    with viewer.config_state.txn() as st:
+        st.status_messages['hello'] = f'Showing level {level} of the atlas hierarchy'
 
 try:
     cv_count = int(session_dict['cv_count']) # number of cloudvolumes
@@ -78,87 +103,17 @@ logging.debug("neuroglancer viewer is now available")
 viewer_dict = {"host": "nglancer", "port": "8080", "token": viewer.token}
 viewer_json_str = json.dumps(viewer_dict)
 kv.hmset(session_name,{'viewer': viewer_json_str})
-
-ontology_file = '/opt/PMA_ontology.json'
-logging.debug("loading in PMA JSON ontology file")
-
-with open(ontology_file) as json_file:
-    data = json.load(json_file)
-logging.debug("read in JSON file")
-
-""" Make the graph that will be used
-in the get_parent() function below.
-Also makes the dictionaries that are 
-used in the keybinding functions below """
-
-ontology_id_dict = {}
-ontology_name_dict = {}
-def make_id_graph(dic,graph):
-    """ Make a edge-unweighted directed graph from a dictionary
-    Representing a brain ontology
-    """
-    name = dic.get('name')
-    acronym = dic.get('acronym')
-    children = dic.get('children')
-    orig_id = dic.get('id')
-    new_id = dic.get('graph_order') + 1
-    ontology_id_dict[new_id] = name
-    ontology_name_dict[name] = new_id
-    graph.node(name,f'{acronym}: {new_id}')
-    for child in children:
-        child_name = child.get('name')
-        graph.edge(name,child_name)
-        make_id_graph(child,graph)
-    return 
-
-Gnew = graphviz.Digraph()
-make_id_graph(data,Gnew)
-
-def get_progeny(dic,input_nodename,progeny_list=None):
-    """
-    Gets all of the descendents of a given input nodename.
-    --- INPUT ---
-    dic             The dictionary representing the JSON ontology graph
-    input_nodename   The name of the region whose progeny you want to know
-    """
-    if progeny_list == None:
-        progeny_list = []
-    if input_nodename == 'root':
-        return list(ontology_name_dict.keys()) 
-        
-    name = dic.get('name')
-
-    children = dic.get('children')
-    if name == input_nodename:
-        for child in children: # child is a dict
-            child_name = child.get('name')
-            progeny_list.append(child_name)
-            get_progeny(child,input_nodename=child_name,progeny_list=progeny_list)
-        return
-    
-    for child in children:
-        child_name = child.get('name')
-        get_progeny(child,input_nodename=input_nodename,progeny_list=progeny_list)
-    return progeny_list
-
-def get_parent(graph,input_nodename):
-    if len(input_nodename.split(' ')) > 1:
-        nodename_to_search = f'"{input_nodename}"'
-    else:
-        nodename_to_search = input_nodename
-    edges_pointing_to_node=[x for x in graph.body if f'-> {nodename_to_search}' in x]
-    if len(edges_pointing_to_node) == 0:
-        return None
-    elif len(edges_pointing_to_node) > 1:
-        print("Error. There should not be more than one edge pointing to this node")
-    else:
-        parent_nodename = edges_pointing_to_node[0].split('->')[0].strip()
-        # remove the extra quotes surrounding the nodename if there is more than one word
-        if len(parent_nodename.split(' ')) > 1:
-            return parent_nodename[1:-1]
-        else:
-            return parent_nodename
-    return
+# Let lightserv know the viewer is ready, it waits on this list with BLPOP
+kv.rpush(f'{session_name}_viewer_ready', viewer_json_str)
+kv.expire(f'{session_name}_viewer_ready', 600)
+
+""" The parent, progeny, id and name lookups used in the keybinding
+functions below come from the PMA ontology index baked into this image
+(see lib/ontology_index), so they are array lookups rather than graph walks """
+index_file = '/opt/ontology_index.npz'
+logging.debug("loading in PMA ontology index")
+ontology_index = OntologyIndex.load(index_file)
+logging.debug("read in ontology index")
 
 def init_tool(s):
     logging.debug("in init_tool()")
@@ -198,6 +153,9 @@ def contract_atlas(s):
     logging.debug("Contracting atlas")
     if not selected_layer_name:
         return
+    if atlas_levels:
+        switch_atlas_level(selected_layer_name,-1)
+        return
     if named_tuple:
         with viewer.config_state.txn() as st:
             st.status_messages['hello'] = 'key p pressed: contracting atlas' 
@@ -205,23 +163,14 @@ def contract_atlas(s):
             region_id = named_tuple.value
         else:
             region_id = named_tuple.key
-        region_name = ontology_id_dict[region_id]
-        # Look up parent name and then get corresponding ID
-        parent_name = get_parent(Gnew,region_name)
-        if not parent_name:
+        # Look up the parent ID
+        parent_id = ontology_index.parent(region_id) if region_id in ontology_index else None
+        if not parent_id:
             with viewer.config_state.txn() as st:
                 st.status_messages['hello'] = 'No parent found.'
             return
-        parent_id = ontology_name_dict.get(parent_name)
-        # find all progeny of this parent
-        progeny_list = get_progeny(data,input_nodename=parent_name) # progeny names
-        # initialize our equivalence list using the id-parent relationship we just found
-        equivalence_list = [] 
-        # Get the progeny ids and include them in the equivalence list
-        for progeny_name in progeny_list:
-            progeny_id = ontology_name_dict.get(progeny_name)
-            if progeny_id:
-                equivalence_list.append((progeny_id,parent_id)) 
+        # Map all progeny of this parent onto the parent
+        equivalence_list = [(int(progeny_id),parent_id) for progeny_id in ontology_index.descendants(parent_id)]
         with viewer.txn() as txn:
             existing_equivalences = list(txn.layers[selected_layer_name].layer.equivalences.items())
             final_equivalence_list = existing_equivalences + equivalence_list
@@ -237,6 +186,9 @@ def expand_atlas(s):
     logging.debug("expanding atlas")
     if not selected_layer_name:
         return
+    if atlas_levels:
+        switch_atlas_level(selected_layer_name,1)
+        return
     
     if named_tuple:
         with viewer.config_state.txn() as st:
@@ -258,9 +210,7 @@ def expand_atlas(s):
                 then re-select the progeny and de-select the parent"""
                 selected_segments = txn.layers[selected_layer_name].segments
                 if region_id in selected_segments:
-                    region_name = ontology_id_dict[region_id]
-                    progeny_list = get_progeny(data,input_nodename=region_name) # progeny names
-                    progeny_ids = [ontology_name_dict.get(name) for name in progeny_list]
+                    progeny_ids = [int(progeny_id) for progeny_id in ontology_index.descendants(region_id)]
                     selected_segments.discard(region_id)
                     selected_segments.update(progeny_ids)
         return
@@ -3,12 +3,11 @@
 ## basic shim to load up neuroglancer in a browser:
 import neuroglancer
 import logging
-from time import sleep
 import redis
 import os
 import json
 
-hosturl = os.environ['HOSTURL']
+hosturl = os.environ.get('HOSTURL') # not set for warm containers, see below
 
 flask_mode = os.environ['FLASK_MODE']
 
@@ -37,7 +36,17 @@ logging.info("viewer token: {}".format(viewer.token))
 
 logging.info("setting viewers default volume")
 # load data from cloudvolume container:
-session_name = os.environ['SESSION_NAME'] # from the environment passed to this container when it is run
+pool_id = os.environ.get('POOL_ID')
+if pool_id:
+	# A warm container from the viewer-launcher pool. 
+	# Wait until viewer-launcher assigns it to a session
+	logging.info(f"waiting to be assigned to a session as {pool_id}")
+	_, assignment_json = kv.blpop(f'pool_assign:{pool_id}')
+	assignment = json.loads(assignment_json)
+	session_name = assignment['session_name']
+	hosturl = assignment['hosturl']
+else:
+	session_name = os.environ['SESSION_NAME'] # from the environment passed to this container when it is run
 session_dict = kv.hgetall(session_name) # gets a dict of all key,val pairs in the session
 logging.debug("session dict:")
 logging.debug(session_dict)
@@ -112,7 +121,22 @@ logging.debug("neuroglancer viewer is now available")
 viewer_dict = {"host": "nglancer", "port": "8080", "token": viewer.token}
 viewer_json_str = json.dumps(viewer_dict)
 kv.hmset(session_name,{'viewer': viewer_json_str})
+# Let lightserv know the viewer is ready, it waits on this list with BLPOP
+kv.rpush(f'{session_name}_viewer_ready', viewer_json_str)
+kv.expire(f'{session_name}_viewer_ready', 600)
 
-# Keep the viewer running
+# Keep the viewer running. When someone else opens the same layers, lightserv
+# reuses this session and asks for a new viewer with its own state through redis
+initial_state_json = viewer.state.to_json()
+viewers = [viewer] # the neuroglancer server only keeps weak references to its viewers
 while 1:
-    sleep(0.1)
+    result = kv.blpop(f'{session_name}_new_viewer', timeout=1)
+    if result is None:
+        continue
+    _, reply_key = result
+    new_viewer = neuroglancer.Viewer()
+    new_viewer.set_state(neuroglancer.ViewerState(initial_state_json))
+    viewers.append(new_viewer)
+    logging.info("new viewer token: {}".format(new_viewer.token))
+    kv.rpush(reply_key, json.dumps({"host": "nglancer", "port": "8080", "token": new_viewer.token}))
+    kv.expire(reply_key, 600)
@@ -167,6 +167,26 @@ class SmartspimCorrectedPrecomputedSpockJob(dj.Manual):
     status_step3 : enum("SUBMITTED","COMPLETED","FAILED","RUNNING","PENDING","BOOT_FAIL","CANCELLED","DEADLINE","OUT_OF_MEMORY","REQUEUED"," RESIZING","REVOKED","SUSPENDED","TIMEOUT")
     """
 
+@schema 
+class SpockJobCurrentStatus(dj.Manual):
+    definition = """    # Points to the latest row of each job in the append-only spock job tables so that the status checkers do not have to aggregate over all of their history
+    spock_dbtable                 : varchar(64) # name of the spock job table, e.g. ProcessingPipelineSpockJob
+    jobid                         : varchar(16) # the jobid in the first primary key column of that table, e.g. jobid_step0
+    ---
+    timestamp                     : timestamp   # timestamp of the latest row for this job in the spock job table
+    is_active                     : tinyint     # 1 if any step of the job can still change status, 0 otherwise
+    index(spock_dbtable,is_active)
+    """
+
+@schema 
+class PrecomputedPipelineStart(dj.Manual):
+    definition = """    # One entry per precomputed pipeline started from a light sheet pipeline job. Used so each pipeline is only ever started once
+    precomputed_pipeline            : enum("blending","registered","downsized")
+    processing_pipeline_jobid_step0 : varchar(16) # jobid_step0 in ProcessingPipelineSpockJob()
+    ---
+    timestamp = CURRENT_TIMESTAMP   : timestamp
+    """
+
 @schema 
 class BucketStorage(dj.Lookup):
     definition = """    # Keep track of storage space on LightSheetData bucket
@@ -10,4 +10,13 @@ def create_app():
 
 	app.register_blueprint(main)
 
+	""" Start the warm cloudvolume and neuroglancer containers 
+	so the first viewers do not have to wait for them """
+	from viewer_launcher.main.pool import warm_up_pools
+	from viewer_launcher.main.hosts import get_docker_hosts
+	try:
+		warm_up_pools(get_docker_hosts().values())
+	except Exception:
+		app.logger.exception("Could not warm up the container pools")
+
 	return app
\ No newline at end of file
@@ -0,0 +1,164 @@
+""" The docker hosts that viewer containers are placed on.
+
+By default every container runs on the docker daemon of this machine.
+DOCKER_HOSTS in the environment can list several daemons as JSON, e.g.:
+[{"name":"local","url":"unix://var/run/docker.sock","capacity":100},
+ {"name":"viz2","url":"tcp://viz2.pni.princeton.edu:2376","capacity":200,"tls":true}]
+where capacity is the number of viewer containers the host is meant to run.
+
+Each session is placed on the host with the lowest load relative to its capacity,
+see place_session(), and the name of the host is kept under docker_host 
+in the redis session hash so that the containers of the session are 
+looked up and killed on the right daemon later.
+
+The containers on all hosts need to reach each other, the confproxy and redis
+by container name, e.g. by attaching them to the same attachable overlay network
+of a docker swarm, and every host needs the data mounted at the same paths.
+"""
+import os
+import json
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+
+from viewer_launcher.main.pool import network, VIEWER_LABEL, DOCKER_MAX_WORKERS
+
+DEFAULT_DOCKER_HOSTS = [{'name':'local','url':'unix://var/run/docker.sock','capacity':100}]
+
+""" How long the containers being started on a host count towards its load
+if the launch never says it is done, see place_session() """
+PENDING_PLACEMENT_SECONDS = 120
+
+class DockerHost(object):
+	"""
+	---PURPOSE---
+	One docker daemon that viewer containers can be started on
+	---INPUT---
+	name        - used in the session hash and to tell the container pools apart
+	url         - of the docker daemon, e.g. tcp://viz2:2376
+	capacity    - how many viewer containers this host is meant to run
+	tls         - (optional) whether to talk to the daemon over TLS,
+				  with the certificates from the DOCKER_CERT_PATH directory
+	network     - (optional) the docker network to attach the containers to
+	"""
+	def __init__(self,name,url,capacity,tls=False,network=network):
+		self.name = name
+		self.url = url
+		self.capacity = capacity
+		self.tls = tls
+		self.network = network
+		self._client = None
+		self._client_lock = threading.Lock()
+
+	@property
+	def client(self):
+		""" The docker client of this host shared by all requests to this worker,
+		with enough pooled connections for DOCKER_MAX_WORKERS threads """
+		with self._client_lock:
+			if self._client is None:
+				if self.tls:
+					tls_config = docker.tls.TLSConfig(
+						client_cert=(os.path.join(os.environ['DOCKER_CERT_PATH'],'cert.pem'),
+							os.path.join(os.environ['DOCKER_CERT_PATH'],'key.pem')),
+						ca_cert=os.path.join(os.environ['DOCKER_CERT_PATH'],'ca.pem'),
+						verify=True)
+				else:
+					tls_config = False
+				self._client = docker.DockerClient(base_url=self.url,tls=tls_config,
+					max_pool_size=DOCKER_MAX_WORKERS)
+			return self._client
+
+	def running_container_count(self):
+		""" The number of viewer containers running on this host,
+		not counting the warm containers waiting in the pools """
+		containers = self.client.containers.list(sparse=True,filters={'label':VIEWER_LABEL})
+		return sum(1 for container in containers \
+			if not container.attrs['Names'][0].lstrip('/').startswith('warm_'))
+
+_docker_hosts = None
+_docker_hosts_lock = threading.Lock()
+
+def get_docker_hosts():
+	""" All docker hosts from DOCKER_HOSTS, as an ordered dictionary
+	of name -> DockerHost. The first one is the default host """
+	global _docker_hosts
+	with _docker_hosts_lock:
+		if _docker_hosts is None:
+			host_dicts = json.loads(os.environ['DOCKER_HOSTS']) \
+				if os.environ.get('DOCKER_HOSTS') else DEFAULT_DOCKER_HOSTS
+			_docker_hosts = OrderedDict((host_dict['name'],DockerHost(**host_dict)) \
+				for host_dict in host_dicts)
+		return _docker_hosts
+
+def get_docker_host(host_name=None):
+	""" The docker host with this name, or the default host """
+	docker_hosts = get_docker_hosts()
+	if host_name is None:
+		return next(iter(docker_hosts.values()))
+	return docker_hosts[host_name]
+
+def get_docker_client(host_name=None):
+	""" The docker client of a host, see DockerHost.client """
+	return get_docker_host(host_name).client
+
+def session_docker_host(kv,session_name):
+	""" The host a session was placed on, from its redis session hash.
+	Sessions started before there was more than one host are on the default host """
+	return get_docker_host(kv.hget(session_name,'docker_host'))
+
+def pending_placement_key(host_name):
+	return f'docker_host_pending:{host_name}'
+
+def place_session(kv,container_count):
+	"""
+	---PURPOSE---
+	Pick the docker host for the containers of a new session: 
+	the one with the lowest load relative to its capacity.
+	The load is the number of viewer containers running on the host
+	plus the ones other launches are starting there right now,
+	which are counted in redis so that launches at the same time 
+	do not all pick the same host. Call placement_done() once the
+	containers are started.
+
+	Capacity is not a hard limit, once every host is full the least 
+	loaded one is still picked. Limiting the number of sessions
+	is left to the admission control of lightserv.
+	---INPUT---
+	kv                  - redis.Redis() instance
+	container_count     - how many containers the session will start
+	---OUTPUT---
+	host                - the DockerHost
+	"""
+	docker_hosts = list(get_docker_hosts().values())
+	if len(docker_hosts) == 1:
+		host = docker_hosts[0]
+	else:
+		def relative_load(host):
+			try:
+				running = host.running_container_count()
+			except Exception:
+				logging.exception(f"Could not reach docker host {host.name}, not placing sessions on it")
+				return None
+			pending = max(int(kv.get(pending_placement_key(host.name)) or 0),0)
+			return (running + pending)/host.capacity
+		with ThreadPoolExecutor(max_workers=len(docker_hosts)) as executor:
+			loads = list(executor.map(relative_load,docker_hosts))
+		reachable = [(load,ii) for ii,load in enumerate(loads) if load is not None]
+		if not reachable:
+			raise RuntimeError("None of the docker hosts can be reached")
+		_,host_index = min(reachable)
+		host = docker_hosts[host_index]
+		logging.debug(f"Docker host loads: {dict(zip([h.name for h in docker_hosts],loads))}")
+	pipe = kv.pipeline()
+	pipe.incrby(pending_placement_key(host.name),container_count)
+	pipe.expire(pending_placement_key(host.name),PENDING_PLACEMENT_SECONDS)
+	pipe.execute()
+	return host
+
+def placement_done(kv,host,container_count):
+	""" The containers placed by place_session() are started 
+	(or failed to start), so they are counted by running_container_count() from now on """
+	kv.decrby(pending_placement_key(host.name),container_count)
@@ -0,0 +1,219 @@
+""" Pools of pre-started ("warm") precomputed server and neuroglancer containers.
+
+Starting a container from cold takes several seconds,
+most of which is spent starting python and importing neuroglancer.
+A warm container is started ahead of time with the environment variable
+POOL_ID set, which makes its launcher script wait (BLPOP on the
+redis list pool_assign:<POOL_ID>) until it is assigned to a session.
+
+Assigning a warm container renames it to the container name
+that lightserv asked for, so that the confproxy route and
+the container killer keep working with the name, and pushes
+the session configuration to the container through redis.
+"""
+import os
+import json
+import secrets
+import threading
+import logging
+
+import redis
+
+flask_mode = os.environ.get("FLASK_MODE")
+if flask_mode == 'DEV':
+	network = 'lightserv-dev'
+	image_tag = 'latest'
+elif flask_mode == 'PROD':
+	network = 'lightserv-prod'
+	image_tag = 'prod'
+elif flask_mode == 'TEST':
+	network = 'lightserv-test'
+	image_tag = 'test'
+else:
+	network = None
+	image_tag = 'latest'
+
+if flask_mode == 'TEST':
+	redis_host = 'testredis'
+else:
+	redis_host = 'redis'
+
+""" These directories are mounted read-only at the same paths in the
+precomputed server containers, so that any cloudvolume under them
+can be served without remounting. Comma-separated in the environment. """
+CV_SERVER_DATA_ROOTS = os.environ.get('CV_SERVER_DATA_ROOTS',
+	'/jukebox/LightSheetData,/jukebox/LightSheetTransfer').split(',')
+
+""" How many warm containers to keep ready of each kind.
+Set to 0 to disable the pool and always start containers from cold. """
+POOL_SIZES = {
+	'cvserver':int(os.environ.get('CV_POOL_SIZE',2)),
+	'ng_raw':int(os.environ.get('NG_POOL_SIZE',1)),
+	'ng':int(os.environ.get('NG_POOL_SIZE',1)),
+	'ng_reg':int(os.environ.get('NG_POOL_SIZE',1)),
+}
+
+""" The image for each kind of pooled container """
+POOL_IMAGES = {
+	'cvserver':f'cloudv_viewer:{image_tag}',
+	'ng_raw':f'nglancer_raw_viewer:{image_tag}',
+	'ng':f'nglancer_viewer:{image_tag}',
+	'ng_reg':f'nglancer_registration_viewer:{image_tag}',
+}
+
+""" Every container started by viewer-launcher carries this label 
+so that they can all be looked up with one API call, see find_containers() """
+VIEWER_LABEL = 'lightserv.viewer'
+
+""" How many docker API calls to make at the same time when 
+starting, looking up or killing many containers """
+DOCKER_MAX_WORKERS = int(os.environ.get('DOCKER_MAX_WORKERS',16))
+
+""" The cloudvolume image also contains the multi-volume precomputed server """
+CV_SERVER_COMMAND = ["python","/opt/precomputed_server.py"]
+
+""" The chunk cache and prefetch settings of the precomputed servers (see precomputed_server.py),
+passed on from the environment of viewer-launcher when they are set there """
+CV_SERVER_ENVIRONMENT = {name:os.environ[name] for name in 
+	('CHUNK_CACHE_MB','CHUNK_CACHE_DISK_MB','CHUNK_CACHE_DIR',
+	'PREFETCH_WORKERS','PREFETCH_COARSE_MB') if name in os.environ}
+
+def cv_server_mounts():
+	return {data_root:{'bind':data_root,'mode':'ro'} for data_root in CV_SERVER_DATA_ROOTS}
+
+def is_in_cv_server_data_roots(cv_path):
+	""" Whether the precomputed server containers can see this path """
+	return any(os.path.commonpath([cv_path,data_root]) == data_root \
+		for data_root in CV_SERVER_DATA_ROOTS)
+
+class ContainerPool(object):
+	"""
+	---PURPOSE---
+	Keeps a number of warm containers of one kind running and
+	hands them out to sessions. The pool is refilled in a background
+	thread so that assigning a container never waits on docker run.
+	---INPUT---
+	client      - docker.DockerClient() of the host the containers run on
+	kind        - one of the keys of POOL_IMAGES
+	size        - number of warm containers to keep ready
+	network     - (optional) the docker network of the containers
+	"""
+	def __init__(self,client,kind,size,network=network):
+		self.client = client
+		self.network = network
+		self.kind = kind
+		self.image = POOL_IMAGES[kind]
+		self.size = size
+		self.lock = threading.Lock()
+		self.warm_container_names = []
+		self.refilling = False
+		self.kv = redis.Redis(host=redis_host, decode_responses=True)
+
+	def start_warm_container(self):
+		""" Start one container that waits to be assigned to a session """
+		pool_id = f'warm_{self.kind}_{secrets.token_hex(4)}'
+		kwargs = dict(environment={'POOL_ID':pool_id,
+			'FLASK_MODE':os.environ.get('FLASK_MODE','')},
+			network=self.network,name=pool_id,detach=True,
+			labels={'lightserv.pool':self.kind,VIEWER_LABEL:self.kind})
+		if self.kind == 'cvserver':
+			kwargs['environment'].update(CV_SERVER_ENVIRONMENT)
+			kwargs['command'] = CV_SERVER_COMMAND
+			kwargs['volumes'] = cv_server_mounts()
+		self.client.containers.run(self.image,**kwargs)
+		logging.debug(f"Started warm {self.kind} container: {pool_id}")
+		return pool_id
+
+	def refill(self):
+		""" Start warm containers until the pool is full """
+		try:
+			while True:
+				with self.lock:
+					if len(self.warm_container_names) >= self.size:
+						break
+				pool_id = self.start_warm_container()
+				with self.lock:
+					self.warm_container_names.append(pool_id)
+		except Exception:
+			logging.exception(f"Failed to refill the {self.kind} container pool")
+		finally:
+			with self.lock:
+				self.refilling = False
+
+	def refill_in_background(self):
+		with self.lock:
+			if self.refilling or self.size <= 0:
+				return
+			self.refilling = True
+		threading.Thread(target=self.refill,daemon=True).start()
+
+	def assign(self,container_name,assignment_dict):
+		"""
+		---PURPOSE---
+		Hand a warm container to a session
+		---INPUT---
+		container_name   - the name lightserv will use for the container
+		assignment_dict  - configuration the container's launcher script needs,
+						   e.g. session_name (and hosturl for neuroglancer)
+		---OUTPUT---
+		True if a warm container was assigned, False if the pool was empty
+		and the caller needs to start a container from cold
+		"""
+		assigned = False
+		while not assigned:
+			with self.lock:
+				if not self.warm_container_names:
+					break
+				pool_id = self.warm_container_names.pop(0)
+			try:
+				container = self.client.containers.get(pool_id)
+				container.rename(container_name)
+			except Exception:
+				logging.exception(f"Warm container {pool_id} is gone, trying the next one")
+				continue
+			self.kv.rpush(f'pool_assign:{pool_id}',json.dumps(assignment_dict))
+			logging.debug(f"Assigned warm container {pool_id} as {container_name}")
+			assigned = True
+		self.refill_in_background()
+		return assigned
+
+	def remove_all(self):
+		""" Kill all warm containers that were not assigned """
+		with self.lock:
+			pool_ids = self.warm_container_names
+			self.warm_container_names = []
+		for pool_id in pool_ids:
+			try:
+				self.client.containers.get(pool_id).kill()
+			except Exception:
+				logging.debug(f"Could not kill warm container {pool_id}")
+
+_container_pools = {}
+_container_pools_lock = threading.Lock()
+
+def get_container_pool(host,kind):
+	""" Get the pool for this kind of container on a docker host 
+	(see hosts.py), creating and filling it the first time it is used.
+	Each host keeps its own POOL_SIZES warm containers """
+	pool_key = (host.name,kind)
+	with _container_pools_lock:
+		if pool_key not in _container_pools:
+			_container_pools[pool_key] = ContainerPool(host.client,kind,POOL_SIZES[kind],
+				network=host.network)
+			_container_pools[pool_key].refill_in_background()
+	return _container_pools[pool_key]
+
+def warm_up_pools(hosts):
+	""" Start filling all of the pools on each docker host, e.g. when viewer-launcher starts.
+	Warm containers left unassigned by a previous viewer-launcher are killed first
+	since no pool knows about them anymore """
+	for host in hosts:
+		try:
+			for container in host.client.containers.list(filters={'label':'lightserv.pool'}):
+				if container.name.startswith('warm_'):
+					logging.debug(f"Killing leftover warm container: {container.name} on {host.name}")
+					container.kill()
+			for kind in POOL_SIZES:
+				get_container_pool(host,kind)
+		except Exception:
+			logging.exception(f"Could not warm up the container pools on docker host {host.name}")
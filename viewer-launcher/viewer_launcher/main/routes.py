@@ -1,8 +1,19 @@
 from flask import Blueprint,request,jsonify
 import os
+import json
 import redis, docker
 import secrets
 import logging
+import threading
+import time
+import requests
+import progproxy as pp
+from concurrent.futures import ThreadPoolExecutor
+from viewer_launcher.main.pool import (get_container_pool, redis_host,
+	is_in_cv_server_data_roots, cv_server_mounts, CV_SERVER_COMMAND, CV_SERVER_ENVIRONMENT,
+	VIEWER_LABEL, DOCKER_MAX_WORKERS, POOL_IMAGES, image_tag)
+from viewer_launcher.main.hosts import (get_docker_client, get_docker_host, get_docker_hosts,
+	session_docker_host, place_session, placement_done)
 
 flask_mode = os.environ.get("FLASK_MODE")
 if flask_mode == 'DEV':
@@ -14,22 +25,37 @@ elif flask_mode == 'TEST':
 
 logging.basicConfig(level=logging.DEBUG)
 
+""" How long /session_launcher waits for the containers of a session 
+to pass their health checks if the request does not say """
+SESSION_LAUNCH_TIMEOUT_SECONDS = int(os.environ.get('SESSION_LAUNCH_TIMEOUT_SECONDS',60))
+
+""" The neuroglancer launchers that have a pool of warm containers, with the kind of pool """
+POOLED_NG_LAUNCHERS = {
+	'ng_raw_launcher':'ng_raw',
+	'nglauncher':'ng',
+	'ng_reg_launcher':'ng_reg',
+}
+
+""" The images of the other neuroglancer launchers """
+NG_LAUNCHER_IMAGES = {
+	'ng_custom_launcher':'nglancer_custom_viewer',
+	'ng_fiber_launcher':'nglancer_fiber_viewer',
+	'ng_cfos_launcher':'nglancer_cfos_viewer',
+	'ng_google_launcher':'nglancer_google',
+	'ng_ontology_launcher':'nglancer_ontology_viewer',
+	'ng_ontology_pma_launcher':'nglancer_ontology_pma_viewer',
+	'ng_sandbox_launcher':'nglancer_sandbox_viewer',
+}
+
 main = Blueprint('main',__name__)
 
 @main.route("/") 
 def base(): 
 	return "home of viewer-launcher"
 
-@main.route("/cvlauncher",methods=['POST']) 
-def cvlauncher(): 
-	logging.debug("POST request to /cvlauncher in viewer-launcher")
-
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-	cv_dict = request.json
-	cv_name = cv_dict['cv_name'] # the name of the layer in Neuroglancer
-	layer_type = cv_dict['layer_type']
+def launch_cloudvolume_container(client,cv_dict,network=network):
+	""" Start a container serving a single cloudvolume mounted at /mnt/data """
 	cv_path = cv_dict['cv_path'] # where the info file and precomputed data will live
-	session_name = cv_dict['session_name']
 	cv_container_name = cv_dict['cv_container_name'] # The name given to the docker container
 
 	cv_mounts = {
@@ -46,11 +72,300 @@ def cvlauncher():
 		cv_image = 'cloudv_viewer:test'
 	cv_container = client.containers.run(cv_image,
 								  volumes=cv_mounts,
+								  environment=CV_SERVER_ENVIRONMENT,
 								  network=network,
+								  labels={VIEWER_LABEL:'true'},
 								  name=cv_container_name,
 								  detach=True)
+	return cv_container
+
+@main.route("/cvlauncher",methods=['POST']) 
+def cvlauncher(): 
+	logging.debug("POST request to /cvlauncher in viewer-launcher")
+
+	client = get_docker_client()
+	cv_dict = request.json
+	launch_cloudvolume_container(client,cv_dict)
 	return "success"
 
+def cloudvolume_container_name(cv_dict):
+	""" The name of the container that serve_cloudvolume() 
+	serves this cloudvolume from """
+	if is_in_cv_server_data_roots(cv_dict['cv_path']):
+		return f"{cv_dict['session_name']}_cv_server"
+	return cv_dict['cv_container_name']
+
+def cloudvolume_proxytarget(cv_dict):
+	""" The confproxy target for this cloudvolume, see serve_cloudvolume() """
+	cv_container_name = cloudvolume_container_name(cv_dict)
+	if is_in_cv_server_data_roots(cv_dict['cv_path']):
+		return f"http://{cv_container_name}:1337/{cv_dict['cv_name']}"
+	return f"http://{cv_container_name}:1337"
+
+def serve_cloudvolume(host,cv_dict):
+	""" Serves a cloudvolume from the precomputed server of its session,
+	starting the server for the first cloudvolume of the session 
+	on the session's docker host (see hosts.py). 
+	All cloudvolumes of a session share one container this way.
+	Cloudvolumes the server cannot see get their own container like in /cvlauncher.
+
+	Returns a dictionary with the name of the container serving the cloudvolume
+	and the target to use for its confproxy route """
+	cv_name = cv_dict['cv_name'] # the name of the layer in Neuroglancer
+	cv_path = cv_dict['cv_path'] # where the info file and precomputed data will live
+	session_name = cv_dict['session_name']
+
+	if not is_in_cv_server_data_roots(cv_path):
+		logging.debug(f"{cv_path} is not visible to the precomputed server, using its own container")
+		launch_cloudvolume_container(host.client,cv_dict,network=host.network)
+		return dict(container_name=cloudvolume_container_name(cv_dict),
+			proxytarget=cloudvolume_proxytarget(cv_dict))
+
+	kv = redis.Redis(host=redis_host, decode_responses=True)
+	cv_server_container_name = cloudvolume_container_name(cv_dict)
+	# Register the volume before the server might look for it
+	kv.hset(f'cvserver:{session_name}',cv_name,cv_path)
+	# Only the first cloudvolume of the session starts the server
+	if kv.set(f'cvserver_started:{session_name}',cv_server_container_name,nx=True):
+		pool = get_container_pool(host,'cvserver')
+		if not pool.assign(cv_server_container_name,{'session_name':session_name}):
+			if flask_mode == 'DEV':
+				cv_image = 'cloudv_viewer:latest'
+			elif flask_mode == 'PROD':
+				cv_image = 'cloudv_viewer:prod'
+			elif flask_mode == 'TEST':
+				cv_image = 'cloudv_viewer:test'
+			host.client.containers.run(cv_image,
+				command=CV_SERVER_COMMAND,
+				environment=dict(CV_SERVER_ENVIRONMENT,SESSION_NAME=session_name),
+				volumes=cv_server_mounts(),
+				network=host.network,
+				labels={VIEWER_LABEL:'true'},
+				name=cv_server_container_name,
+				detach=True)
+		logging.debug(f"Started precomputed server {cv_server_container_name}")
+	
+	return dict(container_name=cv_server_container_name,
+		proxytarget=cloudvolume_proxytarget(cv_dict))
+
+""" Atlases are the same few static volumes for everyone, so each atlas
+is served by one long-lived precomputed server that all sessions share, 
+with its own in-memory chunk cache that is warmed when it starts """
+SHARED_ATLAS_CACHE_MB = int(os.environ.get('SHARED_ATLAS_CACHE_MB',1024))
+""" How often to check that a shared atlas server is still running """
+SHARED_ATLAS_RECHECK_SECONDS = 60
+_shared_atlas_checked = {} # atlas name -> when its server was last seen running
+_shared_atlas_lock = threading.Lock()
+
+def shared_atlas_container_name(atlas_name):
+	return f'shared_atlas_{atlas_name}'
+
+def start_shared_atlas_server(atlas_name,cv_path):
+	""" Start the shared server of an atlas on the default docker host
+	unless it is already running. The server reads its one volume from the 
+	redis hash cvserver:<container name>, like the server of a session """
+	host = get_docker_host()
+	container_name = shared_atlas_container_name(atlas_name)
+	kv = redis.Redis(host=redis_host, decode_responses=True)
+	kv.hset(f'cvserver:{container_name}',atlas_name,cv_path)
+	try:
+		container = host.client.containers.get(container_name)
+		if container.status == 'running':
+			return
+		container.remove(force=True)
+	except docker.errors.NotFound:
+		pass
+	try:
+		host.client.containers.run(POOL_IMAGES['cvserver'],
+			command=CV_SERVER_COMMAND,
+			environment=dict(CV_SERVER_ENVIRONMENT,SESSION_NAME=container_name,
+				CHUNK_CACHE_MB=SHARED_ATLAS_CACHE_MB,WARM_CACHE='1'),
+			volumes=cv_server_mounts(),
+			network=host.network,
+			labels={'lightserv.shared_atlas':atlas_name},
+			name=container_name,
+			restart_policy={'Name':'unless-stopped'},
+			detach=True)
+	except docker.errors.APIError as e:
+		if e.status_code != 409: # 409 is another worker starting it at the same time
+			raise
+	logging.debug(f"Started shared atlas server {container_name}")
+
+def serve_shared_atlas(cv_dict):
+	""" Serves an atlas (a cv_dict with shared set) from its shared server,
+	starting the server and adding its confproxy route, 
+	/cloudvols/atlas/<atlas name>, the first time.
+	The server is not part of any session so it is never killed with one.
+	Returns a dictionary like serve_cloudvolume() without a container name """
+	atlas_name = cv_dict['cv_name']
+	container_name = shared_atlas_container_name(atlas_name)
+	proxytarget = f"http://{container_name}:1337/{atlas_name}"
+	with _shared_atlas_lock:
+		if time.time() - _shared_atlas_checked.get(atlas_name,0) > SHARED_ATLAS_RECHECK_SECONDS:
+			start_shared_atlas_server(atlas_name,cv_dict['cv_path'])
+			proxy_h = pp.progproxy(target_hname='confproxy')
+			proxy_h.addroute(os.path.join('cloudvols','atlas',atlas_name),proxytarget)
+			_shared_atlas_checked[atlas_name] = time.time()
+	return dict(container_name=None,proxytarget=proxytarget)
+
+@main.route("/shared_atlas_launcher",methods=['POST']) 
+def shared_atlas_launcher(): 
+	""" Serves an atlas from its shared server outside of any session launch, 
+	e.g. for the hierarchy levels of the atlas shown by the ontology viewers. 
+	The json has the cv_name (the atlas name) and cv_path, see serve_shared_atlas() """
+	logging.debug("POST request to /shared_atlas_launcher in viewer-launcher")
+	return jsonify(serve_shared_atlas(request.json))
+
+@main.route("/cvserver_launcher",methods=['POST']) 
+def cvserver_launcher(): 
+	""" Serves one cloudvolume, see serve_cloudvolume() """
+	logging.debug("POST request to /cvserver_launcher in viewer-launcher")
+	cv_dict = request.json
+	kv = redis.Redis(host=redis_host, decode_responses=True)
+	host = session_docker_host(kv,cv_dict['session_name'])
+	return jsonify(serve_cloudvolume(host,cv_dict))
+
+@main.route("/cvserver_batch_launcher",methods=['POST']) 
+def cvserver_batch_launcher(): 
+	""" Serves a list of cloudvolumes (cv_dict_list in the json)
+	in one call, in parallel, see serve_cloudvolume().
+	Returns the results in the same order under cv_list """
+	logging.debug("POST request to /cvserver_batch_launcher in viewer-launcher")
+	cv_dict_list = request.json['cv_dict_list']
+	if not cv_dict_list:
+		return jsonify(cv_list=[])
+	kv = redis.Redis(host=redis_host, decode_responses=True)
+	host = session_docker_host(kv,cv_dict_list[0]['session_name'])
+	max_workers = min(len(cv_dict_list),DOCKER_MAX_WORKERS)
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		cv_list = list(executor.map(lambda cv_dict: serve_cloudvolume(host,cv_dict),cv_dict_list))
+	return jsonify(cv_list=cv_list)
+
+def launch_ng_container(host,ng_launcher,ng_dict):
+	""" Start the neuroglancer container of a session on a docker host, 
+	from the host's pool of warm containers if this kind of viewer has one.
+	ng_launcher is the name of the route for this kind of viewer, e.g. ng_raw_launcher,
+	and ng_dict has the ng_container_name, session_name and hosturl """
+	ng_container_name = ng_dict['ng_container_name']
+	session_name = ng_dict['session_name']
+	hosturl = ng_dict['hosturl']
+	if ng_launcher in POOLED_NG_LAUNCHERS:
+		kind = POOLED_NG_LAUNCHERS[ng_launcher]
+		pool = get_container_pool(host,kind)
+		if pool.assign(ng_container_name,{'session_name':session_name,'hosturl':hosturl}):
+			return
+		ng_image = POOL_IMAGES[kind]
+	else:
+		ng_image = f'{NG_LAUNCHER_IMAGES[ng_launcher]}:{image_tag}'
+	ng_environment = {
+		'HOSTURL':hosturl,
+		'SESSION_NAME':session_name,
+		'FLASK_MODE':os.environ['FLASK_MODE']
+	}
+	host.client.containers.run(ng_image,
+		environment=ng_environment,
+		network=host.network,
+		labels={VIEWER_LABEL:'true'},
+		name=ng_container_name,
+		detach=True)
+
+def wait_for_url(url,deadline):
+	""" Poll a url until it answers with 200 or the deadline (unix time) passes.
+	Returns whether it answered """
+	while True:
+		try:
+			if requests.get(url,timeout=2).status_code == 200:
+				return True
+		except requests.exceptions.RequestException:
+			pass
+		if time.time() > deadline:
+			return False
+		time.sleep(0.2)
+
+@main.route("/session_launcher",methods=['POST']) 
+def session_launcher(): 
+	""" Launches a whole neuroglancer session in one call:
+	all of its cloudvolumes and its neuroglancer container at the same time,
+	and registers them with the confproxy. Returns once every cloudvolume
+	serves its info file and the viewer has reported its token, 
+	so the launch takes as long as the slowest container.
+
+	The json has the session_name, the cv_dict_list (each with its cv_number, 
+	see serve_cloudvolume(), and shared set for an atlas, see serve_shared_atlas()), the ng_launcher (e.g. ng_raw_launcher), 
+	the hosturl and optionally the timeout in seconds for the health checks.
+
+	The containers are placed on one of the docker hosts, see place_session(),
+	which is recorded under docker_host in the session hash.
+
+	Returns the cloudvolume containers and proxy targets under cv_list,
+	the viewer (host, port, token) and the docker_host,
+	or a 504 with an error if the session was not healthy in time """
+	logging.debug("POST request to /session_launcher in viewer-launcher")
+	session_spec = request.json
+	session_name = session_spec['session_name']
+	cv_dict_list = session_spec['cv_dict_list']
+	ng_launcher = session_spec.get('ng_launcher','ng_custom_launcher')
+	timeout = session_spec.get('timeout',SESSION_LAUNCH_TIMEOUT_SECONDS)
+	deadline = time.time() + timeout
+	kv = redis.Redis(host=redis_host, decode_responses=True)
+
+	""" The neuroglancer container reads the layers from redis when it starts.
+	The names of all containers are known in advance, 
+	so they are written before any container is started """
+	ng_container_name = f'{session_name}_ng_container'
+	session_fields = {'cv_count':len(cv_dict_list),'ng_container_name':ng_container_name}
+	routes = {f'viewers/{session_name}':f"http://{ng_container_name}:8080/"}
+	session_cv_dict_list = [cv_dict for cv_dict in cv_dict_list if not cv_dict.get('shared')]
+	for cv_dict in cv_dict_list:
+		cv_number = cv_dict['cv_number']
+		session_fields.update({f"cv{cv_number}_name": cv_dict['cv_name'], 
+			f"layer{cv_number}_type":cv_dict['layer_type']})
+		if cv_dict.get('shared'):
+			session_fields[f"cv{cv_number}_shared"] = 1
+			continue
+		session_fields[f"cv{cv_number}_container_name"] = cloudvolume_container_name(cv_dict)
+		routes[os.path.join('cloudvols',session_name,cv_dict['cv_name'])] = cloudvolume_proxytarget(cv_dict)
+	container_count = 1 + len({cloudvolume_container_name(cv_dict) for cv_dict in session_cv_dict_list})
+	host = place_session(kv,container_count)
+	session_fields['docker_host'] = host.name
+	kv.hmset(session_name,session_fields)
+
+	ng_dict = {'ng_container_name':ng_container_name,'session_name':session_name,
+		'hosturl':session_spec['hosturl']}
+	proxy_h = pp.progproxy(target_hname='confproxy',max_workers=DOCKER_MAX_WORKERS)
+	max_workers = min(len(cv_dict_list)+2,DOCKER_MAX_WORKERS)
+	try:
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			ng_future = executor.submit(launch_ng_container,host,ng_launcher,ng_dict)
+			routes_future = executor.submit(proxy_h.addroutes,routes)
+			cv_list = list(executor.map(lambda cv_dict: serve_shared_atlas(cv_dict) \
+				if cv_dict.get('shared') else serve_cloudvolume(host,cv_dict),cv_dict_list))
+			ng_future.result()
+			routes_future.result()
+	finally:
+		placement_done(kv,host,container_count)
+	logging.debug(f"Started the containers of session {session_name} on docker host {host.name}")
+
+	""" Health checks, all at the same time """
+	info_urls = sorted({cv['proxytarget'].rstrip('/') + '/info' for cv in cv_list})
+	with ThreadPoolExecutor(max_workers=min(len(info_urls)+1,DOCKER_MAX_WORKERS)) as executor:
+		viewer_future = executor.submit(kv.blpop,f'{session_name}_viewer_ready',
+			timeout=max(1,int(deadline - time.time())))
+		info_results = list(executor.map(lambda url: wait_for_url(url,deadline),info_urls))
+		viewer_result = viewer_future.result()
+
+	unhealthy_urls = [url for url,ok in zip(info_urls,info_results) if not ok]
+	if unhealthy_urls or viewer_result is None:
+		error = f"Session {session_name} was not ready after {timeout} seconds."
+		if unhealthy_urls:
+			error += f" Cloudvolumes not serving: {unhealthy_urls}."
+		if viewer_result is None:
+			error += " The neuroglancer viewer did not start."
+		logging.error(error)
+		return jsonify(error=error), 504
+	_, viewer_json_str = viewer_result
+	return jsonify(cv_list=cv_list,viewer=json.loads(viewer_json_str),docker_host=host.name)
+
 @main.route("/corslauncher",methods=['POST']) 
 def corslauncher(): 
 	""" Launches a CORS static webserver. Useful 
@@ -58,7 +373,7 @@ def corslauncher():
 	which are not supported by cloudvolume yet """
 	logging.debug("POST request to /corslauncher in viewer-launcher")
 
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	cv_dict = request.json
 	# cv_name = cv_dict['cv_name'] # the name of the layer in Neuroglancer
 	layer_type = cv_dict['layer_type']
@@ -84,6 +399,7 @@ def corslauncher():
 								  volumes=cv_mounts,
 								  environment=cv_environment,
 								  network=network,
+								  labels={VIEWER_LABEL:'true'},
 								  name=cv_container_name,
 								  detach=True)
 	return "success"
@@ -91,88 +407,25 @@ def corslauncher():
 @main.route("/ng_raw_launcher",methods=['POST']) 
 def ng_raw_launcher(): 
 	logging.debug("POST request to /ng_raw_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-	ng_dict = request.json
-	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
-	session_name = ng_dict['session_name']
-	hosturl = ng_dict['hosturl']
-	ng_environment = {
-		'HOSTURL':hosturl,
-        'SESSION_NAME':session_name,
-        'FLASK_MODE':os.environ['FLASK_MODE']
-    }
-
-	if flask_mode == 'DEV':
-		ng_raw_image = 'nglancer_raw_viewer:latest'
-	elif flask_mode == 'PROD':
-		ng_raw_image = 'nglancer_raw_viewer:prod'
-	elif flask_mode == 'TEST':
-		ng_raw_image = 'nglancer_raw_viewer:test'
-	ng_container = client.containers.run(ng_raw_image,
-                                  environment=ng_environment,
-                                  network=network,
-                                  name=ng_container_name,
-                                  detach=True) 
+	launch_ng_container(get_docker_host(),'ng_raw_launcher',request.json)
 	return "success"
 
 @main.route("/nglauncher",methods=['POST']) 
 def nglauncher(): 
 	logging.debug("POST request to /nglauncher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-	ng_dict = request.json
-	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
-	session_name = ng_dict['session_name']
-	hosturl = ng_dict['hosturl']
-	ng_environment = {
-        'HOSTURL':hosturl,
-        'SESSION_NAME':session_name,
-        'FLASK_MODE':os.environ['FLASK_MODE']
-    }
-
-	if flask_mode == 'DEV':
-		ng_image = 'nglancer_viewer:latest'
-	elif flask_mode == 'PROD':
-		ng_image = 'nglancer_viewer:prod'
-	elif flask_mode == 'TEST':
-		ng_image = 'nglancer_viewer:test'
-	ng_container = client.containers.run(ng_image,
-                                  environment=ng_environment,
-                                  network=network,
-                                  name=ng_container_name,
-                                  detach=True) 
+	launch_ng_container(get_docker_host(),'nglauncher',request.json)
 	return "success"
 
 @main.route("/ng_reg_launcher",methods=['POST']) 
 def ng_reg_launcher(): 
 	logging.debug("POST request to /ng_reg_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-	ng_dict = request.json
-	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
-	session_name = ng_dict['session_name']
-	hosturl = ng_dict['hosturl']
-	ng_environment = {
-		'HOSTURL':hosturl,
-        'SESSION_NAME':session_name,
-        'FLASK_MODE':os.environ['FLASK_MODE']
-    }
-
-	if flask_mode == 'DEV':
-		ng_reg_image = 'nglancer_registration_viewer:latest'
-	elif flask_mode == 'PROD':
-		ng_reg_image = 'nglancer_registration_viewer:prod'
-	elif flask_mode == 'TEST':
-		ng_reg_image = 'nglancer_registration_viewer:test'
-	ng_container = client.containers.run(ng_reg_image,
-                                  environment=ng_environment,
-                                  network=network,
-                                  name=ng_container_name,
-                                  detach=True) 
+	launch_ng_container(get_docker_host(),'ng_reg_launcher',request.json)
 	return "success"
 
 @main.route("/ng_custom_launcher",methods=['POST']) 
 def ng_custom_launcher(): 
 	logging.debug("POST request to /ng_custom_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -190,6 +443,7 @@ def ng_custom_launcher():
 	ng_container = client.containers.run(ng_custom_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	return "success"
@@ -197,7 +451,7 @@ def ng_custom_launcher():
 @main.route("/ng_fiber_launcher",methods=['POST']) 
 def ng_fiber_launcher(): 
 	logging.debug("POST request to /ng_fiber_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -215,6 +469,7 @@ def ng_fiber_launcher():
 	ng_container = client.containers.run(ng_fiber_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	return "success"
@@ -222,7 +477,7 @@ def ng_fiber_launcher():
 @main.route("/ng_cfos_launcher",methods=['POST']) 
 def ng_cfos_launcher(): 
 	logging.debug("POST request to /ng_cfos_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -240,6 +495,7 @@ def ng_cfos_launcher():
 	ng_container = client.containers.run(ng_cfos_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	return "success"
@@ -247,7 +503,7 @@ def ng_cfos_launcher():
 @main.route("/ng_google_launcher",methods=['POST']) 
 def ng_google_launcher(): 
 	logging.debug("POST request to /ng_google_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -265,6 +521,7 @@ def ng_google_launcher():
 	ng_container = client.containers.run(ng_google_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	return "success"
@@ -274,7 +531,7 @@ def ng_google_launcher():
 @main.route("/ng_ontology_launcher",methods=['POST']) 
 def ng_ontology_launcher(): 
 	logging.debug("POST request to /ng_ontology_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -292,6 +549,7 @@ def ng_ontology_launcher():
 	ng_container = client.containers.run(ng_ontology_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	return "success"
@@ -300,7 +558,7 @@ def ng_ontology_launcher():
 @main.route("/ng_ontology_pma_launcher",methods=['POST']) 
 def ng_ontology_pma_launcher(): 
 	logging.debug("POST request to /ng_ontology_pma_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -318,6 +576,7 @@ def ng_ontology_pma_launcher():
 	ng_container = client.containers.run(ng_ontology_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	return "success"
@@ -326,7 +585,7 @@ def ng_ontology_pma_launcher():
 @main.route("/ng_sandbox_launcher",methods=['POST']) 
 def ng_sandbox_launcher(): 
 	logging.debug("POST request to /ng_sandbox_launcher in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	client = get_docker_client()
 	ng_dict = request.json
 	ng_container_name = ng_dict['ng_container_name'] # the name of the layer in Neuroglancer
 	session_name = ng_dict['session_name']
@@ -346,49 +605,119 @@ def ng_sandbox_launcher():
 	ng_container = client.containers.run(ng_sandbox_image,
                                   environment=ng_environment,
                                   network=network,
+                                  labels={VIEWER_LABEL:'true'},
                                   name=ng_container_name,
                                   detach=True) 
 	logging.debug("Launched container")
 	return "success"
 
+def find_containers(client,container_names):
+	""" Look up containers by name. The containers started by viewer-launcher
+	are all fetched with one API call using their label, only the others
+	(e.g. started before the label was added) are looked up one by one, in parallel.
+	Returns a dictionary of container name -> container, 
+	without the containers that do not exist """
+	container_names = set(container_names)
+	# sparse, so that docker-py does not inspect every container one by one.
+	# Sparse containers only have the attributes from the list API, with Names instead of Name
+	labeled_containers = client.containers.list(sparse=True,filters={'label':VIEWER_LABEL})
+	found_containers = {}
+	for container in labeled_containers:
+		container_name = container.attrs['Names'][0].lstrip('/')
+		if container_name in container_names:
+			found_containers[container_name] = container
+
+	def get_container(container_name):
+		try:
+			return client.containers.get(container_name)
+		except docker.errors.NotFound:
+			return None
+
+	missing_container_names = [name for name in container_names if name not in found_containers]
+	if missing_container_names:
+		max_workers = min(len(missing_container_names),DOCKER_MAX_WORKERS)
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			for container_name,container in zip(missing_container_names,
+				executor.map(get_container,missing_container_names)):
+				if container is not None:
+					found_containers[container_name] = container
+	return found_containers
+
+def request_docker_hosts(container_dict):
+	""" The docker hosts to look for containers on: the docker_host
+	in the request json (from the session hash), otherwise all of them """
+	if container_dict.get('docker_host'):
+		return [get_docker_host(container_dict['docker_host'])]
+	return list(get_docker_hosts().values())
+
+def find_containers_on_hosts(hosts,container_names):
+	""" find_containers() on each of the hosts at the same time """
+	if len(hosts) == 1:
+		return find_containers(hosts[0].client,container_names)
+	found_containers = {}
+	with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+		for host_containers in executor.map(
+			lambda host: find_containers(host.client,container_names),hosts):
+			found_containers.update(host_containers)
+	return found_containers
+
 @main.route("/container_killer",methods=['POST']) 
 def container_killer(): 
+	""" Kills containers by name (list_of_container_names in the json)
+	on the docker_host given in the json, or on any host if it is not given """
 	logging.debug("POST request to /container_killer in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
 	container_dict = request.json
 	container_names_to_kill = container_dict['list_of_container_names'] # the name of the layer in Neuroglancer
 	logging.debug("Received container names to kill:")
 	logging.debug(container_names_to_kill)
-	for container_name in container_names_to_kill:
-		container = client.containers.get(container_name)
-		logging.debug(f"Killing docker container: {container_name}")
-		container.kill()           
-		logging.debug(f"Killed the container")
+	# The cloudvolumes of a session share a container, so the same name can come up more than once
+	containers_to_kill = find_containers_on_hosts(request_docker_hosts(container_dict),
+		container_names_to_kill)
+	for container_name in set(container_names_to_kill) - set(containers_to_kill):
+		logging.debug(f"Container {container_name} is already gone")
+
+	def kill_container(container_name):
+		try:
+			containers_to_kill[container_name].kill()
+		except docker.errors.APIError:
+			logging.exception(f"Could not kill container {container_name}")
+			return
+		logging.debug(f"Killed docker container: {container_name}")
+
+	if containers_to_kill:
+		max_workers = min(len(containers_to_kill),DOCKER_MAX_WORKERS)
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			list(executor.map(kill_container,containers_to_kill))
 	
 	return "success"
 
 @main.route("/get_container_info",methods=['POST']) 
 def get_container_info(): 
-	""" Given container names returns container IDs """ 
+	""" Given container names returns container IDs,
+	looking on the docker_host in the json if it is given """ 
 	logging.debug("POST request to /get_container_info in viewer-launcher")
-	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
 	container_dict = request.json
 	container_names_to_id = container_dict['list_of_container_names'] # the name of the layer in Neuroglancer
 	logging.debug("Received container names to get info for:")
 	logging.debug(container_names_to_id)
+	found_containers = find_containers_on_hosts(request_docker_hosts(container_dict),
+		container_names_to_id)
 	container_info_dict = {}
 	for container_name in container_names_to_id:
-		try:
-			container = client.containers.get(container_name)
-		except:
+		if container_name not in found_containers:
 			logging.debug("Error retrieving the container by name. It was manually deleted")
 			container_info_dict[container_name] = {
 				'container_id':None,
 				'container_image':None
 			}
 			continue
+		container = found_containers[container_name]
 		container_id = container.short_id
-		container_image =  container.attrs['Config']['Image']
+		# sparse containers from the list API have the image name directly under Image
+		if 'Config' in container.attrs:
+			container_image = container.attrs['Config']['Image']
+		else:
+			container_image = container.attrs['Image']
 			
 		container_info_dict[container_name] = {
 			'container_id':container_id,